@@ -2,8 +2,10 @@
 
 import streamlit as st
 import torch
-from transformers import pipeline
-from config import MODEL_NAME
+from config import INFERENCE_BACKEND, MODEL_NAME, MODEL_PRECISION, PREFIX_CACHE_MAX_MB, STUB_TOKEN_DELAY_MS
+from backends import StubBackend, TransformersBackend
+from precision import load_text_generation_pipeline, resolve_precision
+from prefix_cache import PrefixCachedPipeline
 import metrics
 import database
 from ui import display_quiz_page, display_quiz_history_page, display_data_page
@@ -18,23 +20,29 @@ database.init_db()
 # --- モデルロード ---
 @st.cache_resource
 def load_model():
-    """LLMモデルをロードして返します"""
+    """LLMモデルをロードし、推論バックエンドを返します"""
     try:
+        if INFERENCE_BACKEND == "stub":
+            st.info(f"スタブのバックエンドを使用します（1トークンあたり {STUB_TOKEN_DELAY_MS}ms）")
+            return StubBackend(token_delay=STUB_TOKEN_DELAY_MS / 1000)
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        st.info(f"Using device: {device}")
-        pipe = pipeline(
-            "text-generation",
-            model=MODEL_NAME,
-            model_kwargs={"torch_dtype": torch.bfloat16},
-            device=device
-        )
+        precision = resolve_precision(MODEL_PRECISION, device)
+        st.info(f"Using device: {device} (precision: {precision})")
+        pipe = load_text_generation_pipeline(MODEL_NAME, precision, device)
+        # クイズの並列生成でバッチ推論するため、パディングは左詰めにする
+        if pipe.tokenizer.pad_token is None:
+            pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        pipe.tokenizer.padding_side = "left"
+        if PREFIX_CACHE_MAX_MB > 0:
+            # 共通の指示文の KV キャッシュを再利用してプレフィルを省略する
+            pipe = PrefixCachedPipeline(pipe, max_bytes=int(PREFIX_CACHE_MAX_MB * 1024 * 1024))
         st.success(f"モデル '{MODEL_NAME}' の読み込みに成功しました。")
-        return pipe
+        return TransformersBackend(pipe)
     except Exception as e:
         st.error(f"モデル '{MODEL_NAME}' の読み込みに失敗しました: {e}")
         return None
 
-pipe = load_model()
+backend = load_model()
 
 # --- サイドバー設定 ---
 if "score" not in st.session_state:
@@ -54,7 +62,7 @@ st.title("🧩 Gemma Quiz Game")
 st.markdown("---")
 
 if page == "クイズ":
-    display_quiz_page(pipe)
+    display_quiz_page(backend)
 elif page == "過去のクイズ":
     display_quiz_history_page()
 else:
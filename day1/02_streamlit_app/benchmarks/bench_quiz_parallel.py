@@ -0,0 +1,117 @@
+# bench_quiz_parallel.py
+"""
+クイズ生成の1プロンプト方式（single）とスロットごとの並列生成（parallel）の比較
+
+問題数ごとに、1つのプロンプトで n 問を生成する場合と、per_slot 問ずつのプロンプトを1回のバッチで
+生成する場合の所要時間（wall-clock）と、得られた問題数を比較します。
+モデルを読み込まずに試す場合はスタブのバックエンドを使います（1トークンあたりの遅延を指定）。
+
+実行例:
+    python benchmarks/bench_quiz_parallel.py --backend stub --token-delay-ms 5 --counts 5 10 20
+    python benchmarks/bench_quiz_parallel.py --backend transformers --model HuggingFaceTB/SmolLM2-135M-Instruct
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from backends import StubBackend, TransformersBackend
+from config import QUIZ_SUBTOPICS, QUIZ_TOKENS_PER_QUESTION
+from quiz_parallel import generate_in_slots
+from quiz_prompt import build_quiz_prompt, is_valid_question
+from quiz_stream import StopCriteria, stream_questions
+
+
+def load_backend(args):
+    if args.backend == "stub":
+        return StubBackend(token_delay=args.token_delay_ms / 1000)
+    import torch
+    from transformers import pipeline
+
+    pipe = pipeline("text-generation", model=args.model, torch_dtype=torch.float32, device="cpu")
+    if pipe.tokenizer.pad_token is None:
+        pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+    pipe.tokenizer.padding_side = "left"
+    return TransformersBackend(pipe)
+
+
+def run_single(backend, genre, n, args):
+    """1つのプロンプトで n 問を生成する（現在の方式）"""
+    stop = StopCriteria()
+    chunks = backend.stream(
+        build_quiz_prompt(genre, n), max_new_tokens=args.single_max_new_tokens, stopping_criteria=[stop]
+    )
+    try:
+        return list(stream_questions(chunks, n, validate=is_valid_question, stop=stop)), {}
+    except ValueError:
+        return [], {}
+
+
+def run_parallel(backend, genre, n, args):
+    """per_slot 問ずつのプロンプトを1回のバッチで生成する"""
+    stats = {}
+
+    def generate_batch(prompts, counts):
+        return backend.generate_batch(prompts, max_new_tokens=QUIZ_TOKENS_PER_QUESTION * max(counts))
+
+    try:
+        questions = list(generate_in_slots(
+            generate_batch,
+            lambda count, subtopic, variant: build_quiz_prompt(genre, count, subtopic=subtopic, variant=variant),
+            n,
+            per_slot=args.per_slot,
+            subtopics=QUIZ_SUBTOPICS.get(genre, []),
+            validate=is_valid_question,
+            max_retries=args.max_retries,
+            seed=0,
+            stats=stats,
+        ))
+    except ValueError:
+        questions = []
+    return questions, stats
+
+
+def measure(run, backend, n, args):
+    """(所要時間の中央値（秒）, 得られた問題数, 統計) を返す"""
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        questions, stats = run(backend, args.genre, n, args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), len(questions), stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クイズ生成の single / parallel 比較")
+    parser.add_argument("--backend", choices=["stub", "transformers"], default="stub")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM2-135M-Instruct")
+    parser.add_argument("--token-delay-ms", type=float, default=5.0, help="stub の1トークンあたりの遅延")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--per-slot", type=int, default=1)
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--single-max-new-tokens", type=int, default=1024)
+    parser.add_argument("--genre", default="動物")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    backend = load_backend(args)
+    print(f"バックエンド: {args.backend}  ジャンル: {args.genre}  1スロットあたり: {args.per_slot} 問")
+    backend.generate("warmup", max_new_tokens=1)  # ウォームアップ
+
+    for n in args.counts:
+        single_time, single_count, _ = measure(run_single, backend, n, args)
+        parallel_time, parallel_count, stats = measure(run_parallel, backend, n, args)
+        print(
+            f"n={n:2d}  single: {single_time * 1000:8.1f} ms ({single_count:2d} 問)  "
+            f"parallel: {parallel_time * 1000:8.1f} ms ({parallel_count:2d} 問, "
+            f"ラウンド {stats.get('rounds', 0)}, 再生成 {stats.get('failed_slots', 0)})  "
+            f"x{single_time / parallel_time:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
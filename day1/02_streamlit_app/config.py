@@ -6,5 +6,63 @@ DB_FILE = "chat_feedback.db"
 # 使用する LLM モデル名
 MODEL_NAME = "google/gemma-2-2b-jpn-it"
 
+# 推論バックエンド（"transformers" / "stub"）
+# stub はモデルを読み込まず、決定的なクイズ・採点の JSON を STUB_TOKEN_DELAY_MS（1トークンあたりのミリ秒）の遅延で返す
+INFERENCE_BACKEND = "transformers"
+STUB_TOKEN_DELAY_MS = 0
+
 # クイズ履歴用テーブル名
-QUIZ_TABLE = "quiz_history"
\ No newline at end of file
+QUIZ_TABLE = "quiz_history"
+
+# 事前生成したクイズの問題プール用テーブル名
+QUIZ_POOL_TABLE = "quiz_pool"
+
+# クイズ生成ごとの生成トークン数の記録用テーブル名（max_new_tokens の見積もりに使う）
+QUIZ_GENERATION_LOG_TABLE = "quiz_generation_log"
+
+# 出題するジャンル
+QUIZ_GENRES = ["動物", "健康", "スポーツ", "科学", "社会"]
+
+# ジャンルごとに事前生成しておく問題数（0 で事前生成しない）と、1回の補充で生成する問題数
+QUIZ_POOL_TARGET_SIZE = 20
+QUIZ_POOL_REFILL_BATCH = 5
+
+# クイズの生成方法
+# single: 1つのプロンプトで n 問を順に生成する
+# parallel: QUIZ_QUESTIONS_PER_SLOT 問ずつのスロットに分け、1回のバッチ推論でまとめて生成する
+#           （形式の崩れたスロットだけを最大 QUIZ_SLOT_MAX_RETRIES 回再生成する）
+QUIZ_GENERATION_MODE = "single"
+QUIZ_QUESTIONS_PER_SLOT = 1
+QUIZ_SLOT_MAX_RETRIES = 2
+
+# 1問あたりの生成トークン数の初期値（生成の記録が少ない間の max_new_tokens の見積もりに使う）
+QUIZ_TOKENS_PER_QUESTION = 160
+
+# max_new_tokens は過去の生成から求めた1問あたりのトークン数のこのパーセンタイルに問題数を掛けて決める
+QUIZ_TOKEN_BUDGET_PERCENTILE = 95
+# クイズ生成の max_new_tokens の上限
+QUIZ_MAX_NEW_TOKENS = 4096
+
+# スロットごとに割り当てるサブテーマ（問題の重複を避けるため）
+QUIZ_SUBTOPICS = {
+    "動物": ["哺乳類", "鳥類", "魚類", "昆虫", "爬虫類・両生類", "動物の生態", "絶滅危惧種", "ペット"],
+    "健康": ["栄養", "運動", "睡眠", "病気の予防", "人体のしくみ", "応急手当", "メンタルヘルス", "薬"],
+    "スポーツ": ["サッカー", "野球", "オリンピック", "テニス", "陸上競技", "水泳", "ルール", "記録"],
+    "科学": ["物理", "化学", "生物", "天文", "地学", "発明・発見", "単位", "科学者"],
+    "社会": ["日本の地理", "世界の地理", "日本の歴史", "世界の歴史", "政治", "経済", "国際機関", "文化"],
+}
+
+# クイズ生成・採点の出力を JSON のスキーマに沿うよう制約してデコードするか（transformers のバックエンドのみ）
+CONSTRAINED_DECODING = False
+
+# 共通の前置部（クイズ生成の指示文など）に対する KV キャッシュの上限（MB、0 で無効）
+PREFIX_CACHE_MAX_MB = 256
+
+# モデル読み込み時の精度（"auto" / "fp32" / "bf16" / "int8"）
+# auto は GPU なら bf16、CPU なら bf16 命令の有無で bf16 / fp32 を選ぶ。int8 は CPU で線形層を動的量子化する
+MODEL_PRECISION = "auto"
+
+# プロンプトの長さの制限（トークン数）。MAX_CONTEXT_TOKENS = 0 でモデルのコンテキスト長を使う
+# 上限を超えたプロンプトの扱い: "reject"（エラーにする）/ "head" / "tail" / "middle"（その部分を削って切り詰める）
+MAX_CONTEXT_TOKENS = 0
+PROMPT_TRUNCATION = "reject"
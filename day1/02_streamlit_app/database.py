@@ -4,8 +4,10 @@ import sqlite3
 import pandas as pd
 from datetime import datetime
 import streamlit as st
-from config import DB_FILE, QUIZ_TABLE
+import json
+from config import DB_FILE, QUIZ_TABLE, QUIZ_POOL_TABLE, QUIZ_GENERATION_LOG_TABLE
 from metrics import calculate_metrics
+from quiz_prompt import question_key
 
 # --- テーブル名定義 ---
 CHAT_TABLE = "chat_history"
@@ -42,6 +44,30 @@ CREATE TABLE IF NOT EXISTS {QUIZ_TABLE} (
 );
 """
 
+# 事前生成したクイズの問題プール（1行1問、question/options/answer の JSON）
+QUIZ_POOL_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {QUIZ_POOL_TABLE} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    genre TEXT NOT NULL,
+    quiz_json TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# クイズ生成ごとの問題数と生成トークン数（truncated: max_new_tokens に達して問題がそろわなかった）
+QUIZ_GENERATION_LOG_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {QUIZ_GENERATION_LOG_TABLE} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    genre TEXT NOT NULL,
+    requested INTEGER NOT NULL,
+    parsed INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    max_new_tokens INTEGER NOT NULL,
+    truncated INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
 def init_db():
     """データベースと各テーブルを初期化する"""
     try:
@@ -51,6 +77,10 @@ def init_db():
         c.execute(CHAT_SCHEMA)
         # クイズ履歴用テーブル
         c.execute(QUIZ_SCHEMA)
+        # クイズの問題プール用テーブル
+        c.execute(QUIZ_POOL_SCHEMA)
+        # クイズ生成の記録用テーブル
+        c.execute(QUIZ_GENERATION_LOG_SCHEMA)
         conn.commit()
     except Exception as e:
         st.error(f"データベースの初期化に失敗しました: {e}")
@@ -180,4 +210,106 @@ def get_quiz_history():
         st.error(f"クイズ履歴の取得中にエラーが発生しました: {e}")
         return []
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# --- クイズの問題プール操作関数 ---
+# バックグラウンドの補充スレッドからも呼ばれるため、st は使わずに例外を呼び出し元へ送出する
+
+def add_pool_questions(genre, questions):
+    """
+    事前生成した問題をプールに追加する（プールに既にある問題・同じ問題の繰り返しは追加しない）
+
+    Returns:
+        int: 追加した問題数
+    """
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(f"SELECT quiz_json FROM {QUIZ_POOL_TABLE} WHERE genre = ?", (genre,)).fetchall()
+        seen = {question_key(json.loads(row[0])) for row in rows}
+        new_rows = []
+        for q in questions:
+            key = question_key(q)
+            if key not in seen:
+                seen.add(key)
+                new_rows.append((genre, json.dumps(q, ensure_ascii=False)))
+        conn.executemany(f"INSERT INTO {QUIZ_POOL_TABLE} (genre, quiz_json) VALUES (?, ?)", new_rows)
+        conn.execute("COMMIT")
+        return len(new_rows)
+    finally:
+        conn.close()
+
+def take_pool_questions(genre, n):
+    """
+    プールから古い順に、重複しない最大 n 問を取り出す（取り出した問題と、その重複はプールから削除する）
+    """
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    try:
+        # 同時に取り出した場合に同じ問題を二重に出題しないよう、書き込みロックを取ってから読む
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            f"SELECT id, quiz_json FROM {QUIZ_POOL_TABLE} WHERE genre = ? ORDER BY id", (genre,)
+        ).fetchall()
+        questions = []
+        seen = set()
+        removed = []
+        for row_id, quiz_json in rows:
+            q = json.loads(quiz_json)
+            key = question_key(q)
+            if key in seen:
+                removed.append(row_id)
+                continue
+            if len(questions) >= n:
+                continue
+            seen.add(key)
+            questions.append(q)
+            removed.append(row_id)
+        conn.executemany(f"DELETE FROM {QUIZ_POOL_TABLE} WHERE id = ?", [(row_id,) for row_id in removed])
+        conn.execute("COMMIT")
+        return questions
+    finally:
+        conn.close()
+
+def get_pool_depths():
+    """
+    ジャンルごとのプールの問題数を返す
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        rows = conn.execute(f"SELECT genre, COUNT(*) FROM {QUIZ_POOL_TABLE} GROUP BY genre").fetchall()
+        return dict(rows)
+    finally:
+        conn.close()
+
+# --- クイズ生成の記録操作関数 ---
+# 問題プールの補充スレッドからも呼ばれるため、st は使わずに例外を呼び出し元へ送出する
+
+def add_generation_log(genre, requested, parsed, tokens, max_new_tokens, truncated):
+    """
+    クイズ生成1回分の問題数と生成トークン数を記録する
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        conn.execute(
+            f"INSERT INTO {QUIZ_GENERATION_LOG_TABLE} (genre, requested, parsed, tokens, max_new_tokens, truncated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (genre, requested, parsed, tokens, max_new_tokens, int(truncated)),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_generation_log(genre=None, limit=100):
+    """
+    新しい順に最大 limit 件の (requested, parsed, tokens, max_new_tokens, truncated) を返す（genre=None で全ジャンル）
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        query = f"SELECT requested, parsed, tokens, max_new_tokens, truncated FROM {QUIZ_GENERATION_LOG_TABLE}"
+        params = ()
+        if genre is not None:
+            query += " WHERE genre = ?"
+            params = (genre,)
+        return conn.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,296 @@
+# json_schema.py
+"""
+スキーマに沿った JSON だけを生成させる制約付きデコード
+
+クイズ（question・4つの options・整数の answer）と採点結果（is_correct・correct_answer）の JSON は
+キーの並びと区切り文字が決まっており、自由に書けるのは文字列の中身と正解の番号だけです。
+スキーマをリテラル・文字列・選択肢の並び（segments）で表し、各ステップでスキーマに続けられない
+トークンのロジットを -inf にします。出力は必ず形式の正しい JSON になり、閉じ括弧の後は EOS だけを許すので
+そこで生成が終わります。
+
+- TokenVocabulary: トークンごとの文字列と、接頭辞での検索に使う索引（トークナイザーごとに1回だけ作成）
+- SchemaConstraint: スキーマの状態ごとに続けられるトークンの計算
+- JsonSchemaLogitsProcessor: generate の logits_processor に渡す制約
+"""
+
+import bisect
+
+# 文字列の最大文字数（超えた場合は閉じる " だけを許す）
+DEFAULT_MAX_STRING_CHARS = 200
+
+STRING = ("string",)
+
+
+def choice(chars):
+    """chars のいずれか1文字"""
+    return ("choice", chars)
+
+
+def _normalize(parts):
+    """文字列をリテラルに変換し、隣り合うリテラルを結合した segments を返す"""
+    segments = []
+    for part in parts:
+        if isinstance(part, str):
+            if segments and segments[-1][0] == "literal":
+                segments[-1] = ("literal", segments[-1][1] + part)
+            else:
+                segments.append(("literal", part))
+        else:
+            segments.append(part)
+    return segments
+
+
+def quiz_schema(n):
+    """n 問のクイズの JSON リスト（[{"question": ..., "options": [4つ], "answer": 0-3}, ...]）"""
+    item = ['{"question": "', STRING, '", "options": ["']
+    for i in range(4):
+        item += [STRING, '", "' if i < 3 else '"], "answer": ']
+    item += [choice("0123"), "}"]
+    parts = ["["]
+    for i in range(n):
+        parts += item + ([", "] if i < n - 1 else [])
+    return _normalize(parts + ["]"])
+
+
+def grading_schema():
+    """採点結果の JSON（{"is_correct": 0 or 1, "correct_answer": "..."}）"""
+    return _normalize(['{"is_correct": ', choice("01"), ', "correct_answer": "', STRING, '"}'])
+
+
+def _string_char_ok(ch):
+    return ch not in '"\\' and ch >= " "
+
+
+def consume(segments, state, text, max_string_chars=DEFAULT_MAX_STRING_CHARS):
+    """
+    状態 state=(segment の位置, segment 内の位置) から text を読み進めた状態を返す（続けられなければ None）
+
+    文字列は空にできず、" で閉じます（" は次のリテラルの先頭の文字として読みます）。
+    """
+    seg, offset = state
+    i = 0
+    while i < len(text):
+        if seg >= len(segments):
+            return None
+        kind = segments[seg][0]
+        ch = text[i]
+        if kind == "literal":
+            literal = segments[seg][1]
+            if ch != literal[offset]:
+                return None
+            offset += 1
+            if offset == len(literal):
+                seg, offset = seg + 1, 0
+        elif kind == "choice":
+            if ch not in segments[seg][1]:
+                return None
+            seg, offset = seg + 1, 0
+        else:
+            if ch == '"':
+                if offset == 0:
+                    return None
+                seg, offset = seg + 1, 0
+                continue  # 次のリテラルとして読み直す
+            if not _string_char_ok(ch) or offset >= max_string_chars:
+                return None
+            offset += 1
+        i += 1
+    return seg, offset
+
+
+class TokenVocabulary:
+    """
+    トークン ID ごとの文字列と、制約の計算に使う索引
+
+    語彙全体のデコードに時間がかかるため、トークナイザーごとに1回だけ作成して使い回してください。
+    """
+
+    def __init__(self, tokenizer, eos_token_ids=None):
+        self.texts = self._token_texts(tokenizer)
+        if eos_token_ids is None:
+            eos_token_ids = tokenizer.eos_token_id
+        if isinstance(eos_token_ids, int):
+            eos_token_ids = [eos_token_ids]
+        self.eos_token_ids = [i for i in eos_token_ids if i is not None]
+
+        # 接頭辞での検索用に文字列でソートした (文字列, ID)
+        entries = sorted((text, i) for i, text in enumerate(self.texts) if text)
+        self._sorted_texts = [text for text, _ in entries]
+        self._sorted_ids = [i for _, i in entries]
+        # 文字列の中にそのまま置けるトークンと、" を含むトークン
+        self.plain_ids = [i for i, text in enumerate(self.texts) if text and all(_string_char_ok(c) for c in text)]
+        self.plain_lengths = [len(self.texts[i]) for i in self.plain_ids]
+        self.quote_ids = [i for i, text in enumerate(self.texts) if '"' in text]
+        # スキーマごとの許すトークンの計算結果（リクエストをまたいで再利用する）
+        self.schema_cache = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    @staticmethod
+    def _token_texts(tokenizer):
+        """
+        トークンごとの文字列（単独でデコードできないトークン・特殊トークンは空文字列）
+
+        SentencePiece 系のトークナイザーは単独でデコードすると先頭の空白が落ちるため、
+        基準のトークンの後ろに並べてデコードし、基準の部分を取り除きます。
+        """
+        size = len(tokenizer)
+        special = set(getattr(tokenizer, "all_special_ids", []))
+        anchor = tokenizer.encode("a", add_special_tokens=False)[-1]
+        base = tokenizer.decode([anchor])
+        decoded = tokenizer.batch_decode([[anchor, i] for i in range(size)])
+        texts = []
+        for i, text in enumerate(decoded):
+            if i in special or not text.startswith(base) or "�" in text:
+                texts.append("")
+            else:
+                texts.append(text[len(base):])
+        return texts
+
+    def with_prefix(self, prefix):
+        """文字列が prefix で始まるトークンの ID"""
+        start = bisect.bisect_left(self._sorted_texts, prefix)
+        ids = []
+        for j in range(start, len(self._sorted_texts)):
+            if not self._sorted_texts[j].startswith(prefix):
+                break
+            ids.append(self._sorted_ids[j])
+        return ids
+
+    def exact(self, text):
+        """文字列が text と一致するトークンの ID"""
+        start = bisect.bisect_left(self._sorted_texts, text)
+        ids = []
+        for j in range(start, len(self._sorted_texts)):
+            if self._sorted_texts[j] != text:
+                break
+            ids.append(self._sorted_ids[j])
+        return ids
+
+
+class SchemaConstraint:
+    """
+    1つのスキーマについて、状態ごとに続けられるトークンを求める
+
+    計算結果は TokenVocabulary にスキーマごとに保存し、リクエストをまたいで再利用します。
+    """
+
+    def __init__(self, vocabulary, segments, max_string_chars=DEFAULT_MAX_STRING_CHARS):
+        self.vocabulary = vocabulary
+        self.segments = segments
+        self.max_string_chars = max_string_chars
+        # リテラル・選択肢の状態 -> 許すトークン、文字列の segment -> [(" を含むトークン, " より前の文字数)]
+        self._fixed_cache, self._quote_cache = vocabulary.schema_cache.setdefault(
+            (tuple(segments), max_string_chars), ({}, {})
+        )
+
+    def consume(self, state, text):
+        return consume(self.segments, state, text, self.max_string_chars)
+
+    def _continuations(self, state, prefix_ids):
+        return [i for i in prefix_ids if self.consume(state, self.vocabulary.texts[i]) is not None]
+
+    def allowed_tokens(self, state):
+        """
+        state から続けられるトークンを (ids, limit) で返す
+
+        ids は個別に許すトークンの ID です。文字列の中では、" や制御文字を含まないトークン
+        （TokenVocabulary.plain_ids）も文字数が limit 以下であれば許します（文字列の外では limit=0）。
+        """
+        if state is None or state[0] >= len(self.segments):
+            return list(self.vocabulary.eos_token_ids), 0
+        seg, offset = state
+        kind = self.segments[seg][0]
+        if kind in ("literal", "choice"):
+            if state not in self._fixed_cache:
+                vocab = self.vocabulary
+                if kind == "literal":
+                    rest = self.segments[seg][1][offset:]
+                    # リテラルの途中までのトークンと、リテラルを越えて続くトークン
+                    ids = [i for k in range(1, len(rest)) for i in vocab.exact(rest[:k])]
+                    ids += self._continuations(state, vocab.with_prefix(rest))
+                else:
+                    ids = [i for c in self.segments[seg][1] for i in self._continuations(state, vocab.with_prefix(c))]
+                self._fixed_cache[state] = ids
+            return self._fixed_cache[state], 0
+
+        if seg not in self._quote_cache:
+            entries = []
+            for i in self.vocabulary.quote_ids:
+                text = self.vocabulary.texts[i]
+                body = text[:text.index('"')]
+                if all(_string_char_ok(c) for c in body) and self.consume((seg, 1), text) is not None:
+                    entries.append((i, len(body)))
+            self._quote_cache[seg] = entries
+        remaining = self.max_string_chars - offset
+        ids = [i for i, body_len in self._quote_cache[seg] if body_len <= remaining and offset + body_len > 0]
+        return ids, remaining
+
+
+class JsonSchemaLogitsProcessor:
+    """
+    generate の logits_processor に渡す制約（スキーマに続けられないトークンを禁止する）
+
+    最初の呼び出し時の入力をプロンプトとみなし、以降は生成されたトークンで行ごとの状態を進めます。
+    バッチの各行は独立に制約します（row_segments を渡すと行ごとに別のスキーマを使います）。
+    """
+
+    def __init__(self, vocabulary, segments=None, max_string_chars=DEFAULT_MAX_STRING_CHARS, row_segments=None):
+        self.vocabulary = vocabulary
+        self.segments = segments
+        self.max_string_chars = max_string_chars
+        self._constraints = None
+        if row_segments is not None:
+            self._constraints = [SchemaConstraint(vocabulary, seg, max_string_chars) for seg in row_segments]
+        self._states = None
+        self._length = None  # 前回の呼び出し時の入力長
+
+    def update(self, new_tokens):
+        """
+        行ごとに前回の呼び出し以降に生成されたトークン ID のリストで状態を進める（torch を使わない部分）
+
+        最初の呼び出しは生成の開始（プロンプトのみ）として扱い、各行の状態を先頭にします。
+        """
+        if self._states is None:
+            rows = len(new_tokens)
+            if self._constraints is None:
+                self._constraints = [SchemaConstraint(self.vocabulary, self.segments, self.max_string_chars)] * rows
+            self._states = [(0, 0)] * rows
+            return
+        for row, tokens in enumerate(new_tokens):
+            for token_id in tokens:
+                state = self._states[row]
+                if state is not None:
+                    text = self.vocabulary.texts[token_id] if token_id < len(self.vocabulary) else ""
+                    state = self._constraints[row].consume(state, text) if text else None
+                self._states[row] = state
+
+    def allowed(self, row):
+        """行 row で次に許すトークンを (ids, limit) で返す（SchemaConstraint.allowed_tokens を参照）"""
+        ids, limit = self._constraints[row].allowed_tokens(self._states[row])
+        if not ids and limit <= 0:
+            # 語彙にスキーマを続けられるトークンが無い場合は生成を終える
+            ids = list(self.vocabulary.eos_token_ids)
+        return ids, limit
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        if self._length is None:
+            self.update([[] for _ in range(input_ids.shape[0])])
+        else:
+            self.update(input_ids[:, self._length:].tolist())
+        self._length = input_ids.shape[1]
+        mask = torch.full_like(scores, float("-inf"))
+        plain_ids = None
+        for row in range(input_ids.shape[0]):
+            ids, limit = self.allowed(row)
+            if limit > 0:
+                if plain_ids is None:
+                    plain_ids = torch.tensor(self.vocabulary.plain_ids, device=scores.device)
+                    plain_lengths = torch.tensor(self.vocabulary.plain_lengths, device=scores.device)
+                mask[row, plain_ids[plain_lengths <= limit]] = 0
+            if ids:
+                mask[row, torch.tensor(ids, device=scores.device)] = 0
+        return scores + mask
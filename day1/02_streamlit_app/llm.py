@@ -4,102 +4,243 @@ import re
 import json
 import torch
 import streamlit as st
-from transformers import pipeline
-from config import MODEL_NAME
+from config import (
+    CONSTRAINED_DECODING, INFERENCE_BACKEND, MAX_CONTEXT_TOKENS, MODEL_NAME, MODEL_PRECISION, PREFIX_CACHE_MAX_MB,
+    PROMPT_TRUNCATION, QUIZ_GENERATION_MODE, QUIZ_GENRES, QUIZ_MAX_NEW_TOKENS, QUIZ_POOL_REFILL_BATCH,
+    QUIZ_POOL_TARGET_SIZE, QUIZ_QUESTIONS_PER_SLOT, QUIZ_SLOT_MAX_RETRIES, QUIZ_SUBTOPICS,
+    QUIZ_TOKEN_BUDGET_PERCENTILE, QUIZ_TOKENS_PER_QUESTION, STUB_TOKEN_DELAY_MS,
+)
+import database
+from backends import StubBackend, TransformersBackend
+from precision import load_text_generation_pipeline, resolve_precision
+from json_schema import JsonSchemaLogitsProcessor, TokenVocabulary, grading_schema, quiz_schema
+from prefix_cache import PrefixCachedPipeline
+from prompt_guard import PromptGuard, PromptTooLongError, model_context_length
+from quiz_parallel import generate_in_slots, parse_questions
+from quiz_pool import QuizPool
+from quiz_prompt import build_quiz_prompt, is_valid_question
+from quiz_stream import QuizGeneration, StopCriteria, stream_questions
+from token_budget import TokenBudgetEstimator
+
+# クイズ生成の max_new_tokens の見積もり（生成の記録は SQLite に保存し、補充スレッドからも使う）
+token_budget = TokenBudgetEstimator(
+    database.get_generation_log,
+    database.add_generation_log,
+    default_per_question=QUIZ_TOKENS_PER_QUESTION,
+    percentile=QUIZ_TOKEN_BUDGET_PERCENTILE,
+    max_tokens=QUIZ_MAX_NEW_TOKENS,
+)
 
 @st.cache_resource
 def load_model():
     """
-    LLMモデルをロードして返します
+    LLMモデルをロードし、推論バックエンド（backends.InferenceBackend）を返します
     """
     try:
+        if INFERENCE_BACKEND == "stub":
+            st.info(f"スタブのバックエンドを使用します（1トークンあたり {STUB_TOKEN_DELAY_MS}ms）")
+            return StubBackend(token_delay=STUB_TOKEN_DELAY_MS / 1000)
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        st.info(f"Using device: {device}")
-        pipe = pipeline(
-            "text-generation",
-            model=MODEL_NAME,
-            model_kwargs={"torch_dtype": torch.bfloat16},
-            device=device
-        )
+        precision = resolve_precision(MODEL_PRECISION, device)
+        st.info(f"Using device: {device} (precision: {precision})")
+        pipe = load_text_generation_pipeline(MODEL_NAME, precision, device)
+        # クイズの並列生成でバッチ推論するため、パディングは左詰めにする
+        if pipe.tokenizer.pad_token is None:
+            pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        pipe.tokenizer.padding_side = "left"
+        if PREFIX_CACHE_MAX_MB > 0:
+            # 共通の指示文の KV キャッシュを再利用してプレフィルを省略する
+            pipe = PrefixCachedPipeline(pipe, max_bytes=int(PREFIX_CACHE_MAX_MB * 1024 * 1024))
         st.success(f"モデル '{MODEL_NAME}' の読み込みに成功しました。")
-        return pipe
+        return TransformersBackend(pipe)
     except Exception as e:
         st.error(f"モデル '{MODEL_NAME}' の読み込みに失敗しました: {e}")
         return None
 
 
-def generate_quiz(pipe, genre: str, n: int):
+@st.cache_resource
+def load_prompt_guard(_backend):
     """
-    ジャンル genre で n 問の一般知識クイズを生成し、
-    選択肢付き JSON リストを返します。
-    フォーマット:
-      [
-        {
-          "question": "...",
-          "options": ["A","B","C","D"],
-          "answer": 0  # options の正解インデックス
-        }, ...
-      ]
+    モデルのコンテキスト長に合わせた PromptGuard を返します
+    （_backend は st.cache_resource のハッシュ対象から外すため先頭に _ を付けています）
     """
-    if pipe is None:
-        st.error("モデルがロードされていないため、クイズを生成できません。")
-        return []
-
-    # プロンプト文を厳格化（不要な文章を出さないよう制約）
-    prompt = (
-        f"ジャンル「{genre}」の一般知識に関する4択クイズを{n}問、JSON形式のリストで出力してください。\n"
-        "以下の形式に従い、JSONリスト **のみ** を返してください。説明文や例、見出しを含めないでください。\n"
-        "[\n"
-        "  {\"question\": \"日本の首都はどこですか？\", \"options\": [\"大阪\", \"京都\", \"東京\", \"名古屋\"], \"answer\": 2},\n"
-        "  {\"question\": \"光の速さは？\", \"options\": [\"3万km/s\", \"30万km/s\", \"300万km/s\", \"3000km/s\"], \"answer\": 1}\n"
-        "]"
+    guard = PromptGuard(
+        _backend.tokenizer,
+        max_context=MAX_CONTEXT_TOKENS or model_context_length(_backend.pipe),
+        strategy=PROMPT_TRUNCATION,
     )
+    if isinstance(_backend.pipe, PrefixCachedPipeline):
+        # 長さの確認で得たトークン列を生成時にも使う
+        _backend.pipe.token_cache = guard.cache
+    return guard
+
 
+@st.cache_resource
+def load_token_vocabulary(_backend):
+    """
+    制約付きデコードに使う TokenVocabulary を返します（無効な場合やスタブのバックエンドでは None）
+    （_backend は st.cache_resource のハッシュ対象から外すため先頭に _ を付けています）
+    """
+    if not CONSTRAINED_DECODING or isinstance(_backend, StubBackend):
+        return None
+    return TokenVocabulary(_backend.tokenizer, eos_token_ids=_backend.pipe.model.generation_config.eos_token_id)
+
+
+def guard_prompt(backend, prompt: str, max_new_tokens: int):
+    """
+    プロンプトの長さを確認し、(プロンプト, max_new_tokens) を返します
+    上限を超えて切り詰めない設定の場合はエラーを表示して None を返します
+    """
     try:
-        output = pipe(prompt, max_new_tokens=1024)[0]["generated_text"]
-
-        # JSONリスト抽出を試みる（[]内の全体）
-        m = re.search(r'\[\s*{.*?}\s*\]', output, re.S)
-        if m:
-            json_str = m.group(0)
-        else:
-            # うまくパースできない場合、すべての { ... } を抽出して強引に整形
-            objs = re.findall(r'{\s*"question".*?}', output, re.S)
-            if not objs:
-                raise ValueError("有効なJSONオブジェクトが見つかりませんでした")
-            json_str = "[" + ",".join(objs) + "]"
-
-        # JSONデコード（末尾カンマ除去対応）
+        guarded = load_prompt_guard(backend).check(prompt, max_new_tokens)
+    except PromptTooLongError as e:
+        st.error(str(e))
+        return None
+    if guarded.truncated:
+        st.warning(f"プロンプトが長すぎるため {guarded.original_tokens} トークンから {guarded.prompt_tokens} トークンに切り詰めました。")
+    return guarded.prompt, guarded.max_new_tokens
+
+
+def stream_quiz_questions(backend, genre: str, n: int, guard=None, vocabulary=None, subtopic=None, variant=None,
+                          cancel=None):
+    """
+    st を使わずに n 問のクイズを生成し、問題のオブジェクトが生成されるたびに1問ずつ返します
+    （バックグラウンドのスレッドからも呼び出すため、guard と vocabulary は呼び出し元で取得して渡します）
+    n 問そろった時点でデコードを止めます。vocabulary を渡した場合は出力をクイズのスキーマに制約します。
+    QUIZ_GENERATION_MODE が parallel の場合はスロットごとのバッチ生成（parallel_quiz_questions）を使います。
+    subtopic・variant はプロンプトに加えるテーマと出題番号（build_quiz_prompt を参照）、cancel（threading.Event）が
+    セットされた場合はそれまでに生成できた問題で終えます。
+    プロンプトが長すぎる場合は PromptTooLongError、有効な問題を1問も生成できなかった場合は ValueError を送出します
+    """
+    guard = guard or load_prompt_guard(backend)
+    if QUIZ_GENERATION_MODE == "parallel" and n > QUIZ_QUESTIONS_PER_SLOT:
+        yield from parallel_quiz_questions(backend, genre, n, guard, vocabulary, cancel=cancel)
+        return
+    # max_new_tokens は過去の生成から見積もる（問題数が少なければ短く、多ければ途中で切れないよう長く）
+    prompt = build_quiz_prompt(genre, n, subtopic=subtopic, variant=variant)
+    guarded = guard.check(prompt, token_budget.budget(genre, n))
+    stop = StopCriteria(cancel=cancel)
+    params = {"max_new_tokens": guarded.max_new_tokens, "stopping_criteria": [stop]}
+    if vocabulary is not None:
+        params["logits_processor"] = [JsonSchemaLogitsProcessor(vocabulary, quiz_schema(n))]
+    chunks = backend.stream(guarded.prompt, **params)
+    texts = []
+
+    def collect():
         try:
-            quiz_list = json.loads(json_str)
-        except json.JSONDecodeError:
-            cleaned = re.sub(r",\s*([\]}])", r"\1", json_str)
-            quiz_list = eval(cleaned)
+            for chunk in chunks:
+                texts.append(chunk)
+                yield chunk
+        finally:
+            chunks.close()
 
-        # 各問題の形式確認
-        valid_quiz_list = []
-        for q in quiz_list:
-            if isinstance(q, dict) and 'question' in q and 'options' in q and 'answer' in q:
-                valid_quiz_list.append(q)
+    parsed = 0
+    try:
+        for question in stream_questions(collect(), n, validate=is_valid_question, stop=stop):
+            parsed += 1
+            yield question
+    finally:
+        # 生成トークン数と打ち切りの有無を記録し、次回以降の見積もりに使う
+        token_budget.observe(genre, n, parsed, backend.count_tokens("".join(texts)), guarded.max_new_tokens)
 
-        if not valid_quiz_list:
-            raise ValueError("問題データの形式が正しくありません")
 
-        return valid_quiz_list
+def parallel_quiz_questions(backend, genre: str, n: int, guard, vocabulary=None, cancel=None):
+    """
+    n 問を QUIZ_QUESTIONS_PER_SLOT 問ずつのスロットに分け、スロットごとのプロンプトを1回のバッチ推論で生成します
+    （サブテーマと出題番号をスロットごとに変え、形式の崩れたスロットだけを再生成します）
+    """
+    def make_prompt(count, subtopic, variant):
+        return build_quiz_prompt(genre, count, subtopic=subtopic, variant=variant)
 
-    except Exception as e:
-        st.error(f"クイズ生成中にエラーが発生しました: {e}")
-        if 'output' in locals():
-            st.error(f"@@ raw output start @@\n{output}\n@@ raw output end @@")
-        return []
+    def generate_batch(prompts, counts):
+        guarded = [
+            guard.check(prompt, token_budget.budget(genre, count)) for prompt, count in zip(prompts, counts)
+        ]
+        max_new_tokens = max(g.max_new_tokens for g in guarded)
+        params = {"max_new_tokens": max_new_tokens}
+        if cancel is not None:
+            params["stopping_criteria"] = [StopCriteria(cancel=cancel, rows=len(prompts))]
+        if vocabulary is not None:
+            params["logits_processor"] = [
+                JsonSchemaLogitsProcessor(vocabulary, row_segments=[quiz_schema(count) for count in counts])
+            ]
+        outputs = backend.generate_batch([g.prompt for g in guarded], **params)
+        for output, count in zip(outputs, counts):
+            parsed = min(count, len(parse_questions(output, is_valid_question)))
+            token_budget.observe(genre, count, parsed, backend.count_tokens(output), max_new_tokens)
+        return outputs
+
+    yield from generate_in_slots(
+        generate_batch, make_prompt, n,
+        per_slot=QUIZ_QUESTIONS_PER_SLOT,
+        subtopics=QUIZ_SUBTOPICS.get(genre, []),
+        validate=is_valid_question,
+        max_retries=QUIZ_SLOT_MAX_RETRIES,
+    )
+
+
+def generate_quiz_questions(backend, genre: str, n: int, guard=None, vocabulary=None, **kwargs):
+    """
+    st を使わずに n 問のクイズを生成してリストで返します（引数は stream_quiz_questions を参照）
+    """
+    return list(stream_quiz_questions(backend, genre, n, guard=guard, vocabulary=vocabulary, **kwargs))
+
+
+@st.cache_resource
+def load_quiz_pool(_backend):
+    """
+    ジャンルごとに問題を事前生成するバックグラウンドの QuizPool を起動して返します
+    （_backend は st.cache_resource のハッシュ対象から外すため先頭に _ を付けています）
+    """
+    # 補充スレッドから st.cache_resource を呼ばないよう、PromptGuard などはここで取得しておく
+    guard = load_prompt_guard(_backend)
+    vocabulary = load_token_vocabulary(_backend)
+    def generate(genre, n, **kwargs):
+        return generate_quiz_questions(_backend, genre, n, guard=guard, vocabulary=vocabulary, **kwargs)
 
+    return QuizPool(
+        generate,
+        database.add_pool_questions,
+        database.take_pool_questions,
+        database.get_pool_depths,
+        genres=QUIZ_GENRES,
+        target_size=QUIZ_POOL_TARGET_SIZE,
+        refill_batch=QUIZ_POOL_REFILL_BATCH,
+        subtopics=QUIZ_SUBTOPICS,
+    ).start()
 
-def check_quiz_answer(pipe, question: str, user_answer: str):
+
+def serve_quiz(backend, genre: str, n: int):
+    """
+    出題する n 問を生成する QuizGeneration を返します
+    事前生成のプールから取り出し、足りない分だけをバックグラウンドで逐次生成します
+    （生成できた問題から出題でき、その間プールの補充は止めます）
+    """
+    if backend is None:
+        st.error("モデルがロードされていないため、クイズを生成できません。")
+        return QuizGeneration(0)
+    # バックグラウンドのスレッドから st.cache_resource を呼ばないよう、ここで取得しておく
+    guard = load_prompt_guard(backend)
+    vocabulary = load_token_vocabulary(backend)
+    if QUIZ_POOL_TARGET_SIZE <= 0:
+        return QuizGeneration(n, stream=stream_quiz_questions(backend, genre, n, guard=guard, vocabulary=vocabulary))
+
+    pool = load_quiz_pool(backend)
+    questions = pool.take(genre, n)
+
+    def remaining():
+        with pool.foreground():
+            yield from stream_quiz_questions(backend, genre, n - len(questions), guard=guard, vocabulary=vocabulary)
+
+    return QuizGeneration(n, questions, stream=remaining() if len(questions) < n else None)
+
+
+def check_quiz_answer(backend, question: str, user_answer: str):
     """
     自由記述形式の解答に対して、LLMに採点を依頼する。
     出力形式: {"is_correct": 0 or 1, "correct_answer": "..."}
     """
-    if pipe is None:
+    if backend is None:
         return "モデルがロードされていないため、採点できません。", False, ""
 
     prompt = (
@@ -109,8 +250,19 @@ def check_quiz_answer(pipe, question: str, user_answer: str):
         "JSON形式で出力してください： {\"is_correct\": 0 or 1, \"correct_answer\": \"...\"}"
     )
 
+    guarded = guard_prompt(backend, prompt, 128)
+    if guarded is None:
+        return "採点に失敗しました。", False, ""
+    prompt, max_new_tokens = guarded
+
+    params = {"max_new_tokens": max_new_tokens}
+    vocabulary = load_token_vocabulary(backend)
+    if vocabulary is not None:
+        # 出力を採点結果のスキーマに制約する（閉じ括弧で生成が終わる）
+        params["logits_processor"] = [JsonSchemaLogitsProcessor(vocabulary, grading_schema())]
+
     try:
-        output = pipe(prompt, max_new_tokens=128)[0]["generated_text"]
+        output = backend.generate(prompt, **params)
         m = re.search(r"\{.*?\}", output, re.S)
         if not m:
             raise ValueError("採点結果のJSONが見つかりませんでした")
@@ -0,0 +1,100 @@
+# quiz_parallel.py
+"""
+クイズの問題のスロットごとの並列生成
+
+n 問を1つのプロンプトで順に生成すると、所要時間は問題数にほぼ比例し、1問の形式が崩れると
+全体の解析に影響します。ここでは n 問を per_slot 問ずつのスロットに分け、スロットごとの短いプロンプトを
+1回のバッチ推論でまとめて生成します。スロットは個別に検証し、足りなかったスロットだけを再生成します。
+
+同じジャンルの問題が重複しないよう、スロットごとにサブテーマと出題番号を変えてプロンプトを作ります。
+"""
+
+import random
+
+from quiz_prompt import question_key
+from quiz_stream import QuizStreamParser
+
+
+def split_slots(n, per_slot):
+    """n 問を per_slot 問ずつのスロットに分けた問題数のリスト"""
+    per_slot = max(1, int(per_slot))
+    return [min(per_slot, n - start) for start in range(0, n, per_slot)]
+
+
+def assign_subtopics(subtopics, slots, rng):
+    """スロットごとのサブテーマ（重複が少なくなるよう、シャッフルした順に割り当てる）"""
+    if not subtopics:
+        return [None] * slots
+    order = list(subtopics)
+    rng.shuffle(order)
+    return [order[i % len(order)] for i in range(slots)]
+
+
+def parse_questions(output, validate=None):
+    """生成文から形式の正しい問題をすべて取り出す"""
+    return QuizStreamParser(validate=validate).feed(output)
+
+
+def generate_in_slots(generate_batch, make_prompt, n, per_slot=1, subtopics=(), validate=None,
+                      max_retries=2, seed=None, stats=None):
+    """
+    n 問をスロットに分けてバッチで生成し、検証できた問題を生成のラウンドごとに返す
+
+    既に出た問題と重複する問題は不採用とし、不足したスロットは次のラウンドで（出題番号を変えて）
+    不足分だけを再生成します。max_retries 回再生成しても足りない場合は、生成できた分だけを返します。
+    問題を1問も生成できなかった場合は ValueError（raw_output 属性に最後の生成文）を送出します。
+
+    Args:
+        generate_batch (callable): (プロンプトのリスト, スロットごとの問題数のリスト) を受け取り、生成文のリストを返す関数
+        make_prompt (callable): (問題数, サブテーマ, 出題番号) からプロンプトを作る関数
+        n (int): 必要な問題数
+        per_slot (int): 1スロット（1プロンプト）あたりの問題数
+        subtopics (list[str]): スロットに割り当てるサブテーマ
+        validate (callable, optional): 問題の形式の確認
+        max_retries (int): 不足したスロットを再生成する最大回数
+        seed (int, optional): サブテーマの割り当てと出題番号の乱数のシード
+        stats (dict, optional): rounds・prompts・failed_slots を加算する dict
+    """
+    rng = random.Random(seed)
+    counts = split_slots(n, per_slot)
+    topics = assign_subtopics(subtopics, len(counts), rng)
+    variants = [rng.randrange(1000, 10000) for _ in counts]
+    stats = stats if stats is not None else {}
+    seen = set()
+    produced = 0
+    pending = list(range(len(counts)))
+    last_output = ""
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        prompts = [make_prompt(counts[s], topics[s], variants[s] + attempt) for s in pending]
+        outputs = generate_batch(prompts, [counts[s] for s in pending])
+        stats["rounds"] = stats.get("rounds", 0) + 1
+        stats["prompts"] = stats.get("prompts", 0) + len(prompts)
+
+        accepted = []
+        failed = []
+        for s, output in zip(pending, outputs):
+            last_output = output
+            questions = []
+            for question in parse_questions(output, validate):
+                key = question_key(question)
+                if key not in seen and len(questions) < counts[s]:
+                    seen.add(key)
+                    questions.append(question)
+            accepted += questions
+            if len(questions) < counts[s]:
+                # 足りない分だけを次のラウンドで再生成する
+                counts[s] -= len(questions)
+                failed.append(s)
+        stats["failed_slots"] = stats.get("failed_slots", 0) + len(failed)
+        pending = failed
+
+        for question in accepted:
+            yield question
+        produced += len(accepted)
+
+    if produced == 0:
+        error = ValueError("有効な問題を生成できませんでした")
+        error.raw_output = last_output
+        raise error
@@ -0,0 +1,190 @@
+# quiz_pool.py
+"""
+クイズの問題の事前生成プール
+
+「出題開始」のたびにモデルで問題を生成すると、生成が終わるまで待たされます。
+QuizPool はバックグラウンドのスレッドでジャンルごとに問題を事前生成して SQLite に保存しておき、
+出題時にはプールから即座に取り出します。足りない分だけをその場で生成し、プールは非同期に補充します。
+
+補充は優先度の低い処理として扱います。出題のための生成（foreground）が始まると、実行中の補充は
+キャンセルして（それまでに生成できた問題はプールに追加します）、foreground が終わるまで新しい補充を始めません。
+
+補充のたびにサブテーマと出題番号を変えてプロンプトを作り、同じ問題ばかりがプールにたまらないようにします
+（重複した問題はプールへの追加時・取り出し時にも取り除きます。database.py を参照）。
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _new_stats():
+    return {"requests": 0, "hits": 0, "served": 0, "refills": 0, "refill_errors": 0,
+            "refill_seconds": 0.0, "last_refill_seconds": None}
+
+
+class QuizPool:
+    """ジャンルごとの問題プールと、目標数まで補充するバックグラウンドのワーカー"""
+
+    def __init__(self, generate, add_questions, take_questions, pool_depths, genres,
+                 target_size=20, refill_batch=5, idle_interval=5.0, subtopics=None):
+        """
+        Args:
+            generate (callable): (genre, n, subtopic=, variant=, cancel=) を受け取り、検証済みの問題のリストを
+                返す関数（失敗時は例外）。cancel（threading.Event）がセットされたら生成を止め、
+                それまでに生成できた問題を返す
+            add_questions (callable): (genre, questions) をプールに保存する関数
+            take_questions (callable): (genre, n) でプールから最大 n 問を取り出す関数
+            pool_depths (callable): ジャンル -> プールの問題数 の dict を返す関数
+            genres (list[str]): 事前生成するジャンル
+            target_size (int): ジャンルごとに保持する問題数
+            refill_batch (int): 1回の補充で生成する最大の問題数
+            idle_interval (float): 補充が不要なときに次の確認までに待つ秒数
+            subtopics (dict, optional): ジャンル -> 補充ごとに順に使うサブテーマのリスト
+        """
+        self._generate = generate
+        self._add = add_questions
+        self._take = take_questions
+        self._depths = pool_depths
+        self.genres = list(genres)
+        self.target_size = int(target_size)
+        self.refill_batch = max(1, int(refill_batch))
+        self.idle_interval = idle_interval
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()  # foreground の生成が無いときにセット
+        self._idle.set()
+        self._cancel = threading.Event()  # foreground の生成が始まったら実行中の補充を止める
+        self._foreground = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.stats = {genre: _new_stats() for genre in self.genres}
+        self.subtopics = dict(subtopics or {})
+        # 補充ごとの出題番号（再起動しても前回と同じプロンプトにならないよう、乱数から始める）
+        self._variant = random.randrange(1000, 10000)
+
+    def start(self):
+        """補充ワーカーを起動する"""
+        if self._thread is None and self.target_size > 0:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="quiz-pool-refill", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    @contextmanager
+    def foreground(self):
+        """
+        with ブロックの間は補充を止める（出題のための生成を優先する）
+
+        実行中の補充はキャンセルし、新しい補充は with ブロックを抜けるまで始めません。
+        """
+        with self._lock:
+            self._foreground += 1
+            self._idle.clear()
+            self._cancel.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+                if self._foreground == 0:
+                    self._cancel.clear()
+                    self._idle.set()
+
+    def take(self, genre, n):
+        """
+        プールから最大 n 問を取り出し、補充を促す
+
+        Returns:
+            list: 取り出した問題（足りない場合は n 問未満）
+        """
+        questions = self._take(genre, n)
+        stats = self.stats.setdefault(genre, _new_stats())
+        stats["requests"] += 1
+        stats["served"] += len(questions)
+        if len(questions) >= n:
+            stats["hits"] += 1
+        self._wakeup.set()
+        return questions
+
+    def _next_genre(self):
+        """最も不足しているジャンルと不足数を返す（全て目標数に達していれば (None, 0)）"""
+        depths = self._depths()
+        shortages = {genre: self.target_size - depths.get(genre, 0) for genre in self.genres}
+        genre = max(self.genres, key=lambda g: shortages[g], default=None)
+        if genre is None or shortages[genre] <= 0:
+            return None, 0
+        return genre, shortages[genre]
+
+    def refill_once(self):
+        """
+        最も不足しているジャンルの問題を1回分生成してプールに追加する
+
+        Returns:
+            str: 補充したジャンル（補充が不要だった場合・失敗した場合は None）
+        """
+        genre, shortage = self._next_genre()
+        if genre is None:
+            return None
+        stats = self.stats[genre]
+        self._variant += 1
+        topics = self.subtopics.get(genre) or [None]
+        subtopic = topics[self._variant % len(topics)]
+        start = time.perf_counter()
+        try:
+            # 目標数を超えて生成しない
+            questions = self._generate(
+                genre, min(self.refill_batch, shortage), subtopic=subtopic, variant=self._variant, cancel=self._cancel
+            )
+        except Exception as e:
+            if self._cancel.is_set():
+                # foreground の生成を優先するためにキャンセルした
+                return None
+            stats["refill_errors"] += 1
+            print(f"問題プールの補充に失敗しました（{genre}）: {e}")
+            return None
+        elapsed = time.perf_counter() - start
+        if questions:
+            self._add(genre, questions)
+        stats["refills"] += 1
+        stats["refill_seconds"] += elapsed
+        stats["last_refill_seconds"] = elapsed
+        return genre
+
+    def _run(self):
+        while self._running:
+            # 出題のための生成が終わるまで新しい補充は始めない
+            self._idle.wait()
+            try:
+                genre = self.refill_once()
+            except Exception as e:
+                print(f"問題プールの確認に失敗しました: {e}")
+                genre = None
+            if genre is None:
+                # 補充が不要・失敗した場合は、出題で減るか一定時間が経つまで待つ
+                self._wakeup.wait(self.idle_interval)
+                self._wakeup.clear()
+
+    def snapshot(self):
+        """ジャンルごとのプールの問題数・ヒット率・補充にかかった時間"""
+        depths = self._depths()
+        rows = []
+        for genre, stats in self.stats.items():
+            refills = stats["refills"]
+            rows.append({
+                "genre": genre,
+                "depth": depths.get(genre, 0),
+                "target": self.target_size,
+                "hit_rate": stats["hits"] / stats["requests"] if stats["requests"] else None,
+                "served": stats["served"],
+                "refills": refills,
+                "refill_errors": stats["refill_errors"],
+                "avg_refill_seconds": stats["refill_seconds"] / refills if refills else None,
+                "last_refill_seconds": stats["last_refill_seconds"],
+            })
+        return rows
@@ -0,0 +1,46 @@
+# quiz_prompt.py
+"""
+クイズ生成のプロンプトと、生成された問題の形式の確認
+
+llm.py（Streamlit）とベンチマークの両方から使うため、streamlit・torch には依存しません。
+"""
+
+
+def is_valid_question(q) -> bool:
+    """問題文・4つの選択肢・選択肢の範囲内の正解インデックスを持つ問題かどうか"""
+    return (
+        isinstance(q, dict)
+        and isinstance(q.get("question"), str)
+        and isinstance(q.get("options"), list) and len(q["options"]) == 4
+        and isinstance(q.get("answer"), int) and 0 <= q["answer"] < 4
+    )
+
+
+def question_key(question):
+    """重複の判定に使うキー（空白を除いた問題文）"""
+    return "".join(str(question.get("question", "")).split())
+
+
+def build_quiz_prompt(genre: str, n: int, subtopic: str = None, variant: int = None) -> str:
+    """
+    ジャンル genre で n 問のクイズを生成するプロンプト
+
+    subtopic・variant を指定すると、同じジャンルの他のプロンプトと問題が重複しないよう
+    テーマと出題番号を末尾に加えます（並列生成のスロットごとの多様化に使います）。
+    """
+    # プロンプト文を厳格化（不要な文章を出さないよう制約）
+    # 固定の指示文を先頭に置き、ジャンル・問題数は末尾に置く（前置部の KV キャッシュを再利用するため）
+    prompt = (
+        "一般知識に関する4択クイズを、JSON形式のリストで出力してください。\n"
+        "以下の形式に従い、JSONリスト **のみ** を返してください。説明文や例、見出しを含めないでください。\n"
+        "[\n"
+        "  {\"question\": \"日本の首都はどこですか？\", \"options\": [\"大阪\", \"京都\", \"東京\", \"名古屋\"], \"answer\": 2},\n"
+        "  {\"question\": \"光の速さは？\", \"options\": [\"3万km/s\", \"30万km/s\", \"300万km/s\", \"3000km/s\"], \"answer\": 1}\n"
+        "]\n"
+        f"ジャンル「{genre}」の問題を{n}問作成してください。"
+    )
+    if subtopic:
+        prompt += f"テーマは「{subtopic}」です。"
+    if variant is not None:
+        prompt += f"（出題番号 {variant}）"
+    return prompt
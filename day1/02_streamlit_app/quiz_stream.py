@@ -0,0 +1,241 @@
+# quiz_stream.py
+"""
+クイズの問題の逐次生成
+
+モデルの出力（問題の JSON リスト）をストリーミングで受け取り、問題のオブジェクトが閉じた時点で
+1問ずつ取り出します。必要な問題数がそろった時点でデコードを止めるため、最初の問題が表示されるまでの時間と
+不要なトークンの生成を減らせます。
+
+- QuizStreamParser: テキスト片から完成した問題のオブジェクトを順に取り出す寛容なパーサー（eval は使わない）
+- StopCriteria: stop() が呼ばれたら生成を止める generate の stopping_criteria
+- QuizGeneration: 問題をバックグラウンドで生成し、生成できた問題から順に参照できるようにする
+"""
+
+import json
+import re
+import threading
+
+# 読み直しの目印（問題のオブジェクトの最初のキー）と、その前の空白を読み飛ばす最大文字数
+_QUESTION_KEY = '"question"'
+_RESYNC_LOOKAHEAD = 64
+
+
+class QuizStreamParser:
+    """
+    JSON リストのテキスト片を受け取り、最上位のオブジェクト（{ ... }）が閉じるたびに取り出すパーサー
+
+    リストの前後の説明文やコードブロックの記号、末尾のカンマは無視します。説明文の中の対応しない { や " で
+    読み違えた場合も、{"question" の位置でオブジェクトの始まりとして読み直します。
+    デコードできないオブジェクトや validate で不正と判定されたオブジェクトは読み飛ばします。
+    """
+
+    def __init__(self, validate=None):
+        """
+        Args:
+            validate (callable, optional): オブジェクトを受け取り、採用するかどうかを返す関数
+        """
+        self.validate = validate
+        self.text = ""  # 受け取ったテキスト全体（エラー表示用）
+        self.rejected = 0
+        self._pos = 0
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        """
+        テキスト片を追加し、新たに完成したオブジェクトのリストを返す
+        """
+        self.text += chunk
+        objects = []
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            if ch == "{" and self._depth > 0 and not self._escape:
+                # 説明文の中の { や " で読み違えていても、問題のオブジェクトの始まりで読み直す
+                starts = self._starts_question(text, i)
+                if starts is None:
+                    break  # 判定に必要な文字がまだ届いていない
+                if starts:
+                    self._depth, self._start, self._in_string = 1, i, False
+                    i += 1
+                    continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                # オブジェクトの外の文字列（説明文など）は追わない
+                self._in_string = self._depth > 0
+            elif ch == "{":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self._decode(text[self._start:i + 1])
+                    if obj is not None:
+                        objects.append(obj)
+            i += 1
+        self._pos = i
+        return objects
+
+    @staticmethod
+    def _starts_question(text, i):
+        """
+        text[i] の { が問題のオブジェクト（{"question"）の始まりかどうか（文字が足りず判定できなければ None）
+        """
+        window = text[i + 1:i + 1 + _RESYNC_LOOKAHEAD]
+        rest = window.lstrip()
+        if len(rest) >= len(_QUESTION_KEY):
+            return rest.startswith(_QUESTION_KEY)
+        if len(window) == _RESYNC_LOOKAHEAD:
+            return False  # 空白が長すぎる
+        return None if _QUESTION_KEY.startswith(rest) else False
+
+    def _decode(self, obj_text):
+        try:
+            obj = json.loads(obj_text)
+        except json.JSONDecodeError:
+            # 末尾カンマだけは取り除いて再試行する
+            try:
+                obj = json.loads(re.sub(r",\s*([\]}])", r"\1", obj_text))
+            except json.JSONDecodeError:
+                self.rejected += 1
+                return None
+        if self.validate is not None and not self.validate(obj):
+            self.rejected += 1
+            return None
+        return obj
+
+
+class StopCriteria:
+    """
+    generate の stopping_criteria に渡す停止条件（stop() が呼ばれた後のステップで全行の生成を止める）
+
+    消費側のスレッドから stop() を呼び、推論スレッドが毎ステップ確認します。
+    cancel（threading.Event）を渡すと、それがセットされた場合も止めます。
+    """
+
+    def __init__(self, cancel=None, rows=1):
+        """
+        Args:
+            cancel (threading.Event, optional): 外部からのキャンセル（問題プールの補充の中断など）
+            rows (int): バッチの行数
+        """
+        self._event = threading.Event()
+        self._cancel = cancel
+        self.rows = rows
+
+    def stop(self):
+        self._event.set()
+
+    @property
+    def stopped(self):
+        return self._event.is_set() or (self._cancel is not None and self._cancel.is_set())
+
+    def stopped_rows(self):
+        return [self.stopped] * self.rows
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        return torch.full((input_ids.shape[0],), self.stopped, dtype=torch.bool, device=input_ids.device)
+
+
+def stream_questions(stream, n, validate=None, stop=None):
+    """
+    テキスト片のイテレータから問題を1問ずつ返し、n 問そろったら stop.stop() で生成を止める
+
+    イテレーションを途中でやめた場合も生成を止めます。
+    問題を1問も取り出せずに終わった場合は ValueError（raw_output 属性に生成文）を送出します。
+
+    Args:
+        stream (iterator): 生成文のテキスト片のイテレータ
+        n (int): 必要な問題数
+        validate (callable, optional): 問題の形式の確認（QuizStreamParser を参照）
+        stop (StopCriteria, optional): 生成に渡した停止条件
+    """
+    parser = QuizStreamParser(validate=validate)
+    count = 0
+    try:
+        for chunk in stream:
+            for obj in parser.feed(chunk):
+                yield obj
+                count += 1
+                if count >= n:
+                    return
+    finally:
+        if stop is not None:
+            stop.stop()
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    if count == 0:
+        error = ValueError("有効な問題を生成できませんでした")
+        error.raw_output = parser.text
+        raise error
+
+
+class QuizGeneration:
+    """
+    出題する問題をバックグラウンドのスレッドで生成し、生成できた問題から順に参照できるようにする
+
+    questions には生成済みの問題が順に追加されます。生成の失敗は error に保持し、呼び出し元で表示します。
+    """
+
+    def __init__(self, n, questions=(), stream=None):
+        """
+        Args:
+            n (int): 出題する問題数
+            questions (list): すでに用意できている問題（事前生成のプールなど）
+            stream (iterator, optional): 残りの問題を1問ずつ返すイテレータ（スレッドで消費する）
+        """
+        self.n = n
+        self.questions = list(questions)[:n]
+        self.error = None
+        self._done = threading.Event()
+        self._changed = threading.Condition()
+        if stream is None or len(self.questions) >= n:
+            self._done.set()
+        else:
+            threading.Thread(target=self._run, args=(stream,), name="quiz-generation", daemon=True).start()
+
+    def _run(self, stream):
+        try:
+            for question in stream:
+                with self._changed:
+                    self.questions.append(question)
+                    self._changed.notify_all()
+                if len(self.questions) >= self.n:
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+            with self._changed:
+                self._done.set()
+                self._changed.notify_all()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    @property
+    def total(self):
+        """出題する問題数（生成が終わった後は実際に生成できた問題数）"""
+        return len(self.questions) if self.finished else self.n
+
+    def wait(self, count, timeout=None):
+        """count 問が生成されるか、生成が終わるまで待ち、count 問そろったかどうかを返す"""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.questions) >= count or self.finished, timeout)
+        return len(self.questions) >= count
@@ -0,0 +1,130 @@
+# stub_model.py
+"""
+ベンチマーク・動作確認用の決定的なスタブモデル
+
+実際のモデルを読み込まずにサーバーを起動するための、text-generation pipeline 互換のスタブです。
+生成文はプロンプトのハッシュから決まり（同じプロンプトには常に同じ応答）、
+1トークンごとに指定した時間だけ待つことでデコードの所要時間を模擬します。
+STUB_MODEL=1 で app.py を起動するとこのスタブが使われます。
+responder を渡すと、特定のプロンプト（クイズ生成・採点など）には決まった形式の応答を返せます。
+（03_FastAPI/stub_model.py と同じ内容です）
+"""
+
+import hashlib
+import json
+import re
+import time
+
+# 生成に使う文字（1文字 = 1トークン）
+DEFAULT_VOCABULARY = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+
+def quiz_responder(prompt):
+    """
+    クイズ生成・採点のプロンプトに対して、形式の正しい JSON を返す（それ以外は None）
+
+    問題・正解の位置はプロンプトのハッシュから決まります。
+    """
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    if "is_correct" in prompt:
+        return json.dumps(
+            {"is_correct": digest[0] % 2, "correct_answer": f"正答{digest[1] % 10}"}, ensure_ascii=False
+        )
+    count = re.search(r"(\d+)問", prompt)
+    if "クイズ" not in prompt or not count:
+        return None
+    genre = re.search(r"ジャンル「(.+?)」", prompt)
+    genre = genre.group(1) if genre else "一般知識"
+    quiz = []
+    for i in range(int(count.group(1))):
+        seed = digest[i % len(digest)]
+        quiz.append({
+            "question": f"{genre}に関する問題{i + 1}（{seed}）の正解はどれですか？",
+            "options": [f"選択肢{seed}-{j + 1}" for j in range(4)],
+            "answer": seed % 4,
+        })
+    return json.dumps(quiz, ensure_ascii=False)
+
+
+class StubTokenizer:
+    """1文字を1トークンとして扱うトークナイザー"""
+
+    pad_token = "\0"
+    eos_token = "\0"
+
+    def __init__(self):
+        self.padding_side = "right"
+
+    def encode(self, text, add_special_tokens=True):
+        return [ord(c) for c in text]
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(chr(i) for i in ids)
+
+    def __call__(self, text, **kwargs):
+        return {"input_ids": self.encode(text)}
+
+
+class StubPipeline:
+    """プロンプトから決まる応答を、トークンごとの遅延付きで返す pipeline 互換のスタブ"""
+
+    def __init__(self, token_delay=0.0, prefill_delay=0.0, vocabulary=DEFAULT_VOCABULARY, responder=None):
+        """
+        Args:
+            token_delay (float): 1トークン（バッチの場合は1ステップ）あたりの待ち時間（秒）
+            prefill_delay (float): 1回の呼び出しごとの固定の待ち時間（秒）
+            vocabulary (str): 生成に使う文字
+            responder (callable, optional): プロンプトを受け取り応答を返す関数。None を返した場合や
+                未指定の場合はハッシュから決まる文字列を返す。応答が max_new_tokens より短ければそこで生成を終える
+        """
+        self.token_delay = token_delay
+        self.prefill_delay = prefill_delay
+        self.vocabulary = vocabulary
+        self.responder = responder
+        self.tokenizer = StubTokenizer()
+        self.model = None
+        self.calls = 0
+
+    def completion(self, prompt, max_new_tokens):
+        """プロンプトに対する生成文（最大 max_new_tokens 文字）を返す"""
+        response = self.responder(prompt) if self.responder else None
+        if response is not None:
+            return response[:max_new_tokens]
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        return "".join(
+            self.vocabulary[digest[i % len(digest)] % len(self.vocabulary)] for i in range(max_new_tokens)
+        )
+
+    def __call__(self, inputs, max_new_tokens=16, streamer=None, return_full_text=True, stopping_criteria=None,
+                 **kwargs):
+        self.calls += 1
+        prompts = [inputs] if isinstance(inputs, str) else list(inputs)
+        completions = [self.completion(prompt, max_new_tokens) for prompt in prompts]
+        lengths = [0] * len(prompts)
+
+        time.sleep(self.prefill_delay)
+        # バッチ内のプロンプトは同時にデコードされるものとして、ステップ数分だけ待つ
+        for step in range(max((len(c) for c in completions), default=0)):
+            # stopping_criteria（CancellationCriteria）で止められた行はそれ以上生成しない
+            stopped = [False] * len(prompts)
+            for criteria in stopping_criteria or []:
+                if hasattr(criteria, "stopped_rows"):
+                    stopped = [a or b for a, b in zip(stopped, criteria.stopped_rows())]
+            if step > 0 and all(stopped):
+                break
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            for i in range(len(prompts)):
+                if (step == 0 or not stopped[i]) and step < len(completions[i]):
+                    lengths[i] = step + 1
+            if streamer is not None and lengths[0] == step + 1:
+                streamer.on_finalized_text(completions[0][step], stream_end=False)
+        if streamer is not None:
+            streamer.on_finalized_text("", stream_end=True)
+        completions = [completion[:length] for completion, length in zip(completions, lengths)]
+
+        outputs = [
+            [{"generated_text": (prompt if return_full_text else "") + completion}]
+            for prompt, completion in zip(prompts, completions)
+        ]
+        return outputs[0] if isinstance(inputs, str) else outputs
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from backends import StubBackend, TransformersBackend, create_backend
+from quiz_prompt import build_quiz_prompt, is_valid_question
+from quiz_stream import QuizStreamParser
+from stub_model import StubPipeline
+
+
+def test_stub_backend_streams_a_parsable_quiz():
+    """build_quiz_prompt のプロンプトには、逐次パーサーで指定した問題数を取り出せる生成文を返すことを確認"""
+    parser = QuizStreamParser(validate=is_valid_question)
+    questions = []
+    for chunk in StubBackend().stream(build_quiz_prompt("動物", 3, subtopic="鳥", variant=7), max_new_tokens=1024):
+        questions.extend(parser.feed(chunk))
+
+    assert len(questions) == 3
+    assert all("動物" in q["question"] for q in questions)
+
+
+def test_stub_backend_returns_grading_json():
+    """採点のプロンプトには is_correct と correct_answer を含む JSON を返すことを確認"""
+    prompt = '問題: ...\nユーザーの解答: ...\nJSON形式で出力してください： {"is_correct": 0 or 1, "correct_answer": "..."}'
+    result = json.loads(StubBackend().generate(prompt, max_new_tokens=128))
+
+    assert result["is_correct"] in (0, 1)
+    assert isinstance(result["correct_answer"], str)
+
+
+def test_generate_batch_matches_single():
+    """スロットごとのバッチ生成でも、プロンプトごとに単一生成と同じ生成文になることを確認"""
+    backend = StubBackend()
+    prompts = [build_quiz_prompt("歴史", 2, variant=i) for i in range(3)]
+
+    outputs = backend.generate_batch(prompts, max_new_tokens=1024)
+
+    assert outputs == [backend.generate(p, max_new_tokens=1024) for p in prompts]
+    assert len(set(outputs)) == 3
+
+
+def test_stream_raises_generation_error():
+    """生成中の例外は、ストリームの終了後に送出されることを確認"""
+    class FailingPipeline(StubPipeline):
+        def __call__(self, inputs, **kwargs):
+            raise RuntimeError("boom")
+
+    backend = StubBackend()
+    backend.pipe = FailingPipeline()
+    with pytest.raises(RuntimeError, match="boom"):
+        list(backend.stream("a", max_new_tokens=4))
+
+
+def test_create_backend():
+    """設定名から対応するバックエンドが作成されることを確認"""
+    assert isinstance(create_backend("stub"), StubBackend)
+    assert isinstance(create_backend("transformers", load_pipeline=StubPipeline), TransformersBackend)
+    with pytest.raises(ValueError):
+        create_backend("unknown")
@@ -0,0 +1,164 @@
+import json
+import random
+import string
+
+import pytest
+
+from json_schema import (
+    JsonSchemaLogitsProcessor,
+    TokenVocabulary,
+    consume,
+    grading_schema,
+    quiz_schema,
+)
+
+EOS = 0
+PIECES = [
+    "<eos>", ' "', '"', ', "', '", "', '"],', '"}', "{", "}", "[", "]", ", ", ",", " ", ":",
+    "0", "1", "2", "3", "4", '"question": "', "question", "options", "answer", "is_correct",
+    "correct_answer", "犬", "猫は", "何", "？", "です", 'a"b', "\\n", '"],"', '"]', '": ', '":', ": ",
+    '[{"', '{"', "\n", '"\n', "_",
+] + list(string.ascii_lowercase)
+
+
+class ToyTokenizer:
+    """1トークン = PIECES の1要素のトークナイザー"""
+
+    eos_token_id = EOS
+    all_special_ids = [EOS]
+
+    def __len__(self):
+        return len(PIECES)
+
+    def encode(self, text, add_special_tokens=False):
+        return [PIECES.index(text)]
+
+    def decode(self, ids):
+        return "".join(PIECES[i] for i in ids)
+
+    def batch_decode(self, batch):
+        return [self.decode(ids) for ids in batch]
+
+
+@pytest.fixture(scope="module")
+def vocabulary():
+    return TokenVocabulary(ToyTokenizer())
+
+
+def random_walk(processor, rows, rng, max_steps=2000):
+    """各行で許されたトークンから無作為に選んで生成し、行ごとの (生成文, EOS で終わったか) を返す"""
+    vocab = processor.vocabulary
+    processor.update([[] for _ in range(rows)])
+    outputs = [""] * rows
+    finished = [False] * rows
+    for _ in range(max_steps):
+        if all(finished):
+            break
+        step = []
+        for row in range(rows):
+            if finished[row]:
+                step.append([EOS])
+                continue
+            ids, limit = processor.allowed(row)
+            candidates = list(ids) + [i for i, n in zip(vocab.plain_ids, vocab.plain_lengths) if n <= limit]
+            token = rng.choice(candidates)
+            if token == EOS:
+                finished[row] = True
+            else:
+                outputs[row] += vocab.texts[token]
+            step.append([token])
+        processor.update(step)
+    return outputs, finished
+
+
+def test_consume_accepts_prefixes_of_the_schema():
+    """スキーマに沿った途中までの文字列を受け付け、最後まで読むと終端の状態になることを確認"""
+    segments = quiz_schema(1)
+    text = json.dumps([{"question": "犬は何？", "options": ["a", "b", "c", "d"], "answer": 2}], ensure_ascii=False)
+    for end in range(len(text) + 1):
+        assert consume(segments, (0, 0), text[:end]) is not None, text[:end]
+    assert consume(segments, (0, 0), text) == (len(segments), 0)
+
+
+@pytest.mark.parametrize("text", [
+    '{"question"',                      # リストで始まらない
+    '[{"question": ""',                 # 空の文字列
+    '[{"question": "a\\',               # 文字列の中のエスケープ
+    '[{"question": "a\n',               # 文字列の中の制御文字
+    '[{"question":"a"',                 # 区切りの空白が無い
+    '[{"question": "a", "options": ["a", "b", "c", "d"], "answer": 4',  # 範囲外の番号
+    '[{"question": "a", "options": ["a", "b", "c", "d"], "answer": 1}]x',  # 閉じた後の文字
+])
+def test_consume_rejects_text_outside_the_schema(text):
+    """スキーマに続けられない文字列で None になることを確認"""
+    assert consume(quiz_schema(1), (0, 0), text) is None
+
+
+def test_consume_limits_string_length():
+    """文字列が max_string_chars を超えると受け付けず、閉じる " は受け付けることを確認"""
+    segments = grading_schema()
+    prefix = '{"is_correct": 1, "correct_answer": "'
+    assert consume(segments, (0, 0), prefix + "a" * 5, max_string_chars=5) is not None
+    assert consume(segments, (0, 0), prefix + "a" * 6, max_string_chars=5) is None
+    assert consume(segments, (0, 0), prefix + "a" * 5 + '"}', max_string_chars=5) == (len(segments), 0)
+
+
+@pytest.mark.parametrize("segments", [quiz_schema(1), quiz_schema(3), grading_schema()])
+def test_masked_random_walk_always_produces_valid_json(vocabulary, segments):
+    """許されたトークンだけを無作為に選ぶと、必ず EOS で終わり json.loads できることを確認"""
+    rng = random.Random(0)
+    for _ in range(30):
+        processor = JsonSchemaLogitsProcessor(vocabulary, segments, max_string_chars=8)
+        outputs, finished = random_walk(processor, 1, rng)
+        assert finished == [True]
+        assert consume(segments, (0, 0), outputs[0]) == (len(segments), 0)
+        json.loads(outputs[0])
+
+
+def test_rows_with_different_schemas_are_constrained_independently(vocabulary):
+    """row_segments で行ごとに別のスキーマを渡すと、各行がそれぞれのスキーマの JSON になることを確認"""
+    rng = random.Random(1)
+    for _ in range(10):
+        processor = JsonSchemaLogitsProcessor(
+            vocabulary, row_segments=[quiz_schema(1), grading_schema()], max_string_chars=8
+        )
+        (quiz, grading), finished = random_walk(processor, 2, rng)
+        assert finished == [True, True]
+        assert isinstance(json.loads(quiz), list)
+        assert set(json.loads(grading)) == {"is_correct", "correct_answer"}
+
+
+def test_first_tokens_differ_per_row(vocabulary):
+    """最初のステップで、行ごとにそれぞれのスキーマの先頭に続くトークンだけを許すことを確認"""
+    processor = JsonSchemaLogitsProcessor(vocabulary, row_segments=[quiz_schema(1), grading_schema()])
+    processor.update([[], []])
+    quiz_ids, _ = processor.allowed(0)
+    grading_ids, _ = processor.allowed(1)
+    assert {vocabulary.texts[i] for i in quiz_ids} == {"[", '[{"'}
+    assert {vocabulary.texts[i] for i in grading_ids} == {"{", '{"'}
+
+
+def test_row_that_left_the_schema_only_allows_eos(vocabulary):
+    """スキーマから外れたトークンが入った行は EOS だけを許し、他の行には影響しないことを確認"""
+    processor = JsonSchemaLogitsProcessor(vocabulary, quiz_schema(1))
+    processor.update([[], []])
+    processor.update([[PIECES.index("犬")], [PIECES.index("[")]])
+    assert processor.allowed(0) == ([EOS], 0)
+    ids, _ = processor.allowed(1)
+    assert PIECES.index("{") in ids and EOS not in ids
+
+
+def test_logits_processor_masks_scores(vocabulary):
+    """__call__ が行ごとに許されないトークンのスコアを -inf にすることを確認"""
+    torch = pytest.importorskip("torch")
+    processor = JsonSchemaLogitsProcessor(vocabulary, row_segments=[quiz_schema(1), grading_schema()])
+    input_ids = torch.zeros((2, 3), dtype=torch.long)
+    scores = processor(input_ids, torch.zeros((2, len(vocabulary))))
+    assert torch.isfinite(scores[0, PIECES.index("[")]) and not torch.isfinite(scores[0, PIECES.index("{")])
+    assert torch.isfinite(scores[1, PIECES.index("{")]) and not torch.isfinite(scores[1, PIECES.index("[")])
+
+    input_ids = torch.tensor([[0, 0, 0, PIECES.index("[")], [0, 0, 0, PIECES.index("{")]])
+    scores = processor(input_ids, torch.zeros((2, len(vocabulary))))
+    assert torch.isfinite(scores[0, PIECES.index("{")])
+    assert torch.isfinite(scores[1, PIECES.index('"')]) and not torch.isfinite(scores[1, PIECES.index("[")])
+    assert not torch.isfinite(scores[1, EOS])
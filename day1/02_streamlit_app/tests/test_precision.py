@@ -0,0 +1,31 @@
+import pytest
+
+from precision import BF16, FP32, INT8, cpu_supports_bf16, dtype_name, read_cpu_flags, resolve_precision
+
+
+def test_auto_follows_cpu_flags():
+    """config.MODEL_PRECISION = "auto" は CPU が bf16 命令を持つ場合だけ bf16 を選ぶことを確認"""
+    assert resolve_precision("auto", "cpu", {"avx512_bf16"}) == BF16
+    assert resolve_precision("auto", "cpu", {"amx_bf16"}) == BF16
+    assert resolve_precision("auto", "cpu", {"avx2"}) == FP32
+    assert resolve_precision(None, "cuda", set()) == BF16
+
+
+def test_int8_loads_in_fp32_on_cpu_only():
+    """int8 は CPU では fp32 で読み込んでから量子化し、GPU では bf16 にすることを確認"""
+    assert resolve_precision(" INT8 ", "cpu", set()) == INT8
+    assert dtype_name(INT8) == "float32"
+    assert resolve_precision("int8", "cuda", set()) == BF16
+
+
+def test_unknown_precision_raises():
+    """不明な精度を指定するとエラーになることを確認"""
+    with pytest.raises(ValueError):
+        resolve_precision("fp8", "cpu", set())
+
+
+def test_missing_cpuinfo_means_no_bf16(tmp_path):
+    """/proc/cpuinfo を読めない環境では bf16 命令が無いものとして扱うことを確認"""
+    flags = read_cpu_flags(str(tmp_path / "missing"))
+    assert flags == set()
+    assert not cpu_supports_bf16(flags)
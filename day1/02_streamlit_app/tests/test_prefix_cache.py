@@ -0,0 +1,68 @@
+import os
+
+from prefix_cache import PrefixCachedPipeline, PrefixTrie, crop_cache
+from quiz_prompt import build_quiz_prompt
+from stub_model import StubPipeline, StubTokenizer
+
+
+class FakeCache:
+    """get_seq_length と crop だけを持つ KV キャッシュ（crop に渡された値を記録する）"""
+
+    def __init__(self, length):
+        self.length = length
+        self.crops = []
+
+    def get_seq_length(self):
+        return self.length
+
+    def crop(self, max_length):
+        self.crops.append(max_length)
+        self.length = max_length if max_length >= 0 else self.length + max_length
+
+
+def test_quiz_prompts_share_the_instruction_prefix():
+    """ジャンル・問題数が違うクイズのプロンプト同士は、固定の指示文の分だけ一致することを確認"""
+    tokenizer = StubTokenizer()
+    first = tokenizer.encode(build_quiz_prompt("動物", 3))
+    second = tokenizer.encode(build_quiz_prompt("歴史", 5))
+    common = len(os.path.commonprefix([first, second]))
+    trie = PrefixTrie(max_bytes=1000)
+    trie.insert(first, "kv-動物", nbytes=10)
+
+    assert common > 100
+    assert trie.longest_prefix(second) == (common, "kv-動物")
+
+
+def test_memory_bounded_eviction():
+    """バイト数の上限を超えると最も古く使われたエントリが削除されることを確認"""
+    trie = PrefixTrie(max_bytes=25)
+    trie.insert([1, 2], "a", nbytes=10)
+    trie.insert([3, 4], "b", nbytes=10)
+    trie.longest_prefix([1, 2])  # a を最近使ったことにする
+    trie.insert([5, 6], "c", nbytes=10)
+
+    assert trie.longest_prefix([3, 4]) == (0, None)
+    assert trie.longest_prefix([1, 2]) == (2, "a")
+    assert trie.total_bytes == 20
+    assert trie.evictions == 1
+
+
+def test_crop_cache_uses_negative_offset():
+    """crop_cache が末尾から取り除くトークン数を負の値で crop に渡し、短いキャッシュはそのままにすることを確認"""
+    past = FakeCache(10)
+    crop_cache(past, 7)
+    crop_cache(past, 9)
+
+    assert past.crops == [-3]
+    assert past.get_seq_length() == 7
+
+
+def test_batch_calls_are_delegated_to_the_pipeline():
+    """スロットごとの複数プロンプトの呼び出しは、キャッシュを使わず元の pipeline に委譲することを確認"""
+    pipe = StubPipeline()
+    cached = PrefixCachedPipeline(pipe, max_bytes=1000)
+    prompts = ["a", "b"]
+
+    assert cached(prompts, max_new_tokens=4, batch_size=2) == pipe(prompts, max_new_tokens=4, batch_size=2)
+    assert cached.stats["lookups"] == 0
+    assert cached.tokenizer is pipe.tokenizer
@@ -0,0 +1,59 @@
+import pytest
+
+from prompt_guard import PromptGuard, PromptTooLongError, TokenCache, model_context_length, truncate_ids
+from stub_model import StubPipeline, StubTokenizer
+
+
+class CountingTokenizer(StubTokenizer):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def encode(self, text, add_special_tokens=True):
+        self.calls += 1
+        return super().encode(text, add_special_tokens)
+
+
+def test_repeated_prompt_is_tokenized_once():
+    """同じクイズのプロンプトを何度確認してもトークン化は1回だけであることを確認"""
+    tokenizer = CountingTokenizer()
+    guard = PromptGuard(tokenizer, max_context=100, min_new_tokens=10)
+
+    for _ in range(3):
+        guard.check("ジャンル「動物」の問題を3問", max_new_tokens=20)
+
+    assert tokenizer.calls == 1
+    assert isinstance(guard.cache, TokenCache)
+
+
+def test_reject_is_the_default_strategy():
+    """既定（config.PROMPT_TRUNCATION = "reject"）では長すぎるプロンプトで PromptTooLongError になることを確認"""
+    guard = PromptGuard(StubTokenizer(), max_context=20, min_new_tokens=10)
+
+    with pytest.raises(PromptTooLongError) as e:
+        guard.check("あ" * 11, max_new_tokens=5)
+    assert (e.value.prompt_tokens, e.value.max_prompt_tokens) == (11, 10)
+
+
+@pytest.mark.parametrize("strategy, expected", [
+    ("head", [5, 6, 7, 8]),
+    ("tail", [1, 2, 3, 4]),
+    ("middle", [1, 2, 7, 8]),
+])
+def test_truncate_ids(strategy, expected):
+    """切り詰め方ごとに残る部分を確認"""
+    assert truncate_ids([1, 2, 3, 4, 5, 6, 7, 8], 4, strategy) == expected
+
+
+def test_token_budget_is_clamped_to_remaining_context():
+    """見積もった max_new_tokens がコンテキストの残りを超える場合は減らされることを確認"""
+    guard = PromptGuard(StubTokenizer(), max_context=20, min_new_tokens=4)
+
+    guarded = guard.check("あ" * 12, max_new_tokens=100)
+
+    assert (guarded.max_new_tokens, guarded.clamped, guarded.truncated) == (8, True, False)
+
+
+def test_model_context_length_falls_back_to_default():
+    """スタブのようにモデルの設定が無い場合は既定値を使うことを確認"""
+    assert model_context_length(StubPipeline(), default=1234) == 1234
@@ -0,0 +1,182 @@
+import json
+import random
+
+import pytest
+
+from quiz_parallel import assign_subtopics, generate_in_slots, question_key, split_slots
+from quiz_prompt import is_valid_question
+
+
+def question(text, answer=0):
+    return {"question": text, "options": ["A", "B", "C", "D"], "answer": answer}
+
+
+def make_prompt(count, subtopic, variant):
+    return {"count": count, "subtopic": subtopic, "variant": variant}
+
+
+class FakeBatch:
+    """
+    generate_batch の代わり（ラウンドごとに、スロットの出題番号から生成文を返す）
+
+    respond(prompt, count, round) が問題のリスト（または生成文）を返します。
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+
+    def __call__(self, prompts, counts):
+        round_ = len(self.calls)
+        self.calls.append((prompts, counts))
+        outputs = []
+        for prompt, count in zip(prompts, counts):
+            output = self.respond(prompt, count, round_)
+            outputs.append(output if isinstance(output, str) else json.dumps(output, ensure_ascii=False))
+        return outputs
+
+
+def unique(prompt, count, round_):
+    """出題番号ごとに異なる問題を count 問返す"""
+    return [question(f"問題{prompt['variant']}-{i}") for i in range(count)]
+
+
+def test_split_slots():
+    """n が per_slot で割り切れない場合、最後のスロットが余りの問題数になることを確認"""
+    assert split_slots(7, 3) == [3, 3, 1]
+    assert split_slots(6, 3) == [3, 3]
+    assert split_slots(2, 5) == [2]
+    assert split_slots(3, 0) == [1, 1, 1]
+
+
+def test_assign_subtopics_covers_all_before_repeating():
+    """サブテーマがスロット数以上あれば重複せず、足りなければ一巡してから繰り返すことを確認"""
+    topics = assign_subtopics(["a", "b", "c"], 5, random.Random(0))
+    assert sorted(topics[:3]) == ["a", "b", "c"]
+    assert topics[3:] == topics[:2]
+    assert assign_subtopics([], 2, random.Random(0)) == [None, None]
+
+
+def test_generates_all_slots_in_one_batch_when_n_is_not_divisible():
+    """7問を3問ずつに分けると、3つのプロンプトを1回のバッチで生成し7問を返すことを確認"""
+    fake = FakeBatch(unique)
+    stats = {}
+
+    questions = list(generate_in_slots(fake, make_prompt, 7, per_slot=3, subtopics=["a", "b"], seed=0, stats=stats))
+
+    assert len(questions) == 7
+    assert len({question_key(q) for q in questions}) == 7
+    assert len(fake.calls) == 1
+    prompts, counts = fake.calls[0]
+    assert counts == [3, 3, 1]
+    assert [p["count"] for p in prompts] == [3, 3, 1]
+    assert {p["subtopic"] for p in prompts} <= {"a", "b"}
+    assert stats == {"rounds": 1, "prompts": 3, "failed_slots": 0}
+
+
+def test_retries_only_the_failed_slot_with_a_new_variant():
+    """形式が崩れたスロットだけを、出題番号を変えて次のラウンドで再生成することを確認"""
+    def respond(prompt, count, round_):
+        if round_ == 0 and prompt["subtopic"] == "bad":
+            return "すみません、問題を作れませんでした"
+        return unique(prompt, count, round_)
+
+    fake = FakeBatch(respond)
+    stats = {}
+
+    questions = list(generate_in_slots(
+        fake, make_prompt, 2, per_slot=1, subtopics=["good", "bad"], validate=is_valid_question, seed=0, stats=stats
+    ))
+
+    assert len(questions) == 2
+    first_prompts, _ = fake.calls[0]
+    retry_prompts, retry_counts = fake.calls[1]
+    failed = next(p for p in first_prompts if p["subtopic"] == "bad")
+    assert retry_prompts == [{"count": 1, "subtopic": "bad", "variant": failed["variant"] + 1}]
+    assert retry_counts == [1]
+    assert stats == {"rounds": 2, "prompts": 3, "failed_slots": 1}
+
+
+def test_partial_slot_regenerates_only_the_shortfall():
+    """3問中1問しか生成できなかったスロットは、不足の2問だけを再生成することを確認"""
+    def respond(prompt, count, round_):
+        return unique(prompt, 1 if round_ == 0 else count, round_)
+
+    fake = FakeBatch(respond)
+
+    questions = list(generate_in_slots(fake, make_prompt, 3, per_slot=3, seed=0))
+
+    assert len(questions) == 3
+    assert [counts for _, counts in fake.calls] == [[3], [2]]
+
+
+def test_duplicates_are_rejected_and_regenerated():
+    """question_key が同じ問題（空白の違いのみを含む）は1問だけ採用し、不足分を再生成することを確認"""
+    def respond(prompt, count, round_):
+        if round_ == 0:
+            return [question("犬は 何科？"), question("犬は何科？ ", answer=1)]
+        return [question("猫は何科？")]
+
+    fake = FakeBatch(respond)
+    stats = {}
+
+    questions = list(generate_in_slots(fake, make_prompt, 2, per_slot=2, seed=0, stats=stats))
+
+    assert [q["question"] for q in questions] == ["犬は 何科？", "猫は何科？"]
+    assert [counts for _, counts in fake.calls] == [[2], [1]]
+    assert stats["failed_slots"] == 1
+
+
+def test_duplicates_across_slots_in_the_same_round():
+    """同じラウンドの別のスロットと重複した問題も不採用になることを確認"""
+    def respond(prompt, count, round_):
+        if round_ == 0:
+            return [question("同じ問題")]
+        return unique(prompt, count, round_)
+
+    fake = FakeBatch(respond)
+
+    questions = list(generate_in_slots(fake, make_prompt, 3, per_slot=1, seed=0))
+
+    assert len({question_key(q) for q in questions}) == 3
+    assert len(fake.calls[1][0]) == 2
+
+
+def test_returns_partial_results_when_retries_run_out():
+    """max_retries 回再生成しても足りない場合、生成できた分だけを返すことを確認"""
+    def respond(prompt, count, round_):
+        return [question("毎回同じ問題")]
+
+    fake = FakeBatch(respond)
+    stats = {}
+
+    questions = list(generate_in_slots(fake, make_prompt, 3, per_slot=3, max_retries=2, seed=0, stats=stats))
+
+    assert [q["question"] for q in questions] == ["毎回同じ問題"]
+    assert len(fake.calls) == 3
+    assert stats == {"rounds": 3, "prompts": 3, "failed_slots": 3}
+
+
+def test_raises_with_raw_output_when_nothing_is_generated():
+    """1問も生成できなかった場合は ValueError を送出し、raw_output に最後の生成文が入ることを確認"""
+    fake = FakeBatch(lambda prompt, count, round_: f"失敗 {round_}")
+
+    with pytest.raises(ValueError) as excinfo:
+        list(generate_in_slots(fake, make_prompt, 2, per_slot=1, max_retries=1, seed=0))
+
+    assert excinfo.value.raw_output == "失敗 1"
+    assert len(fake.calls) == 2
+
+
+def test_yields_each_round_before_retrying():
+    """最初のラウンドで採用した問題は、再生成を待たずに返されることを確認"""
+    def respond(prompt, count, round_):
+        return unique(prompt, 1, round_)
+
+    fake = FakeBatch(respond)
+    questions = generate_in_slots(fake, make_prompt, 2, per_slot=2, seed=0)
+
+    next(questions)
+    assert len(fake.calls) == 1
+    next(questions)
+    assert len(fake.calls) == 2
@@ -0,0 +1,211 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from quiz_pool import QuizPool
+
+
+def question(text, answer=0):
+    return {"question": text, "options": ["A", "B", "C", "D"], "answer": answer}
+
+
+class FakeStore:
+    """SQLite の代わりのプール（ジャンルごとの問題のリスト）"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, genre, questions):
+        self.rows.setdefault(genre, []).extend(questions)
+
+    def take(self, genre, n):
+        rows = self.rows.get(genre, [])
+        taken, self.rows[genre] = rows[:n], rows[n:]
+        return taken
+
+    def depths(self):
+        return {genre: len(rows) for genre, rows in self.rows.items()}
+
+
+class FakeGenerate:
+    """generate の代わり（呼び出しを記録し、呼び出しごとに異なる問題を n 問返す）"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, genre, n, subtopic=None, variant=None, cancel=None):
+        self.calls.append((genre, n, subtopic, variant))
+        if self.error is not None:
+            raise self.error
+        return [question(f"{genre}{variant}-{i}") for i in range(n)]
+
+
+def make_pool(store, generate, genres=("動物",), **kwargs):
+    return QuizPool(generate, store.add, store.take, store.depths, genres, **kwargs)
+
+
+def test_refill_once_fills_up_to_the_target():
+    """refill_batch 問ずつ補充し、目標数を超えて生成しないことを確認"""
+    store = FakeStore()
+    generate = FakeGenerate()
+    pool = make_pool(store, generate, target_size=7, refill_batch=3)
+
+    while pool.refill_once() is not None:
+        pass
+
+    assert store.depths() == {"動物": 7}
+    assert [call[1] for call in generate.calls] == [3, 3, 1]
+    assert pool.stats["動物"]["refills"] == 3
+
+
+def test_refill_once_picks_the_most_depleted_genre():
+    """最も不足しているジャンルから補充することを確認"""
+    store = FakeStore()
+    store.add("動物", [question("犬")] * 4)
+    generate = FakeGenerate()
+    pool = make_pool(store, generate, genres=["動物", "歴史"], target_size=5, refill_batch=5)
+
+    assert pool.refill_once() == "歴史"
+    assert generate.calls[0][:2] == ("歴史", 5)
+    assert pool.refill_once() == "動物"
+    assert generate.calls[1][:2] == ("動物", 1)
+
+
+def test_refill_uses_subtopics_and_new_variants():
+    """補充ごとに出題番号を変え、サブテーマを順に使うことを確認"""
+    generate = FakeGenerate()
+    pool = make_pool(FakeStore(), generate, target_size=10, refill_batch=1, subtopics={"動物": ["鳥", "魚"]})
+
+    pool.refill_once()
+    pool.refill_once()
+
+    (_, _, first_topic, first_variant), (_, _, second_topic, second_variant) = generate.calls
+    assert second_variant == first_variant + 1
+    assert {first_topic, second_topic} == {"鳥", "魚"}
+
+
+def test_take_stats_and_snapshot():
+    """take の回数・ヒット（n 問そろった回数）・出題数を数え、snapshot に反映されることを確認"""
+    store = FakeStore()
+    store.add("動物", [question(f"問題{i}") for i in range(5)])
+    pool = make_pool(store, FakeGenerate(), target_size=10)
+
+    assert len(pool.take("動物", 3)) == 3
+    assert len(pool.take("動物", 3)) == 2
+
+    assert pool.stats["動物"]["requests"] == 2
+    assert pool.stats["動物"]["hits"] == 1
+    assert pool.stats["動物"]["served"] == 5
+    row = pool.snapshot()[0]
+    assert row["depth"] == 0 and row["target"] == 10
+    assert row["hit_rate"] == 0.5
+    assert row["refills"] == 0 and row["avg_refill_seconds"] is None
+
+
+def test_refill_errors_are_counted():
+    """生成に失敗した補充は refill_errors に数え、プールには何も追加しないことを確認"""
+    store = FakeStore()
+    pool = make_pool(store, FakeGenerate(error=ValueError("形式エラー")), target_size=3)
+
+    assert pool.refill_once() is None
+
+    assert pool.stats["動物"]["refill_errors"] == 1
+    assert pool.stats["動物"]["refills"] == 0
+    assert store.depths().get("動物", 0) == 0
+
+
+def test_cancelled_refill_is_not_an_error():
+    """foreground の生成中に中断された補充は失敗として数えないことを確認"""
+    pool = make_pool(FakeStore(), FakeGenerate(error=RuntimeError("中断")), target_size=3)
+
+    with pool.foreground():
+        assert pool.refill_once() is None
+
+    assert pool.stats["動物"]["refill_errors"] == 0
+
+
+# --- database.py のプール操作（SQLite） ---
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """一時ファイルの SQLite を使う database モジュール"""
+    module = pytest.importorskip("database")
+    monkeypatch.setattr(module, "DB_FILE", str(tmp_path / "quiz.db"))
+    module.init_db()
+    return module
+
+
+def insert_raw(database, genre, questions):
+    """add_pool_questions の重複除去を通さずにプールへ行を追加する"""
+    conn = sqlite3.connect(database.DB_FILE)
+    try:
+        conn.executemany(
+            f"INSERT INTO {database.QUIZ_POOL_TABLE} (genre, quiz_json) VALUES (?, ?)",
+            [(genre, json.dumps(q, ensure_ascii=False)) for q in questions],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_add_pool_questions_skips_duplicates(database):
+    """プールに既にある問題・空白だけが異なる問題は追加しないことを確認"""
+    assert database.add_pool_questions("動物", [question("犬は何科？"), question("犬は 何科？")]) == 1
+    assert database.add_pool_questions("動物", [question("犬は何科？ "), question("猫は何科？")]) == 1
+    assert database.add_pool_questions("歴史", [question("犬は何科？")]) == 1
+
+    assert database.get_pool_depths() == {"動物": 2, "歴史": 1}
+
+
+def test_take_pool_questions_returns_unique_questions_oldest_first(database):
+    """古い順に重複しない問題を取り出し、取り出した問題とその重複をプールから削除することを確認"""
+    insert_raw(database, "動物", [question("A"), question("A "), question("B"), question("C"), question("B")])
+
+    taken = database.take_pool_questions("動物", 2)
+
+    assert [q["question"] for q in taken] == ["A", "B"]
+    # 残るのは取り出さなかった C だけ（A・B の重複も削除される）
+    assert database.get_pool_depths() == {"動物": 1}
+    assert [q["question"] for q in database.take_pool_questions("動物", 5)] == ["C"]
+
+
+def test_concurrent_takes_do_not_share_questions(database):
+    """複数のスレッドから同時に取り出しても、同じ問題を二重に返さないことを確認"""
+    database.add_pool_questions("動物", [question(f"問題{i}") for i in range(40)])
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(8)
+
+    def take():
+        barrier.wait()
+        questions = database.take_pool_questions("動物", 5)
+        with lock:
+            results.extend(q["question"] for q in questions)
+
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 40
+    assert len(set(results)) == 40
+    assert database.get_pool_depths().get("動物", 0) == 0
+
+
+def test_pool_refills_database_up_to_the_target(database):
+    """QuizPool が SQLite のプールを目標数まで補充し、取り出した分を再び補充することを確認"""
+    pool = QuizPool(FakeGenerate(), database.add_pool_questions, database.take_pool_questions,
+                    database.get_pool_depths, ["動物"], target_size=6, refill_batch=4)
+
+    while pool.refill_once() is not None:
+        pass
+    assert database.get_pool_depths() == {"動物": 6}
+
+    assert len(pool.take("動物", 3)) == 3
+    assert pool.refill_once() == "動物"
+    assert database.get_pool_depths() == {"動物": 6}
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from quiz_prompt import is_valid_question
+from quiz_stream import QuizGeneration, QuizStreamParser, StopCriteria, stream_questions
+
+
+def question(i):
+    return {"question": f"問題{i}", "options": ["A", "B", "C", "D"], "answer": i % 4}
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def feed_all(parser, chunks):
+    objects = []
+    for chunk in chunks:
+        objects += parser.feed(chunk)
+    return objects
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_yields_each_object_when_it_closes(size):
+    """テキスト片の区切り方に関係なく、オブジェクトが閉じた時点で順に取り出されることを確認"""
+    text = json.dumps([question(0), question(1), question(2)], ensure_ascii=False)
+    parser = QuizStreamParser(validate=is_valid_question)
+
+    assert feed_all(parser, chunked(text, size)) == [question(0), question(1), question(2)]
+    assert parser.rejected == 0
+
+
+def test_first_object_is_available_before_the_list_ends():
+    """リストが閉じる前でも、閉じたオブジェクトは取り出せることを確認"""
+    parser = QuizStreamParser()
+    first = parser.feed('[{"question": "a", "options": ["1", "2", "3", "4"], "answer": 0}, {"question": "b", ')
+    assert [q["question"] for q in first] == ["a"]
+
+
+def test_escaped_quotes_and_braces_in_strings():
+    """文字列の中のエスケープされた " や { } で区切りを読み違えないことを確認"""
+    q = {"question": 'これは "{引用}" と \\ を含む問題ですか}', "options": ["{", "}", "\"", "\\"], "answer": 1}
+    parser = QuizStreamParser(validate=is_valid_question)
+
+    assert feed_all(parser, chunked(json.dumps([q], ensure_ascii=False), 2)) == [q]
+
+
+def test_trailing_commas_are_tolerated():
+    """末尾のカンマがあってもデコードできることを確認"""
+    text = '[{"question": "a", "options": ["1", "2", "3", "4",], "answer": 2,},]'
+    assert QuizStreamParser().feed(text) == [{"question": "a", "options": ["1", "2", "3", "4"], "answer": 2}]
+
+
+@pytest.mark.parametrize("prefix", [
+    "Here is {your quiz: ",
+    'Here is "your quiz: ',
+    'Here is {"your quiz: ',
+    "```json\n",
+])
+def test_recovers_from_stray_brace_or_quote_in_prose(prefix):
+    """JSON の前の説明文に対応しない { や " があっても、問題のオブジェクトから読み直せることを確認"""
+    text = prefix + json.dumps([question(0), question(1)], ensure_ascii=False) + "\n```"
+    parser = QuizStreamParser(validate=is_valid_question)
+
+    assert feed_all(parser, chunked(text, 1)) == [question(0), question(1)]
+
+
+def test_invalid_objects_are_rejected():
+    """形式の正しくないオブジェクトやデコードできないオブジェクトは読み飛ばして数えることを確認"""
+    text = '[{"question": "a", "options": ["1"], "answer": 0}, {broken}, ' + json.dumps(question(1)) + "]"
+    parser = QuizStreamParser(validate=is_valid_question)
+
+    assert parser.feed(text) == [question(1)]
+    assert parser.rejected == 2
+
+
+def test_stream_questions_stops_at_n():
+    """n 問そろった時点で取り出しを終え、停止条件をセットして生成元を閉じることを確認"""
+    consumed = []
+
+    def chunks():
+        for chunk in chunked(json.dumps([question(i) for i in range(5)]), 7):
+            consumed.append(chunk)
+            yield chunk
+
+    stop = StopCriteria()
+    stream = chunks()
+    questions = list(stream_questions(stream, 2, validate=is_valid_question, stop=stop))
+
+    assert questions == [question(0), question(1)]
+    assert stop.stopped and stop.stopped_rows() == [True]
+    assert len("".join(consumed)) < len(json.dumps([question(i) for i in range(5)]))
+    assert stream.gi_frame is None  # 閉じられている
+
+
+def test_stream_questions_raises_without_valid_questions():
+    """有効な問題が1問も無い場合は、生成文を raw_output に持つ ValueError になることを確認"""
+    with pytest.raises(ValueError) as e:
+        list(stream_questions(iter(["説明文だけです"]), 3))
+    assert e.value.raw_output == "説明文だけです"
+
+
+def test_stop_criteria_follows_external_cancel():
+    """外部のキャンセルがセットされると、全行の生成を止めることを確認"""
+    import threading
+
+    cancel = threading.Event()
+    stop = StopCriteria(cancel=cancel, rows=3)
+    assert stop.stopped_rows() == [False] * 3
+    cancel.set()
+    assert stop.stopped_rows() == [True] * 3
+
+
+def test_quiz_generation_exposes_questions_as_they_arrive():
+    """用意済みの問題に続けて、バックグラウンドで生成された問題が順に参照できることを確認"""
+    quiz = QuizGeneration(3, [question(0)], stream=iter([question(1), question(2)]))
+
+    assert quiz.wait(3, timeout=5)
+    assert quiz.questions == [question(0), question(1), question(2)]
+    assert quiz.wait(4, timeout=5) is False
+    assert quiz.finished and quiz.total == 3 and quiz.error is None
+
+
+def test_quiz_generation_keeps_error():
+    """生成の失敗は error に保持され、生成できた問題数が total になることを確認"""
+    def failing():
+        yield question(0)
+        raise ValueError("boom")
+
+    quiz = QuizGeneration(3, stream=failing())
+    quiz.wait(3, timeout=5)
+
+    assert quiz.finished and quiz.total == 1
+    assert str(quiz.error) == "boom"
@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..")
+FASTAPI_DIR = os.path.join(APP_DIR, "..", "03_FastAPI")
+
+# 03_FastAPI と同じ内容を持つモジュール（片方だけを直すと、もう片方のテストでは気付けないため一致を確認する）
+SHARED_MODULES = ["prompt_guard", "backends", "stub_model", "precision", "prefix_cache"]
+
+
+def source_without_note(path):
+    """「（…と同じ内容です）」の注記の行を除いたソース"""
+    with open(path, encoding="utf-8") as f:
+        return [line for line in f if "と同じ内容です）" not in line]
+
+
+@pytest.mark.parametrize("name", SHARED_MODULES)
+def test_module_matches_fastapi_copy(name):
+    """03_FastAPI の同名モジュールと、注記の行以外が一致することを確認"""
+    ours = source_without_note(os.path.join(APP_DIR, f"{name}.py"))
+    theirs = source_without_note(os.path.join(FASTAPI_DIR, f"{name}.py"))
+    assert ours == theirs
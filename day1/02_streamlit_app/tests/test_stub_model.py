@@ -0,0 +1,31 @@
+import json
+
+from stub_model import StubPipeline, StubTokenizer, quiz_responder
+
+
+def test_quiz_responder_depends_on_the_prompt():
+    """クイズのプロンプトごとに決定的で、出題番号が変われば別の問題になることを確認"""
+    first = quiz_responder("クイズ ジャンル「動物」の問題を2問（出題番号 1）")
+
+    assert first == quiz_responder("クイズ ジャンル「動物」の問題を2問（出題番号 1）")
+    assert first != quiz_responder("クイズ ジャンル「動物」の問題を2問（出題番号 2）")
+    assert len(json.loads(first)) == 2
+    assert quiz_responder("こんにちは") is None
+
+
+def test_stub_pipeline_stops_at_max_new_tokens():
+    """応答が max_new_tokens より長い場合は途中で打ち切ることを確認（1文字 = 1トークン）"""
+    pipe = StubPipeline(responder=quiz_responder)
+    prompt = "クイズ ジャンル「動物」の問題を5問"
+
+    text = pipe(prompt, max_new_tokens=10, return_full_text=False)[0]["generated_text"]
+
+    assert text == quiz_responder(prompt)[:10]
+
+
+def test_stub_tokenizer_round_trip():
+    """1文字が1トークンになり、decode で元の文字列に戻ることを確認"""
+    tokenizer = StubTokenizer()
+    ids = tokenizer.encode("あいう")
+    assert len(ids) == 3
+    assert tokenizer.decode(ids) == "あいう"
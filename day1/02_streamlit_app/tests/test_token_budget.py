@@ -0,0 +1,153 @@
+import math
+
+import pytest
+
+from token_budget import (
+    LIST_OVERHEAD_TOKENS,
+    TokenBudgetEstimator,
+    is_truncated,
+    percentile,
+    tokens_per_question,
+)
+
+
+class FakeLog:
+    """SQLite の代わりの生成ログ（load の呼び出し回数を数える）"""
+
+    def __init__(self, rows=()):
+        self.rows = [tuple(row) for row in rows]  # (genre, requested, parsed, tokens, max_new_tokens, truncated)
+        self.loads = 0
+
+    def load(self, genre, limit):
+        self.loads += 1
+        rows = [row[1:] for row in reversed(self.rows) if genre is None or row[0] == genre]
+        return rows[:limit]
+
+    def save(self, genre, requested, parsed, tokens, max_new_tokens, truncated):
+        self.rows.append((genre, requested, parsed, tokens, max_new_tokens, truncated))
+
+
+def completed(genre, parsed, per_question, max_new_tokens=1024):
+    """parsed 問を1問あたり per_question トークンで生成し終えた履歴"""
+    return (genre, parsed, parsed, parsed * per_question + LIST_OVERHEAD_TOKENS, max_new_tokens, False)
+
+
+def estimator(log, **kwargs):
+    params = dict(default_per_question=100, percentile=95, margin=1.0, min_samples=3, window=10,
+                  min_tokens=64, max_tokens=1024)
+    params.update(kwargs)
+    return TokenBudgetEstimator(log.load, log.save, **params)
+
+
+def test_percentile_nearest_rank():
+    """nearest-rank のパーセンタイルを確認"""
+    values = list(range(1, 21))
+    assert percentile(values, 95) == 19
+    assert percentile(values, 100) == 20
+    assert percentile(values, 50) == 10
+    assert percentile([7], 95) == 7
+
+
+def test_tokens_per_question_for_completed_run():
+    """最後まで生成できた場合は、リストの分を除いたトークン数を問題数で割ることを確認"""
+    assert tokens_per_question(4, 4 * 50 + LIST_OVERHEAD_TOKENS, 1024, False) == 50
+
+
+def test_tokens_per_question_for_truncated_run():
+    """打ち切られた場合は parsed 問と parsed+1 問の間（max_new_tokens / (parsed + 0.5)）とすることを確認"""
+    assert tokens_per_question(3, 1000, 700, True) == pytest.approx(200)
+
+
+@pytest.mark.parametrize("truncated", [False, True])
+def test_tokens_per_question_ignores_runs_without_questions(truncated):
+    """1問も解析できなかった生成は（打ち切りでも）1問の長さの情報にしないことを確認"""
+    assert tokens_per_question(0, 1024, 1024, truncated) is None
+
+
+def test_tokens_per_question_is_clamped_to_max_new_tokens():
+    """1問あたりのトークン数は max_new_tokens を超えないことを確認"""
+    assert tokens_per_question(1, 5000, 256, False) == 256
+
+
+def test_is_truncated():
+    """問題がそろわず max_new_tokens をほぼ使い切った場合だけ打ち切りとみなすことを確認"""
+    assert is_truncated(5, 3, 1020, 1024)
+    assert not is_truncated(5, 5, 1024, 1024)
+    assert not is_truncated(5, 3, 600, 1024)
+
+
+def test_budget_uses_default_without_history():
+    """履歴が無い場合は既定の1問あたりのトークン数から求めることを確認"""
+    budget = estimator(FakeLog()).budget("動物", 3)
+    assert budget == 3 * 100 + LIST_OVERHEAD_TOKENS
+
+
+def test_budget_uses_high_percentile_of_genre_history():
+    """ジャンルの履歴が十分あれば、そのパーセンタイルに問題数を掛けることを確認"""
+    log = FakeLog([completed("動物", 2, per) for per in (40, 50, 60, 70)] + [completed("歴史", 2, 300)] * 4)
+    assert estimator(log).budget("動物", 5) == 5 * 70 + LIST_OVERHEAD_TOKENS
+
+
+def test_budget_falls_back_to_all_genres():
+    """ジャンルの履歴が min_samples 未満なら全ジャンルの履歴を使うことを確認"""
+    log = FakeLog([completed("歴史", 2, 80)] * 5 + [completed("動物", 2, 500)])
+    assert estimator(log, percentile=50).budget("動物", 2) == 2 * 80 + LIST_OVERHEAD_TOKENS
+
+
+@pytest.mark.parametrize("n, expected", [(0, 64), (100, 1024)])
+def test_budget_is_clamped(n, expected):
+    """max_new_tokens は min_tokens 以上 max_tokens 以下になることを確認"""
+    assert estimator(FakeLog()).budget("動物", n) == expected
+
+
+def test_truncated_runs_without_questions_raise_the_budget():
+    """1問も収まらずに打ち切られた生成は、見積もりを小さくせず打ち切りの割合として引き上げることを確認"""
+    rows = [completed("動物", 2, 50)] * 4
+    base = estimator(FakeLog(rows)).budget("動物", 2)
+    truncated = [("動物", 2, 0, 64, 64, True)] * 4
+    budget = estimator(FakeLog(rows + truncated)).budget("動物", 2)
+    # サンプルは 50 のまま、打ち切りの割合 0.5 の半分だけ余裕が増える
+    assert budget == math.ceil(2 * 50 * 1.25) + LIST_OVERHEAD_TOKENS
+    assert budget > base
+
+
+def test_budget_loads_history_once():
+    """budget を何度呼んでも履歴の読み込みはジャンルごとに1回だけであることを確認"""
+    log = FakeLog([completed("動物", 2, 50)] * 5)
+    budget = estimator(log)
+    for _ in range(10):
+        budget.budget("動物", 3)
+    assert log.loads == 1
+
+
+def test_observe_updates_cached_estimate_without_reloading():
+    """observe の結果が読み込み直さずに次の見積もりへ反映されることを確認"""
+    log = FakeLog([completed("動物", 2, 50)] * 5)
+    budget = estimator(log, percentile=100)
+    assert budget.budget("動物", 2) == 2 * 50 + LIST_OVERHEAD_TOKENS
+
+    truncated = budget.observe("動物", 2, 2, 2 * 90 + LIST_OVERHEAD_TOKENS, 1024)
+
+    assert not truncated
+    assert budget.budget("動物", 2) == 2 * 90 + LIST_OVERHEAD_TOKENS
+    assert log.loads == 1
+    assert log.rows[-1] == completed("動物", 2, 90)
+
+
+def test_observe_keeps_only_the_window():
+    """メモリの履歴は直近 window 件だけを使うことを確認"""
+    log = FakeLog([completed("動物", 2, 500)] * 5)
+    budget = estimator(log, window=5, percentile=100)
+    budget.budget("動物", 2)
+    for _ in range(5):
+        budget.observe("動物", 2, 2, 2 * 40 + LIST_OVERHEAD_TOKENS, 1024)
+    assert budget.budget("動物", 2) == 2 * 40 + LIST_OVERHEAD_TOKENS
+
+
+def test_observe_skips_malformed_runs():
+    """打ち切りでもなく1問も解析できなかった生成は記録しないことを確認"""
+    log = FakeLog()
+    budget = estimator(log)
+    assert budget.observe("動物", 3, 0, 100, 1024) is False
+    assert log.rows == []
+    assert budget.stats == {"observed": 0, "truncated": 0}
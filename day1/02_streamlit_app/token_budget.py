@@ -0,0 +1,142 @@
+# token_budget.py
+"""
+クイズ生成の max_new_tokens の見積もり
+
+問題数に関係なく max_new_tokens=1024 を指定すると、問題数が少ない場合は不要な上限でデコードの時間を
+見込み過ぎ、問題数が多い場合は途中で切れてしまいます。TokenBudgetEstimator は過去の生成
+（SQLite に記録）からジャンルごとの1問あたりのトークン数を学習し、その高いパーセンタイルに
+問題数を掛けて max_new_tokens を決めます。
+
+上限に達して問題がそろわなかった生成（打ち切り）も記録し、見積もりを引き上げて自己修正します。
+履歴と見積もりはメモリに保持し、SQLite はジャンルごとに最初の1回だけ読み込みます。
+"""
+
+import collections
+import math
+import threading
+
+# リストの括弧・区切りなど、問題数に比例しない分のトークン数
+LIST_OVERHEAD_TOKENS = 8
+
+
+def percentile(values, q):
+    """values の q パーセンタイル（nearest-rank）"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def is_truncated(requested, parsed, tokens, max_new_tokens):
+    """問題がそろわないまま max_new_tokens に達した（ほぼ使い切った）かどうか"""
+    return parsed < requested and tokens >= max_new_tokens * 0.98
+
+
+def tokens_per_question(parsed, tokens, max_new_tokens, truncated):
+    """
+    1回の生成から求めた1問あたりのトークン数（見積もりに使えない場合は None）
+
+    打ち切られた場合は、parsed 問は収まり parsed+1 問目が収まらなかったので、その間の値とします。
+    1問も解析できなかった場合は1問の長さが分からないため None とします（打ち切りの割合には数えます）。
+    """
+    if parsed <= 0:
+        return None
+    if truncated:
+        value = max_new_tokens / (parsed + 0.5)
+    else:
+        value = max(tokens - LIST_OVERHEAD_TOKENS, 1) / parsed
+    return min(value, max(max_new_tokens, 1))
+
+
+class TokenBudgetEstimator:
+    """ジャンルごとの1問あたりのトークン数を学習し、問題数に応じた max_new_tokens を返す"""
+
+    def __init__(self, load_history, save_history, default_per_question=160, percentile=95, margin=1.1,
+                 min_samples=5, window=100, min_tokens=64, max_tokens=4096):
+        """
+        Args:
+            load_history (callable): genre, limit を受け取り、新しい順の
+                (requested, parsed, tokens, max_new_tokens, truncated) のリストを返す関数（genre=None で全ジャンル）
+            save_history (callable): genre, requested, parsed, tokens, max_new_tokens, truncated を保存する関数
+            default_per_question (float): 履歴が少ない場合の1問あたりのトークン数
+            percentile (float): 1問あたりのトークン数の何パーセンタイルを使うか
+            margin (float): 見積もりに掛ける余裕（直近の打ち切りの割合の半分だけさらに引き上げる）
+            min_samples (int): ジャンルの履歴だけで見積もるのに必要な件数（未満なら全ジャンルの履歴を使う）
+            window (int): 見積もりに使う直近の件数
+            min_tokens (int): max_new_tokens の下限
+            max_tokens (int): max_new_tokens の上限
+        """
+        self._load = load_history
+        self._save = save_history
+        self.default_per_question = default_per_question
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        # ジャンル（None は全ジャンル）-> 新しい順の履歴、ジャンル -> 見積もり
+        self._history = {}
+        self._estimates = {}
+        self.stats = {"observed": 0, "truncated": 0}
+
+    def _rows(self, genre):
+        """genre の直近の履歴（初回だけ load_history で読み込む。ロックを持った状態で呼ぶ）"""
+        if genre not in self._history:
+            self._history[genre] = collections.deque(self._load(genre, self.window), maxlen=self.window)
+        return self._history[genre]
+
+    def _estimate(self, genre):
+        rows = self._rows(genre)
+        if len(rows) < self.min_samples:
+            rows = self._rows(None)
+        samples = []
+        for requested, parsed, tokens, max_new_tokens, truncated in rows:
+            value = tokens_per_question(parsed, tokens, max_new_tokens, bool(truncated))
+            if value is not None:
+                samples.append(value)
+        truncation_rate = sum(1 for row in rows if row[4]) / len(rows) if rows else 0.0
+        # 打ち切られた生成のサンプルは実際より小さめなので、直近の打ち切りの割合に応じて引き上げる
+        margin = self.margin + truncation_rate / 2
+        if len(samples) < self.min_samples:
+            return self.default_per_question * margin
+        return percentile(samples, self.percentile) * margin
+
+    def per_question(self, genre):
+        """genre の1問あたりのトークン数の見積もり（余裕を含む）"""
+        with self._lock:
+            if genre not in self._estimates:
+                self._estimates[genre] = self._estimate(genre)
+            return self._estimates[genre]
+
+    def budget(self, genre, n):
+        """genre の問題を n 問生成するための max_new_tokens"""
+        tokens = math.ceil(n * self.per_question(genre)) + LIST_OVERHEAD_TOKENS
+        return max(self.min_tokens, min(self.max_tokens, tokens))
+
+    def observe(self, genre, requested, parsed, tokens, max_new_tokens):
+        """
+        1回の生成の結果を記録する（st を使わないため、バックグラウンドのスレッドからも呼べる）
+
+        Returns:
+            bool: 打ち切られたかどうか
+        """
+        truncated = is_truncated(requested, parsed, tokens, max_new_tokens)
+        if parsed == 0 and not truncated:
+            # 形式が崩れただけの生成は見積もりに使わない
+            return False
+        row = (requested, parsed, tokens, max_new_tokens, truncated)
+        with self._lock:
+            self.stats["observed"] += 1
+            self.stats["truncated"] += int(truncated)
+            # 保存と履歴への追加を同じロックの中で行い、初回の読み込みと重複・欠落しないようにする
+            try:
+                self._save(genre, requested, parsed, tokens, max_new_tokens, truncated)
+            except Exception as e:
+                print(f"生成トークン数の記録に失敗しました: {e}")
+            for key in (genre, None):
+                if key in self._history:
+                    self._history[key].appendleft(row)
+            # 全ジャンルの履歴で見積もっているジャンルもあるため、見積もりはすべて作り直す
+            self._estimates.clear()
+        return truncated
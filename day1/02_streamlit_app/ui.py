@@ -1,53 +1,72 @@
 # ui.py
 
 import streamlit as st
-from llm import generate_quiz, check_quiz_answer
+import pandas as pd
+from config import QUIZ_GENRES, QUIZ_POOL_TARGET_SIZE
+from llm import serve_quiz, check_quiz_answer, load_quiz_pool
 from database import save_quiz_result, get_quiz_history
 from data import get_sample_questions
 
 
-def display_quiz_page(pipe):
+def display_quiz_page(backend):
     """
     クイズ出題ページを表示する
     """
     st.header("🧩 クイズチャレンジ")
 
     # ジャンル選択と問題数スライダー
-    genre = st.selectbox("ジャンルを選択してください", ["動物", "健康", "スポーツ", "科学", "社会"])
+    genre = st.selectbox("ジャンルを選択してください", QUIZ_GENRES)
     count = st.slider("問題数", min_value=1, max_value=20, value=5)
 
     # セッションステート初期化
-    if 'quiz_list' not in st.session_state:
-        st.session_state.quiz_list = []
+    if 'quiz' not in st.session_state:
+        st.session_state.quiz = None
         st.session_state.current_idx = 0
         st.session_state.score = 0
 
-    # 出題開始
+    # 出題開始（問題は生成できたものから順に出題する）
     if st.button("出題開始"):
-        st.session_state.quiz_list = generate_quiz(pipe, genre, count)
+        st.session_state.quiz = serve_quiz(backend, genre, count)
         st.session_state.current_idx = 0
         st.session_state.score = 0
 
-    # 問題生成エラーチェック
-    if not st.session_state.quiz_list:
+    # 事前生成プールの状態
+    if backend is not None and QUIZ_POOL_TARGET_SIZE > 0:
+        display_quiz_pool_stats(load_quiz_pool(backend))
+
+    quiz = st.session_state.quiz
+    if quiz is None:
         st.info("「出題開始」を押してクイズを生成してください。")
         return
 
-    # 現在の問題番号
+    # 現在の問題番号（まだ生成されていなければ生成されるまで待つ）
     idx = st.session_state.current_idx
-    total = len(st.session_state.quiz_list)
+    if idx >= len(quiz.questions) and not quiz.finished:
+        with st.spinner(f"問題 {idx+1} を生成しています..."):
+            quiz.wait(idx + 1)
+    total = quiz.total
+
+    # 問題生成エラーチェック
+    if quiz.finished and quiz.error is not None:
+        st.error(f"クイズ生成中にエラーが発生しました: {quiz.error}")
+        output = getattr(quiz.error, "raw_output", None)
+        if output is not None:
+            st.error(f"@@ raw output start @@\n{output}\n@@ raw output end @@")
+    if total == 0:
+        st.info("「出題開始」を押してクイズを生成してください。")
+        return
 
     # 全問題終了後
     if idx >= total:
         st.success(f"全{total}問終了！ 最終スコア：{st.session_state.score}")
         if st.button("再度チャレンジ"):
-            st.session_state.quiz_list = []
+            st.session_state.quiz = None
             st.session_state.current_idx = 0
             st.session_state.score = 0
         return
 
     # 問題取得
-    q = st.session_state.quiz_list[idx]
+    q = quiz.questions[idx]
     # 辞書形式でない場合エラー
     if not isinstance(q, dict):
         st.error("問題の生成に失敗しました。再度「出題開始」を押してください。")
@@ -58,6 +77,8 @@ def display_quiz_page(pipe):
 
     # 表示
     st.subheader(f"問題 {idx+1} ／ {total}")
+    if not quiz.finished:
+        st.caption(f"残りの問題を生成しています（{len(quiz.questions)} 問生成済み）")
     st.write(question_text)
 
     # 選択肢ボタン表示
@@ -82,7 +103,7 @@ def display_quiz_page(pipe):
         # 万一選択肢がない場合のフォールバックテキスト入力
         ans = st.text_input("あなたの解答を入力してください", key=f"text_{idx}")
         if st.button("解答を提出", key=f"sub_{idx}"):
-            msg, is_correct, correct_ans = check_quiz_answer(pipe, question_text, ans)
+            msg, is_correct, correct_ans = check_quiz_answer(backend, question_text, ans)
             st.write(msg)
             save_quiz_result(genre, question_text, correct_ans, ans, is_correct)
             if is_correct:
@@ -94,6 +115,25 @@ def display_quiz_page(pipe):
     st.sidebar.metric("スコア", st.session_state.score)
 
 
+def display_quiz_pool_stats(pool):
+    """
+    ジャンルごとの事前生成プールの問題数・ヒット率・補充時間を表示する
+    """
+    with st.expander("問題プールの状態"):
+        df = pd.DataFrame(pool.snapshot()).rename(columns={
+            "genre": "ジャンル",
+            "depth": "問題数",
+            "target": "目標数",
+            "hit_rate": "ヒット率",
+            "served": "出題数",
+            "refills": "補充回数",
+            "refill_errors": "補充失敗",
+            "avg_refill_seconds": "平均補充時間(秒)",
+            "last_refill_seconds": "直近の補充時間(秒)",
+        })
+        st.dataframe(df, use_container_width=True)
+
+
 def display_quiz_history_page():
     """
     過去のクイズ履歴ページを表示する
@@ -1,27 +1,130 @@
 import os
+import asyncio
+import contextlib
+import json
+import logging
 import torch
-from transformers import pipeline
 import time
+import uuid
+import threading
 import traceback
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import uvicorn
 import nest_asyncio
 from pyngrok import ngrok
+from batching import MicroBatcher
+from batch_generation import BatchRequestError, generate_in_chunks, validate_prompts
+from streaming import format_sse, run_streaming_generation, iterate_in_thread, StreamTimer
+from concurrency import InferenceExecutor, QueueFullError, DeadlineExceededError
+from scheduler import CostAwareScheduler
+from cancellation import (
+    CancellationCriteria, CancellationToken, GenerationCancelled, DISCONNECTED, DEADLINE, watch_disconnect,
+)
+from timing import ChromeTraceRecorder, GenerationTimer, RequestTimings, format_server_timing, run_timed
+from cache import (
+    ResponseCache, SingleFlight, cached_response, is_cacheable, make_cache_key, unpack_cached_response,
+)
+from prefix_cache import PrefixCachedPipeline
+from prompt_guard import PromptGuard, PromptTooLongError, model_context_length
+from sessions import SessionChatGenerator, SessionStore, render_chat_prompt
+from metrics import LAG_BUCKETS, MetricsRegistry, monitor_event_loop_lag
+from replicas import ReplicaPool
+from precision import load_text_generation_pipeline, quantize_model, resolve_precision, torch_dtype
+from backends import BACKENDS, StubBackend, TransformersBackend
+from speculative import AssistedGenerator, load_draft_model
+from lifecycle import ModelLifecycle, LOADING, WARMING, READY, FAILED
+
+# プロセスの起動時刻（準備完了までの時間の計測に使う）
+PROCESS_START = time.time()
 
 # --- 設定 ---
 # モデル名を設定
 MODEL_NAME = "google/gemma-2-2b-jpn-it"  # お好みのモデルに変更可能です
 print(f"モデル名を設定: {MODEL_NAME}")
+# 投機的デコーディング用のドラフトモデル（メインモデルより小さいモデル。未設定で無効）
+DRAFT_MODEL_NAME = os.environ.get("DRAFT_MODEL_NAME") or None
 
 # --- モデル設定クラス ---
 class Config:
-    def __init__(self, model_name=MODEL_NAME):
+    def __init__(self, model_name=MODEL_NAME, draft_model_name=DRAFT_MODEL_NAME):
         self.MODEL_NAME = model_name
+        self.DRAFT_MODEL_NAME = draft_model_name
+        # ドラフトモデルが1回に提案するトークン数（0 で transformers の既定値）
+        self.DRAFT_NUM_TOKENS = int(os.environ.get("DRAFT_NUM_TOKENS", "0"))
+        # 読み込み時の精度（auto / fp32 / bf16 / int8）。auto は CPU の bf16 対応を見て決める
+        self.MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "auto")
+        # STUB_MODEL=1 で実際のモデルの代わりに決定的なスタブを使う（ベンチマーク用）
+        self.STUB_MODEL = os.environ.get("STUB_MODEL", "0") == "1"
+        # 推論バックエンド（transformers / stub）。STUB_MODEL=1 は INFERENCE_BACKEND=stub と同じ
+        self.INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "stub" if self.STUB_MODEL else "transformers")
+        self.STUB_TOKEN_DELAY_MS = float(os.environ.get("STUB_TOKEN_DELAY_MS", "0"))  # 1トークンあたりの待ち時間
+        # マイクロバッチ設定（BATCH_MAX_SIZE=1 でバッチ処理を無効化）
+        self.BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+        self.BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+        # マルチプロセスのレプリカ数（2以上でワーカープロセスごとにモデルを保持する）
+        self.REPLICAS = int(os.environ.get("REPLICAS", "1"))
+        self.REPLICA_TORCH_THREADS = int(os.environ.get("REPLICA_TORCH_THREADS", "0"))  # 0 で割り当て CPU 数
+        self.REPLICA_PIN_CPUS = os.environ.get("REPLICA_PIN_CPUS", "1") == "1"
+        self.REPLICA_WEIGHTS_DIR = os.environ.get("REPLICA_WEIGHTS_DIR") or None
+        # 推論の同時実行数・待ち行列の長さ・リクエストの既定期限（秒）
+        # 同時実行数の既定値はレプリカ数（各レプリカに1つずつ）
+        self.INFERENCE_MAX_CONCURRENCY = int(os.environ.get("INFERENCE_MAX_CONCURRENCY", str(self.REPLICAS)))
+        self.INFERENCE_MAX_QUEUE = int(os.environ.get("INFERENCE_MAX_QUEUE", "16"))
+        self.REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", "300"))
+        # /generate のスケジューラ（SCHEDULER_ENABLED=0 で到着順）
+        # 予想コストの小さいリクエストを優先し、CLIENT_ID_HEADER の値ごとに公平に実行する
+        self.SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") == "1"
+        self.SCHEDULER_MAX_ACTIVE = int(os.environ.get(
+            "SCHEDULER_MAX_ACTIVE", str(self.BATCH_MAX_SIZE * self.INFERENCE_MAX_CONCURRENCY)
+        ))
+        self.SCHEDULER_MAX_OUTSTANDING_TOKENS = int(os.environ.get("SCHEDULER_MAX_OUTSTANDING_TOKENS", "8192"))
+        self.SCHEDULER_MAX_WAITING = int(os.environ.get("SCHEDULER_MAX_WAITING", "64"))
+        self.SCHEDULER_AGING_RATE = float(os.environ.get("SCHEDULER_AGING_RATE", "100"))  # 待ち1秒あたりのコスト
+        self.CLIENT_ID_HEADER = os.environ.get("CLIENT_ID_HEADER", "X-API-Key")
+        # リクエストの期限（秒）を指定するヘッダ（本文の timeout が優先）
+        self.TIMEOUT_HEADER = os.environ.get("TIMEOUT_HEADER", "X-Request-Timeout")
+        # フェーズ別の所要時間を Chrome のトレース形式で保持するイベント数（0 で無効）
+        # TRACE_FILE を指定すると終了時にファイルへ書き出す（GET /trace でも取得できる）
+        self.TRACE_MAX_EVENTS = int(os.environ.get("TRACE_MAX_EVENTS", "0"))
+        self.TRACE_FILE = os.environ.get("TRACE_FILE") or None
+        # 応答キャッシュ（CACHE_MAX_SIZE=0 で無効、CACHE_DB を指定すると SQLite に永続化）
+        self.CACHE_MAX_SIZE = int(os.environ.get("CACHE_MAX_SIZE", "256"))
+        self.CACHE_TTL = float(os.environ.get("CACHE_TTL", "3600"))
+        self.CACHE_DB = os.environ.get("CACHE_DB") or None
+        # 共通の前置部に対する KV キャッシュの上限（MB、0 で無効）
+        self.PREFIX_CACHE_MAX_MB = float(os.environ.get("PREFIX_CACHE_MAX_MB", "256"))
+        # /chat のセッションごとの KV キャッシュの上限（MB、0 で無効）と、使われないセッションを破棄するまでの秒数
+        self.SESSION_CACHE_MAX_MB = float(os.environ.get("SESSION_CACHE_MAX_MB", "512"))
+        self.SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", "600"))
+        # プロンプトの長さの制限。MAX_CONTEXT_TOKENS=0 でモデルのコンテキスト長を使い、
+        # MAX_PROMPT_TOKENS=0 でコンテキスト長から MIN_NEW_TOKENS を引いた値を上限とする
+        self.MAX_CONTEXT_TOKENS = int(os.environ.get("MAX_CONTEXT_TOKENS", "0"))
+        self.MAX_PROMPT_TOKENS = int(os.environ.get("MAX_PROMPT_TOKENS", "0"))
+        self.MIN_NEW_TOKENS = int(os.environ.get("MIN_NEW_TOKENS", "16"))
+        # 上限を超えたプロンプトの扱い（reject: 413 を返す / head・tail・middle: その部分を削って切り詰める）
+        self.PROMPT_TRUNCATION = os.environ.get("PROMPT_TRUNCATION", "reject")
+        # トークン列をキャッシュするプロンプト数
+        self.TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "1024"))
+        # /generate/batch で1回に受け付ける最大プロンプト数
+        self.BATCH_MAX_PROMPTS = int(os.environ.get("BATCH_MAX_PROMPTS", "1000"))
+        # ウォームアップに使うプロンプト長（トークン数、カンマ区切り。空でウォームアップなし）
+        self.WARMUP_PROMPT_LENGTHS = [
+            int(n) for n in os.environ.get("WARMUP_PROMPT_LENGTHS", "16,128,512").split(",") if n.strip()
+        ]
+
+config = Config(MODEL_NAME, DRAFT_MODEL_NAME)
 
-config = Config(MODEL_NAME)
+# --- ログ設定 ---
+# リクエストごとの詳細ログは DEBUG レベル（LOG_LEVEL=DEBUG で出力）
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger("llm_api")
 
 # --- FastAPIアプリケーション定義 ---
 app = FastAPI(
@@ -51,94 +154,432 @@ class SimpleGenerationRequest(BaseModel):
     do_sample: Optional[bool] = True
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 0.9
+    timeout: Optional[float] = None  # このリクエストの期限（秒）。省略時は REQUEST_TIMEOUT
+    assisted: Optional[bool] = False  # ドラフトモデルによる投機的デコーディングを使うか
+    timings: Optional[bool] = False  # 応答にフェーズ別の所要時間を含めるか
 
 class GenerationResponse(BaseModel):
     generated_text: str
     response_time: float
+    cached: bool = False
+    coalesced: bool = False  # 同時に届いた同一リクエストの生成結果を共有した場合 True
+    speculative: Optional[Dict[str, Any]] = None  # 投機的デコーディングの採用率などの統計
+    timings: Optional[Dict[str, Any]] = None  # フェーズ別の所要時間（秒）とトークン数
+    truncated: bool = False  # プロンプトが長すぎたため切り詰めた場合 True
+
+# 複数プロンプトをまとめて処理するリクエスト
+class BatchGenerationRequest(BaseModel):
+    prompts: List[str]
+    max_new_tokens: Optional[int] = 512
+    do_sample: Optional[bool] = True
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+    batch_size: Optional[int] = None  # 1回の推論にまとめるプロンプト数。省略時は BATCH_MAX_SIZE
+    timeout: Optional[float] = None
+
+# 会話履歴（Message のリスト）に続く応答を生成するリクエスト
+class ChatRequest(BaseModel):
+    messages: List[Message]
+    session_id: Optional[str] = None  # 同じ ID で続けると前のターンまでの KV キャッシュを再利用する
+    max_new_tokens: Optional[int] = 512
+    do_sample: Optional[bool] = True
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+    timeout: Optional[float] = None
+
+class ChatResponse(BaseModel):
+    message: Message
+    session_id: str
+    response_time: float
+    reused_tokens: int = 0  # セッションの KV キャッシュから再利用したトークン数
+    prefilled_tokens: int = 0  # 新たにプレフィルしたトークン数
+
+class BatchItemResult(BaseModel):
+    generated_text: str
+    cached: bool = False
+    truncated: bool = False
+
+class BatchGenerationResponse(BaseModel):
+    results: List[BatchItemResult]
+    response_time: float
+    num_batches: int
+    prompts_per_sec: float
 
 # --- モデル関連の関数 ---
-# モデルのグローバル変数
+# モデルのグローバル変数（生成は backend を通して行い、model は pipeline 互換のオブジェクト）
+backend = None
 model = None
+# 投機的デコーディング用（DRAFT_MODEL_NAME を設定した場合のみ）
+assisted_generator = None
+# プロンプトの長さの制限とトークン列のキャッシュ（モデルの読み込み後に作成）
+prompt_guard = None
+# /chat のセッションごとの KV キャッシュ（単一プロセスで実際のモデルを使う場合のみ）
+session_store = None
+session_generator = None
+# モデルの読み込み状態（loading / warming / ready / failed）
+lifecycle = ModelLifecycle(process_start=PROCESS_START)
 
 def load_model():
-    """推論用のLLMモデルを読み込む"""
-    global model  # グローバル変数を更新するために必要
+    """推論用のLLMモデルを読み込み、推論バックエンドを返す"""
+    global backend, model, assisted_generator, session_store, session_generator  # グローバル変数を更新するために必要
     try:
+        load_start = time.time()
+        if config.INFERENCE_BACKEND not in BACKENDS:
+            raise ValueError(f"不明な推論バックエンドです: {config.INFERENCE_BACKEND}（{', '.join(BACKENDS)} のいずれか）")
+        if config.INFERENCE_BACKEND == "stub":
+            backend = StubBackend(token_delay=config.STUB_TOKEN_DELAY_MS / 1000)
+            MODEL_LOAD_SECONDS.set(time.time() - load_start)
+            print(f"スタブモデルを使用します（1トークンあたり {config.STUB_TOKEN_DELAY_MS}ms）")
+            model = backend.pipe
+            return backend
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"使用デバイス: {device}")
-        pipe = pipeline(
-            "text-generation",
-            model=config.MODEL_NAME,
-            model_kwargs={"torch_dtype": torch.bfloat16},
-            device=device
-        )
+        precision = resolve_precision(config.MODEL_PRECISION, device)
+        print(f"使用デバイス: {device}  精度: {precision}")
+        if config.REPLICAS > 1:
+            if config.DRAFT_MODEL_NAME:
+                print("警告: レプリカモードでは投機的デコーディングは利用できません")
+            # ワーカープロセスごとにレプリカを持ち、最も空いているレプリカに振り分ける
+            pipe = ReplicaPool(
+                config.MODEL_NAME,
+                num_replicas=config.REPLICAS,
+                torch_threads=config.REPLICA_TORCH_THREADS or None,
+                pin_cpus=config.REPLICA_PIN_CPUS,
+                precision=precision,
+                weights_dir=config.REPLICA_WEIGHTS_DIR,
+                prefix_cache_mb=config.PREFIX_CACHE_MAX_MB,
+            ).start()
+            MODEL_LOAD_SECONDS.set(time.time() - load_start)
+            print(f"モデル '{config.MODEL_NAME}' のレプリカを {config.REPLICAS} 個起動しました")
+            backend = TransformersBackend(pipe)
+            model = pipe
+            return backend
+
+        pipe = load_text_generation_pipeline(config.MODEL_NAME, precision, device)
+        # バッチ推論用にパディングを設定（デコーダのみのモデルは左パディング）
+        if pipe.tokenizer.pad_token is None:
+            pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        pipe.tokenizer.padding_side = "left"
+        if config.PREFIX_CACHE_MAX_MB > 0:
+            # 単一プロンプトの推論では共通の前置部の KV キャッシュを再利用する
+            pipe = PrefixCachedPipeline(pipe, max_bytes=int(config.PREFIX_CACHE_MAX_MB * 1024 * 1024))
+        if config.SESSION_CACHE_MAX_MB > 0:
+            # /chat では会話の前のターンまでの KV キャッシュをセッションごとに保持する
+            session_store = SessionStore(
+                max_bytes=int(config.SESSION_CACHE_MAX_MB * 1024 * 1024),
+                idle_timeout=config.SESSION_IDLE_TIMEOUT,
+            )
+            session_generator = SessionChatGenerator(pipe, session_store)
+        if config.DRAFT_MODEL_NAME:
+            draft_model, draft_tokenizer = load_draft_model(config.DRAFT_MODEL_NAME, torch_dtype(precision), device)
+            quantize_model(draft_model, precision)
+            assisted_generator = AssistedGenerator(
+                pipe, draft_model, draft_tokenizer, num_assistant_tokens=config.DRAFT_NUM_TOKENS or None
+            )
+            print(f"ドラフトモデル '{config.DRAFT_MODEL_NAME}' の読み込みに成功しました")
+        MODEL_LOAD_SECONDS.set(time.time() - load_start)
         print(f"モデル '{config.MODEL_NAME}' の読み込みに成功しました")
+        backend = TransformersBackend(pipe)
         model = pipe  # グローバル変数を更新
-        return pipe
+        return backend
     except Exception as e:
         error_msg = f"モデル '{config.MODEL_NAME}' の読み込みに失敗: {e}"
         print(error_msg)
         traceback.print_exc()  # 詳細なエラー情報を出力
         return None
 
-def extract_assistant_response(outputs, user_prompt):
-    """モデルの出力からアシスタントの応答を抽出する"""
-    assistant_response = ""
+def clean_completion(text):
+    """生成文の前後の空白を除く（空の場合は既定の応答を返す）"""
+    text = text.strip()
+    if not text:
+        logger.warning("アシスタントの応答を生成できませんでした。")
+        return "応答を生成できませんでした。"
+    return text
+
+# --- 推論の実行管理 ---
+# ブロッキングする推論は専用スレッドプールで実行し、イベントループを止めない
+inference = InferenceExecutor(
+    max_concurrency=config.INFERENCE_MAX_CONCURRENCY,
+    max_queue_size=config.INFERENCE_MAX_QUEUE,
+)
+
+# --- フェーズ別の所要時間のトレース ---
+trace_recorder = ChromeTraceRecorder(config.TRACE_MAX_EVENTS) if config.TRACE_MAX_EVENTS > 0 else None
+
+# --- スケジューラ ---
+scheduler = None
+if config.SCHEDULER_ENABLED:
+    scheduler = CostAwareScheduler(
+        max_active=config.SCHEDULER_MAX_ACTIVE,
+        max_outstanding_tokens=config.SCHEDULER_MAX_OUTSTANDING_TOKENS,
+        max_waiting=config.SCHEDULER_MAX_WAITING,
+        aging_rate=config.SCHEDULER_AGING_RATE,
+        retry_after=inference.retry_after,
+    )
+
+def client_id(raw_request):
+    """公平キューに使うクライアントの識別子（API キーのヘッダ、無ければ接続元アドレス）"""
+    key = raw_request.headers.get(config.CLIENT_ID_HEADER)
+    if key:
+        return key
+    return raw_request.client.host if raw_request.client else "anonymous"
+
+async def acquire_slot(client, prompt_tokens, max_new_tokens, deadline):
+    """
+    スケジューラで実行の順番を待って実行枠を確保し、枠を返すための AsyncExitStack を返す
+
+    ストリーミングのようにハンドラが返った後も生成が続く場合は、生成の終了時に aclose() で枠を返します。
+    """
+    stack = contextlib.AsyncExitStack()
+    if scheduler is None:
+        inference.check_admission(deadline)
+        return stack
+    waited = await stack.enter_async_context(scheduler.slot(client, prompt_tokens, max_new_tokens, deadline))
+    SCHEDULER_WAIT.observe(waited)
+    return stack
+
+async def run_scheduled(client, prompt_tokens, max_new_tokens, deadline, run):
+    """スケジューラで実行の順番を待ってから run() を実行する"""
+    async with await acquire_slot(client, prompt_tokens, max_new_tokens, deadline):
+        return await run()
+
+def overloaded_exception(e):
+    """QueueFullError を Retry-After 付きの HTTPException に変換する"""
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def ensure_model_ready():
+    """モデルの準備ができていなければ Retry-After 付きの 503 を送出する"""
+    if not lifecycle.ready:
+        raise HTTPException(
+            status_code=503,
+            detail=f"モデルの準備ができていません（状態: {lifecycle.state}）。後でもう一度お試しください。",
+            headers={"Retry-After": str(lifecycle.retry_after())},
+        )
+
+def generation_params(request):
+    """リクエストから pipeline に渡す生成パラメータを取り出す"""
+    return {
+        "max_new_tokens": request.max_new_tokens,
+        "do_sample": request.do_sample,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+    }
+
+def request_deadline(request, raw_request=None):
+    """リクエストの処理期限（time.monotonic() 基準）を返す（本文の timeout → ヘッダ → 既定値の順）"""
+    timeout = request.timeout
+    if not timeout and raw_request is not None:
+        try:
+            timeout = float(raw_request.headers.get(config.TIMEOUT_HEADER) or 0)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{config.TIMEOUT_HEADER} ヘッダは秒数で指定してください。")
+    return time.monotonic() + (timeout if timeout and timeout > 0 else config.REQUEST_TIMEOUT)
+
+def create_prompt_guard(pipe):
+    """モデルのコンテキスト長に合わせた PromptGuard を作成する"""
+    guard = PromptGuard(
+        pipe.tokenizer,
+        max_context=config.MAX_CONTEXT_TOKENS or model_context_length(pipe),
+        max_prompt_tokens=config.MAX_PROMPT_TOKENS or None,
+        strategy=config.PROMPT_TRUNCATION,
+        min_new_tokens=config.MIN_NEW_TOKENS,
+        cache_size=config.TOKEN_CACHE_SIZE,
+    )
+    if isinstance(pipe, PrefixCachedPipeline):
+        # 長さの確認で得たトークン列を生成時にも使う
+        pipe.token_cache = guard.cache
+    return guard
+
+def guard_prompt(prompt, max_new_tokens, add_special_tokens=True):
+    """プロンプトの長さを確認する（上限を超えて切り詰めない設定の場合は 413 を送出する）"""
     try:
-        if outputs and isinstance(outputs, list) and len(outputs) > 0 and outputs[0].get("generated_text"):
-            generated_output = outputs[0]["generated_text"]
-            
-            if isinstance(generated_output, list):
-                # メッセージフォーマットの場合
-                if len(generated_output) > 0:
-                    last_message = generated_output[-1]
-                    if isinstance(last_message, dict) and last_message.get("role") == "assistant":
-                        assistant_response = last_message.get("content", "").strip()
-                    else:
-                        # 予期しないリスト形式の場合は最後の要素を文字列として試行
-                        print(f"警告: 最後のメッセージの形式が予期しないリスト形式です: {last_message}")
-                        assistant_response = str(last_message).strip()
-
-            elif isinstance(generated_output, str):
-                # 文字列形式の場合
-                full_text = generated_output
-                
-                # 単純なプロンプト入力の場合、プロンプト後の全てを抽出
-                if user_prompt:
-                    prompt_end_index = full_text.find(user_prompt)
-                    if prompt_end_index != -1:
-                        prompt_end_pos = prompt_end_index + len(user_prompt)
-                        assistant_response = full_text[prompt_end_pos:].strip()
-                    else:
-                        # 元のプロンプトが見つからない場合は、生成されたテキストをそのまま返す
-                        assistant_response = full_text
-                else:
-                    assistant_response = full_text
-            else:
-                print(f"警告: 予期しない出力タイプ: {type(generated_output)}")
-                assistant_response = str(generated_output).strip()  # 文字列に変換
+        guarded = prompt_guard.check(prompt, max_new_tokens, add_special_tokens)
+    except PromptTooLongError as e:
+        PROMPT_GUARD.inc(action="rejected")
+        raise HTTPException(status_code=413, detail=str(e))
+    if guarded.truncated:
+        PROMPT_GUARD.inc(action="truncated")
+        logger.info("プロンプトを切り詰めました: %d → %d トークン", guarded.original_tokens, guarded.prompt_tokens)
+    if guarded.clamped:
+        PROMPT_GUARD.inc(action="clamped")
+    return guarded
 
-    except Exception as e:
-        print(f"応答の抽出中にエラーが発生しました: {e}")
-        traceback.print_exc()
-        assistant_response = "応答の抽出に失敗しました。"  # エラーメッセージを設定
+def supports_cancellation(pipe):
+    """stopping_criteria で生成を途中で止められるか（レプリカはプロセス間で停止条件を共有できない）"""
+    return not isinstance(pipe, ReplicaPool)
+
+def record_cancelled_rows(texts, cancel_tokens, max_new_tokens):
+    """キャンセルされた行について、生成を省略したトークン数と破棄したトークン数を記録する"""
+    for text, token in zip(texts, cancel_tokens):
+        if token is None or not token.cancelled:
+            continue
+        generated = backend.count_tokens(text)
+        CANCELLED_TOKENS.inc(max(0, max_new_tokens - generated))
+        DISCARDED_TOKENS.inc(generated)
+
+# --- 応答キャッシュ ---
+response_cache = ResponseCache(
+    max_size=config.CACHE_MAX_SIZE,
+    ttl=config.CACHE_TTL,
+    db_path=config.CACHE_DB,
+)
+# キャッシュに入る前の同一の決定的リクエストを1回の生成にまとめる
+single_flight = SingleFlight()
+
+# --- マイクロバッチ処理 ---
+def run_model_batch(prompts, params):
+    """バッチ化されたプロンプトを推論バックエンドで生成し、プロンプトごとの生成文を返す"""
+    start = time.perf_counter()
+    texts = backend.generate_batch(prompts, **params)
+    MODEL_LATENCY.observe(time.perf_counter() - start)
+    return texts
+
+def run_model_batch_cancellable(prompts, params, cancel_tokens):
+    """run_model_batch をキャンセルの停止条件付きで実行し、キャンセルされた行のトークン数を記録する"""
+    if supports_cancellation(model):
+        params = dict(params, stopping_criteria=[CancellationCriteria(cancel_tokens)])
+    texts = run_model_batch(prompts, params)
+    record_cancelled_rows(texts, cancel_tokens, params["max_new_tokens"])
+    return texts
 
-    if not assistant_response:
-        print("警告: アシスタントの応答を抽出できませんでした。完全な出力:", outputs)
-        # デフォルトまたはエラー応答を返す
-        assistant_response = "応答を生成できませんでした。"
+def run_model_batch_timed(prompts, params, cancel_tokens):
+    """run_model_batch を実行し、プロンプトごとの (生成文, GenerationTimer) を返す"""
+    timer = GenerationTimer()
+    params = dict(params, streamer=timer)
+    if supports_cancellation(model) and any(token is not None for token in cancel_tokens):
+        # キャンセルされたリクエストの行は次のステップで生成を止める
+        params["stopping_criteria"] = [CancellationCriteria(cancel_tokens)]
+    timer.start()
+    texts = run_model_batch(prompts, params)
+    timer.end()
+    record_cancelled_rows(texts, cancel_tokens, params["max_new_tokens"])
+    return [(text, timer) for text in texts]
 
-    return assistant_response
+def run_assisted_timed(prompt, params, cancel_token):
+    """投機的デコーディングを1件実行し、((生成文, 統計), GenerationTimer) を返す"""
+    params = dict(params, stopping_criteria=[CancellationCriteria([cancel_token])])
+    (outputs, stats), timer = run_timed(assisted_generator, prompt, **params)
+    text = outputs[0]["generated_text"][len(prompt):]
+    record_cancelled_rows([text], [cancel_token], params["max_new_tokens"])
+    return (text, stats), timer
+
+def run_chat(session_id, token_ids, params, cancel_token):
+    """セッションの KV キャッシュを使って /chat の応答を1件生成する"""
+    start = time.perf_counter()
+    params = dict(params, stopping_criteria=[CancellationCriteria([cancel_token])])
+    result = session_generator(session_id, token_ids, **params)
+    MODEL_LATENCY.observe(time.perf_counter() - start)
+    return result
+
+batcher = MicroBatcher(
+    run_model_batch_timed,
+    max_batch_size=config.BATCH_MAX_SIZE,
+    max_wait_ms=config.BATCH_MAX_WAIT_MS,
+    executor=inference,
+    cancellable=True,
+)
+
+# --- メトリクス ---
+registry = MetricsRegistry()
+REQUESTS = registry.counter("llm_requests_total", "エンドポイント・ステータス別のリクエスト数", ("endpoint", "status"))
+REQUEST_LATENCY = registry.histogram("llm_request_duration_seconds", "エンドツーエンドの応答時間（秒）", ("endpoint",))
+MODEL_LATENCY = registry.histogram("llm_model_duration_seconds", "モデル推論1回（バッチ単位）の所要時間（秒）")
+PROMPT_TOKENS = registry.counter("llm_prompt_tokens_total", "処理したプロンプトのトークン数")
+GENERATED_TOKENS = registry.counter("llm_generated_tokens_total", "生成したトークン数")
+TOKENS_PER_SEC = registry.histogram(
+    "llm_tokens_per_second", "リクエストごとの生成速度（トークン/秒）",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+IN_FLIGHT = registry.gauge("llm_inflight_requests", "処理中の HTTP リクエスト数")
+MODEL_LOAD_SECONDS = registry.gauge("llm_model_load_seconds", "モデルの読み込みにかかった時間（秒）")
+registry.gauge("llm_queue_depth", "推論の実行待ちリクエスト数", callback=lambda: inference.queue_depth)
+registry.gauge("llm_inference_active", "推論を実行中のリクエスト数", callback=lambda: inference.active)
+registry.gauge("llm_model_ready", "モデルの準備ができていれば 1", callback=lambda: int(lifecycle.ready))
+registry.gauge("llm_warmup_seconds", "ウォームアップにかかった時間（秒）", callback=lambda: lifecycle.warmup_seconds or 0)
+registry.gauge("llm_time_to_ready_seconds", "プロセス起動から準備完了までの時間（秒）", callback=lambda: lifecycle.time_to_ready or 0)
+SPECULATIVE_DRAFTED = registry.counter("llm_speculative_drafted_tokens_total", "ドラフトモデルが提案したトークン数")
+SPECULATIVE_ACCEPTED = registry.counter("llm_speculative_accepted_tokens_total", "メインモデルが採用したドラフトのトークン数")
+registry.gauge(
+    "llm_speculative_acceptance_rate", "投機的デコーディングの累計採用率",
+    callback=lambda: assisted_generator.acceptance_rate() if assisted_generator else 0,
+)
+EVENT_LOOP_LAG = registry.histogram(
+    "llm_event_loop_lag_seconds", "イベントループの遅延（sleep の超過時間、秒）", buckets=LAG_BUCKETS
+)
+SCHEDULER_WAIT = registry.histogram("llm_scheduler_wait_seconds", "スケジューラで実行の順番を待った時間（秒）")
+registry.gauge("llm_scheduler_waiting", "スケジューラで順番を待っているリクエスト数",
+               callback=lambda: scheduler.waiting if scheduler else 0)
+registry.gauge("llm_scheduler_outstanding_tokens", "実行中のリクエストの max_new_tokens の合計",
+               callback=lambda: scheduler.outstanding_tokens if scheduler else 0)
+CANCELLED_REQUESTS = registry.counter(
+    "llm_cancelled_requests_total", "切断・期限切れでキャンセルしたリクエスト数", ("endpoint", "reason")
+)
+CANCELLED_TOKENS = registry.counter("llm_cancelled_tokens_total", "キャンセルにより生成を省略したトークン数")
+DISCARDED_TOKENS = registry.counter("llm_discarded_tokens_total", "キャンセルされたリクエストで生成済みだったトークン数")
+registry.gauge("llm_cache_hits", "応答キャッシュのヒット数", callback=lambda: response_cache.hits)
+registry.gauge("llm_cache_misses", "応答キャッシュのミス数", callback=lambda: response_cache.misses)
+registry.gauge(
+    "llm_coalesced_requests", "実行中の同一リクエストの結果を共有したリクエスト数", callback=lambda: single_flight.coalesced
+)
+PROMPT_GUARD = registry.counter(
+    "llm_prompt_guard_total", "長すぎるプロンプトの拒否・切り詰めと max_new_tokens の制限の回数", ("action",)
+)
+registry.gauge("llm_token_cache_hits", "プロンプトのトークン列のキャッシュのヒット数",
+               callback=lambda: prompt_guard.cache.hits if prompt_guard else 0)
+registry.gauge("llm_token_cache_misses", "プロンプトのトークン列のキャッシュのミス数",
+               callback=lambda: prompt_guard.cache.misses if prompt_guard else 0)
+SESSION_REUSED_TOKENS = registry.counter(
+    "llm_session_reused_tokens_total", "/chat でセッションの KV キャッシュから再利用したプロンプトのトークン数"
+)
+SESSION_PREFILLED_TOKENS = registry.counter("llm_session_prefilled_tokens_total", "/chat で新たにプレフィルしたトークン数")
+registry.gauge("llm_session_cache_sessions", "KV キャッシュを保持している /chat のセッション数",
+               callback=lambda: len(session_store) if session_store else 0)
+registry.gauge("llm_session_cache_bytes", "/chat のセッションの KV キャッシュの合計バイト数",
+               callback=lambda: session_store.total_bytes if session_store else 0)
+registry.gauge("llm_singleflight_inflight", "結果を共有できる実行中の生成の数", callback=lambda: single_flight.inflight)
+
+def record_generation(prompt_tokens, generated_tokens, elapsed):
+    """生成トークン数と生成速度を記録する"""
+    PROMPT_TOKENS.inc(prompt_tokens)
+    GENERATED_TOKENS.inc(generated_tokens)
+    if elapsed > 0:
+        TOKENS_PER_SEC.observe(generated_tokens / elapsed)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """全リクエストの件数・応答時間・処理中の件数を記録する"""
+    start = time.perf_counter()
+    IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        IN_FLIGHT.dec()
+        # ラベルの種類が増えすぎないよう、URL ではなくルート定義のパスを使う
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUESTS.inc(endpoint=endpoint, status=str(status))
+        REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
 
 # --- FastAPIエンドポイント定義 ---
 @app.on_event("startup")
 async def startup_event():
-    """起動時にモデルを初期化"""
-    load_model_task()  # バックグラウンドではなく同期的に読み込む
-    if model is None:
-        print("警告: 起動時にモデルの初期化に失敗しました")
-    else:
-        print("起動時にモデルの初期化が完了しました。")
+    """起動時にモデルの読み込みをバックグラウンドで開始（読み込み完了を待たずにリクエストを受け付ける）"""
+    threading.Thread(target=load_model_task, name="model-loader", daemon=True).start()
+    asyncio.get_running_loop().create_task(monitor_event_loop_lag(EVENT_LOOP_LAG))
+    print("起動時にモデルの読み込みをバックグラウンドで開始しました。準備状況は /ready で確認できます。")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """終了時にレプリカのワーカープロセスと推論スレッドを停止"""
+    if isinstance(model, ReplicaPool):
+        model.shutdown()
+    inference.shutdown()
+    if trace_recorder is not None and config.TRACE_FILE:
+        with open(config.TRACE_FILE, "w") as f:
+            json.dump(trace_recorder.export(), f)
+        print(f"トレースを保存しました: {config.TRACE_FILE}")
 
 @app.get("/")
 async def root():
@@ -147,70 +588,491 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """ヘルスチェックエンドポイント"""
-    global model
-    if model is None:
-        return {"status": "error", "message": "No model loaded"}
+    """ヘルスチェックエンドポイント（プロセスの生存確認。モデルの準備状況は /ready を使う）"""
+    result = {
+        "status": "ok",
+        "model": config.MODEL_NAME,
+        "model_state": lifecycle.state,
+        "cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "scheduler": scheduler.snapshot() if scheduler else None,
+        "sessions": session_store.stats() if session_store else None,
+        "prompt_guard": dict(prompt_guard.stats, token_cache=prompt_guard.cache.stats()) if prompt_guard else None,
+    }
+    if isinstance(model, ReplicaPool):
+        result["replicas"] = model.stats()
+    return result
 
-    return {"status": "ok", "model": config.MODEL_NAME}
+@app.get("/ready")
+async def readiness_check():
+    """レディネスチェック。モデルの準備ができるまでは 503 と Retry-After を返す"""
+    if not lifecycle.ready:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not_ready", "model": config.MODEL_NAME, **lifecycle.as_dict()},
+            headers={"Retry-After": str(lifecycle.retry_after())},
+        )
+    return {"status": "ready", "model": config.MODEL_NAME, **lifecycle.as_dict()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus テキスト形式のメトリクス"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/trace")
+async def trace_endpoint():
+    """フェーズ別の所要時間（Chrome のトレース形式。chrome://tracing や Perfetto で開ける）"""
+    if trace_recorder is None:
+        raise HTTPException(status_code=404, detail="トレースは無効です（TRACE_MAX_EVENTS を設定してください）。")
+    return trace_recorder.export()
 
 # 簡略化されたエンドポイント
 @app.post("/generate", response_model=GenerationResponse)
-async def generate_simple(request: SimpleGenerationRequest):
+async def generate_simple(request: SimpleGenerationRequest, raw_request: Request, response: Response):
     """単純なプロンプト入力に基づいてテキストを生成"""
-    global model
+    # 決定的なリクエストはキャッシュを確認する
+    start_time = time.time()
+    params = generation_params(request)
+    cache_key = None
+    if is_cacheable(params):
+        cache_key = make_cache_key(config.MODEL_NAME, request.prompt, params)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            cached_text, truncated = unpack_cached_response(cached)
+            response_time = time.time() - start_time
+            logger.debug("キャッシュから応答しました: %.4f秒", response_time)
+            return GenerationResponse(
+                generated_text=cached_text, response_time=response_time, cached=True, truncated=truncated
+            )
 
-    if model is None:
-        print("generateエンドポイント: モデルが読み込まれていません。読み込みを試みます...")
-        load_model_task()  # 再度読み込みを試みる
-        if model is None:
-            print("generateエンドポイント: モデルの読み込みに失敗しました。")
-            raise HTTPException(status_code=503, detail="モデルが利用できません。後でもう一度お試しください。")
+    ensure_model_ready()
+    if request.assisted and assisted_generator is None:
+        raise HTTPException(status_code=400, detail="ドラフトモデルが設定されていないため assisted は利用できません。")
 
-    try:
-        start_time = time.time()
-        print(f"シンプルなリクエストを受信: prompt={request.prompt[:100]}..., max_new_tokens={request.max_new_tokens}")  # 長いプロンプトは切り捨て
-
-        # プロンプトテキストで直接応答を生成
-        print("モデル推論を開始...")
-        outputs = model(
-            request.prompt,
-            max_new_tokens=request.max_new_tokens,
-            do_sample=request.do_sample,
-            temperature=request.temperature,
-            top_p=request.top_p,
+    deadline = request_deadline(request, raw_request)
+    # 切断・期限切れで生成を途中で止めるためのトークン
+    cancel_token = CancellationToken(deadline)
+    timings = RequestTimings()
+    with timings.phase("tokenize"):
+        # 長すぎるプロンプトは拒否または切り詰め、max_new_tokens を残りのコンテキストに収める
+        guarded = guard_prompt(request.prompt, request.max_new_tokens)
+    prompt = guarded.prompt
+    params["max_new_tokens"] = guarded.max_new_tokens
+    prompt_tokens = guarded.prompt_tokens
+    timings.prompt_tokens = prompt_tokens
+    client = client_id(raw_request)
+
+    def run_batched():
+        # 同時リクエストとまとめてバッチ推論する（推論自体は専用スレッドプールで実行）
+        return asyncio.wait_for(
+            batcher.submit(prompt, params, cancel_token),
+            timeout=max(0.0, deadline - time.monotonic()),
         )
-        print("モデル推論が完了しました。")
 
-        # アシスタント応答を抽出
-        assistant_response = extract_assistant_response(outputs, request.prompt)
-        print(f"抽出されたアシスタント応答: {assistant_response[:100]}...")  # 長い場合は切り捨て
+    def run_assisted():
+        # 投機的デコーディングはバッチにまとめず1件ずつ実行する
+        return inference.run(run_assisted_timed, prompt, params, cancel_token, deadline=deadline, check=False)
+
+    def generate_text(run=run_batched):
+        return run_scheduled(client, prompt_tokens, params["max_new_tokens"], deadline, run)
+
+    async def produce():
+        """(生成文, GenerationTimer, 投機的デコーディングの統計, 結果を共有したか) を返す"""
+        if request.assisted:
+            (text, speculative_stats), generation_timer = await generate_text(run_assisted)
+            SPECULATIVE_DRAFTED.inc(speculative_stats["drafted_tokens"])
+            SPECULATIVE_ACCEPTED.inc(speculative_stats["accepted_tokens"])
+            return text, generation_timer, speculative_stats, False
+        if cache_key is not None:
+            # 実行中の同一リクエストがあれば、その生成結果を共有する
+            # （共有元が切断・期限切れでキャンセルされた場合は自分で生成し直す）
+            (text, generation_timer), coalesced = await single_flight.run(
+                cache_key, generate_text, retry_on=(GenerationCancelled,)
+            )
+            return text, generation_timer, None, coalesced
+        text, generation_timer = await generate_text()
+        return text, generation_timer, None, False
+
+    try:
+        logger.debug("シンプルなリクエストを受信: prompt=%.100s..., max_new_tokens=%s", request.prompt, request.max_new_tokens)
+
+        queued_at = time.perf_counter()
+        generation = asyncio.ensure_future(produce())
+        # クライアントが切断したら待ち行列から外し、生成中なら次のステップで止める
+        watcher = asyncio.ensure_future(watch_disconnect(raw_request, cancel_token, generation))
+        try:
+            text, generation_timer, speculative_stats, coalesced = await generation
+        finally:
+            watcher.cancel()
+        cancel_token.raise_if_cancelled()
+        timings.add_generation(queued_at, generation_timer)
+
+        # アシスタント応答を整形（pipeline 内での生成文のデコードも postprocess に含める）
+        postprocess_start = generation_timer.finished or time.perf_counter()
+        assistant_response = clean_completion(text)
+        logger.debug("アシスタント応答: %.100s...", assistant_response)
+        output_tokens = backend.count_tokens(assistant_response)
+        timings.add("postprocess", postprocess_start, time.perf_counter())
+        timings.output_tokens = output_tokens
+        if cache_key is not None and not coalesced:
+            response_cache.set(cache_key, cached_response(assistant_response, guarded.truncated))
 
         end_time = time.time()
         response_time = end_time - start_time
-        print(f"応答生成時間: {response_time:.2f}秒")
+        if not coalesced:
+            record_generation(prompt_tokens, output_tokens, response_time)
+        logger.debug("応答生成時間: %.2f秒", response_time)
+
+        response.headers["Server-Timing"] = format_server_timing(timings.durations())
+        if trace_recorder is not None:
+            trace_recorder.record(timings, args={"coalesced": coalesced, "assisted": bool(request.assisted)})
 
         return GenerationResponse(
             generated_text=assistant_response,
-            response_time=response_time
+            response_time=response_time,
+            coalesced=coalesced,
+            speculative=speculative_stats,
+            timings=timings.as_dict() if request.timings else None,
+            truncated=guarded.truncated,
         )
 
+    except QueueFullError as e:
+        logger.info("generateエンドポイント: リクエストを拒否しました (待ち行列: %d)", inference.queue_depth)
+        raise overloaded_exception(e)
+    except (asyncio.TimeoutError, DeadlineExceededError):
+        logger.info("generateエンドポイント: リクエストの期限を過ぎました。")
+        CANCELLED_REQUESTS.inc(endpoint="/generate", reason=DEADLINE)
+        raise HTTPException(status_code=504, detail="リクエストの期限内に応答を生成できませんでした。")
+    except (GenerationCancelled, asyncio.CancelledError) as e:
+        reason = cancel_token.reason or getattr(e, "reason", DISCONNECTED)
+        if isinstance(e, asyncio.CancelledError) and reason != DISCONNECTED:
+            raise
+        logger.info("generateエンドポイント: 生成をキャンセルしました (%s)", reason)
+        CANCELLED_REQUESTS.inc(endpoint="/generate", reason=reason)
+        if reason == DEADLINE:
+            raise HTTPException(status_code=504, detail="リクエストの期限内に応答を生成できませんでした。")
+        # クライアントは切断済みなので応答は届かない（ログ・メトリクス用のステータス）
+        raise HTTPException(status_code=499, detail="クライアントが切断しました。")
     except Exception as e:
-        print(f"シンプル応答生成中にエラーが発生しました: {e}")
-        traceback.print_exc()
+        logger.exception("シンプル応答生成中にエラーが発生しました: %s", e)
+        raise HTTPException(status_code=500, detail=f"応答の生成中にエラーが発生しました: {str(e)}")
+
+# ストリーミングエンドポイント（Server-Sent Events）
+@app.post("/generate/stream")
+async def generate_stream(request: SimpleGenerationRequest, raw_request: Request):
+    """生成されたトークンを Server-Sent Events として逐次返す"""
+    ensure_model_ready()
+
+    logger.debug("ストリーミングリクエストを受信: prompt=%.100s..., max_new_tokens=%s", request.prompt, request.max_new_tokens)
+    pipe = model
+    guarded = guard_prompt(request.prompt, request.max_new_tokens)
+    prompt = guarded.prompt
+    timer = StreamTimer()
+    streamer = backend.make_streamer()
+    errors = []
+    params = dict(generation_params(request), max_new_tokens=guarded.max_new_tokens)
+    deadline = request_deadline(request, raw_request)
+    # 切断・期限切れの場合は次のステップで生成を止める
+    cancel_token = CancellationToken(deadline)
+    if supports_cancellation(pipe):
+        params["stopping_criteria"] = [CancellationCriteria([cancel_token])]
+
+    # /generate と同じくスケジューラの順番を待つ（拒否・期限切れはストリームを始める前に HTTP エラーで返す）
+    acquire = asyncio.ensure_future(
+        acquire_slot(client_id(raw_request), guarded.prompt_tokens, params["max_new_tokens"], deadline)
+    )
+    watcher = asyncio.ensure_future(watch_disconnect(raw_request, cancel_token, acquire))
+    try:
+        slot = await acquire
+    except QueueFullError as e:
+        raise overloaded_exception(e)
+    except DeadlineExceededError:
+        CANCELLED_REQUESTS.inc(endpoint="/generate/stream", reason=DEADLINE)
+        raise HTTPException(status_code=504, detail="リクエストの期限内に生成を開始できませんでした。")
+    except asyncio.CancelledError:
+        if cancel_token.reason != DISCONNECTED:
+            raise
+        CANCELLED_REQUESTS.inc(endpoint="/generate/stream", reason=DISCONNECTED)
+        raise HTTPException(status_code=499, detail="クライアントが切断しました。")
+    finally:
+        watcher.cancel()
+
+    async def generate():
+        # 実行枠は生成が終わるまで（ハンドラが返った後も）確保する
+        try:
+            await inference.run(run_streaming_generation, backend.generate, prompt, streamer, params, errors, check=False)
+        except Exception as e:
+            # 生成を開始できなかった場合も受信側のイテレーションを終わらせる
+            errors.append(e)
+            streamer.end()
+        finally:
+            await slot.aclose()
+
+    # 生成は専用スレッドプールで実行し、トークンはストリーマ経由で受け取る
+    asyncio.ensure_future(generate())
+
+    async def event_stream():
+        chunks = []
+        finished = False
+        try:
+            async for chunk in iterate_in_thread(streamer):
+                if not chunk:
+                    continue
+                timer.mark_token()
+                chunks.append(chunk)
+                yield format_sse({"token": chunk})
+            finished = True
+        finally:
+            if not finished:
+                # 送信中にクライアントが切断した
+                cancel_token.cancel(DISCONNECTED)
+                CANCELLED_REQUESTS.inc(endpoint="/generate/stream", reason=DISCONNECTED)
+                generated = backend.count_tokens("".join(chunks))
+                CANCELLED_TOKENS.inc(max(0, params["max_new_tokens"] - generated))
+
+        if errors:
+            logger.error("ストリーミング生成中にエラーが発生しました: %s", errors[0])
+            yield format_sse({"error": f"応答の生成中にエラーが発生しました: {errors[0]}"}, event="error")
+            return
+
+        generated_text = "".join(chunks).strip()
+        token_count = backend.count_tokens(generated_text)
+        stats = timer.summary(token_count)
+        record_generation(guarded.prompt_tokens, token_count, stats["response_time"])
+        logger.debug("ストリーミング応答生成時間: %.2f秒 (TTFT: %s秒)", stats["response_time"], stats["time_to_first_token"])
+        if cancel_token.cancelled:
+            # 期限を過ぎたため途中で生成を止めた
+            CANCELLED_REQUESTS.inc(endpoint="/generate/stream", reason=cancel_token.reason)
+            CANCELLED_TOKENS.inc(max(0, params["max_new_tokens"] - token_count))
+            stats["cancelled"] = cancel_token.reason
+        if guarded.truncated:
+            stats["truncated"] = True
+        yield format_sse({"done": True, "generated_text": generated_text, **stats}, event="done")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+# マルチターンのチャットエンドポイント
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, raw_request: Request):
+    """会話履歴にチャットテンプレートを適用して応答を生成（同じセッションでは新しいターンだけをプレフィル）"""
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="messages が空です。")
+    ensure_model_ready()
+
+    start_time = time.time()
+    # セッション ID が無ければ発行する（応答の session_id を次のターンで送ると KV キャッシュを再利用できる）
+    session_id = request.session_id or uuid.uuid4().hex
+    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    params = generation_params(request)
+    deadline = request_deadline(request, raw_request)
+    cancel_token = CancellationToken(deadline)
+    try:
+        prompt = render_chat_prompt(model.tokenizer, messages)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"チャットテンプレートを適用できません: {e}")
+    # テンプレートに BOS などの特殊トークンが含まれるため、ここでは追加しない
+    guarded = guard_prompt(prompt, request.max_new_tokens, add_special_tokens=False)
+    prompt, token_ids = guarded.prompt, guarded.token_ids
+    params["max_new_tokens"] = guarded.max_new_tokens
+    prompt_tokens = len(token_ids)
+
+    async def run():
+        if session_generator is not None:
+            return await inference.run(run_chat, session_id, token_ids, params, cancel_token, deadline=deadline, check=False)
+        # スタブ・レプリカでは KV キャッシュを保持できないため、毎回プロンプト全体を生成に渡す
+        text, _ = await asyncio.wait_for(
+            batcher.submit(prompt, params, cancel_token), timeout=max(0.0, deadline - time.monotonic())
+        )
+        return text, {"reused_tokens": 0, "prefilled_tokens": prompt_tokens}
+
+    try:
+        logger.debug("チャットリクエストを受信: session_id=%s, messages=%d件", session_id, len(messages))
+        generation = asyncio.ensure_future(
+            run_scheduled(client_id(raw_request), prompt_tokens, params["max_new_tokens"], deadline, run)
+        )
+        watcher = asyncio.ensure_future(watch_disconnect(raw_request, cancel_token, generation))
+        try:
+            text, stats = await generation
+        finally:
+            watcher.cancel()
+        cancel_token.raise_if_cancelled()
+    except QueueFullError as e:
+        raise overloaded_exception(e)
+    except (asyncio.TimeoutError, DeadlineExceededError):
+        CANCELLED_REQUESTS.inc(endpoint="/chat", reason=DEADLINE)
+        raise HTTPException(status_code=504, detail="リクエストの期限内に応答を生成できませんでした。")
+    except (GenerationCancelled, asyncio.CancelledError) as e:
+        reason = cancel_token.reason or getattr(e, "reason", DISCONNECTED)
+        if isinstance(e, asyncio.CancelledError) and reason != DISCONNECTED:
+            raise
+        CANCELLED_REQUESTS.inc(endpoint="/chat", reason=reason)
+        if reason == DEADLINE:
+            raise HTTPException(status_code=504, detail="リクエストの期限内に応答を生成できませんでした。")
+        raise HTTPException(status_code=499, detail="クライアントが切断しました。")
+    except Exception as e:
+        logger.exception("チャット応答生成中にエラーが発生しました: %s", e)
         raise HTTPException(status_code=500, detail=f"応答の生成中にエラーが発生しました: {str(e)}")
 
+    text = clean_completion(text)
+    response_time = time.time() - start_time
+    SESSION_REUSED_TOKENS.inc(stats["reused_tokens"])
+    SESSION_PREFILLED_TOKENS.inc(stats["prefilled_tokens"])
+    record_generation(prompt_tokens, backend.count_tokens(text), response_time)
+    logger.debug("チャット応答生成時間: %.2f秒 (再利用 %d トークン)", response_time, stats["reused_tokens"])
+    return ChatResponse(
+        message=Message(role="assistant", content=text),
+        session_id=session_id,
+        response_time=response_time,
+        **stats,
+    )
+
+@app.delete("/chat/{session_id}")
+async def delete_chat_session(session_id: str):
+    """セッションの KV キャッシュを破棄する"""
+    deleted = session_store.delete(session_id) if session_store else False
+    return {"session_id": session_id, "deleted": deleted}
+
+# バッチ生成エンドポイント
+@app.post("/generate/batch", response_model=BatchGenerationResponse)
+async def generate_batch(request: BatchGenerationRequest, raw_request: Request):
+    """複数のプロンプトを1回の HTTP 呼び出しで受け取り、バッチ推論して結果をまとめて返す"""
+    try:
+        validate_prompts(request.prompts, config.BATCH_MAX_PROMPTS)
+    except BatchRequestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    ensure_model_ready()
+
+    start_time = time.time()
+    params = generation_params(request)
+    deadline = request_deadline(request, raw_request)
+    # 切断・期限切れで実行中のチャンクを次のステップで止め、残りのチャンクは推論しない
+    cancel_token = CancellationToken(deadline)
+    batch_size = max(1, request.batch_size or config.BATCH_MAX_SIZE)
+    client = client_id(raw_request)
+
+    async def run_chunk(prompts, chunk_params, prompt_tokens):
+        started = False
+        cancel_tokens = [cancel_token] * len(prompts)
+
+        def run():
+            nonlocal started
+            started = True
+            return inference.run(run_model_batch_cancellable, prompts, chunk_params, cancel_tokens,
+                                 deadline=deadline, check=False)
+
+        try:
+            # /generate と同じくチャンクごとにスケジューラの順番を待つ（チャンク全体を1件のリクエストとして見積もる）
+            texts = await run_scheduled(
+                client, sum(prompt_tokens), chunk_params["max_new_tokens"] * len(prompts), deadline, run
+            )
+        finally:
+            if not started and cancel_token.cancelled:
+                # 順番を待つ間にキャンセルされたチャンクは1トークンも生成していない
+                CANCELLED_TOKENS.inc(chunk_params["max_new_tokens"] * len(prompts))
+        return [clean_completion(text) for text in texts]
+
+    logger.debug("バッチリクエストを受信: %d件 (batch_size=%d)", len(request.prompts), batch_size)
+    try:
+        # 長すぎるプロンプトが1件でもあれば（切り詰めない設定の場合）推論前に guard_prompt が 413 を返す
+        generation = asyncio.ensure_future(generate_in_chunks(
+            request.prompts,
+            params,
+            guard=guard_prompt,
+            run_chunk=run_chunk,
+            batch_size=batch_size,
+            cache=response_cache,
+            cache_key=lambda prompt, p: make_cache_key(config.MODEL_NAME, prompt, p),
+            cancel_token=cancel_token,
+            on_skipped=CANCELLED_TOKENS.inc,
+        ))
+        # クライアントが切断したら実行中のチャンクを止め、残りのチャンクを推論しない
+        watcher = asyncio.ensure_future(watch_disconnect(raw_request, cancel_token, generation))
+        try:
+            items, num_batches = await generation
+        finally:
+            watcher.cancel()
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise overloaded_exception(e)
+    except (asyncio.TimeoutError, DeadlineExceededError):
+        logger.info("batchエンドポイント: リクエストの期限を過ぎました。")
+        CANCELLED_REQUESTS.inc(endpoint="/generate/batch", reason=DEADLINE)
+        raise HTTPException(status_code=504, detail="リクエストの期限内に応答を生成できませんでした。")
+    except (GenerationCancelled, asyncio.CancelledError) as e:
+        reason = cancel_token.reason or getattr(e, "reason", DISCONNECTED)
+        if isinstance(e, asyncio.CancelledError) and reason != DISCONNECTED:
+            raise
+        logger.info("batchエンドポイント: 生成をキャンセルしました (%s)", reason)
+        CANCELLED_REQUESTS.inc(endpoint="/generate/batch", reason=reason)
+        if reason == DEADLINE:
+            raise HTTPException(status_code=504, detail="リクエストの期限内に応答を生成できませんでした。")
+        # クライアントは切断済みなので応答は届かない（ログ・メトリクス用のステータス）
+        raise HTTPException(status_code=499, detail="クライアントが切断しました。")
+    except Exception as e:
+        logger.exception("バッチ応答生成中にエラーが発生しました: %s", e)
+        raise HTTPException(status_code=500, detail=f"応答の生成中にエラーが発生しました: {str(e)}")
+
+    results = []
+    for item in items:
+        if not item.cached:
+            # TOKENS_PER_SEC にはチャンクの推論時間あたりのトークン数を記録する
+            record_generation(item.prompt_tokens, backend.count_tokens(item.text), item.elapsed)
+        results.append(BatchItemResult(generated_text=item.text, cached=item.cached, truncated=item.truncated))
+
+    response_time = time.time() - start_time
+    logger.debug("バッチ応答生成時間: %.2f秒 (%dバッチ)", response_time, num_batches)
+    return BatchGenerationResponse(
+        results=results,
+        response_time=response_time,
+        num_batches=num_batches,
+        prompts_per_sec=len(request.prompts) / response_time if response_time > 0 else 0.0,
+    )
+
+def warmup_prompts(tokenizer, lengths):
+    """指定したトークン数に近い長さのウォームアップ用プロンプトを作成する"""
+    base = "人工知能は、言語の理解や推論などの知的な処理をコンピュータで実現する技術です。"
+    prompts = []
+    for length in lengths:
+        ids = tokenizer.encode(base * (length // 8 + 1), add_special_tokens=False)[:length]
+        prompts.append(tokenizer.decode(ids))
+    return prompts
+
+def warmup_model(loaded_backend):
+    """代表的な長さのプロンプトで推論し、メモリアロケータやカーネルを温めておく"""
+    params = {"max_new_tokens": 8, "do_sample": False}
+    prompts = warmup_prompts(loaded_backend.tokenizer, config.WARMUP_PROMPT_LENGTHS)
+    for prompt in prompts:
+        loaded_backend.generate_batch([prompt], **params)
+    if len(prompts) >= 2 and config.BATCH_MAX_SIZE > 1:
+        # パディング付きのバッチ推論の経路も温めておく
+        loaded_backend.generate_batch(prompts[:2], **params)
+
 def load_model_task():
-    """モデルを読み込むバックグラウンドタスク"""
-    global model
+    """モデルを読み込むバックグラウンドタスク（読み込み → ウォームアップ → 準備完了）"""
+    global model, prompt_guard
     print("load_model_task: モデルの読み込みを開始...")
+    lifecycle.set_state(LOADING)
     # load_model関数を呼び出し、結果をグローバル変数に設定
-    loaded_pipe = load_model()
-    if loaded_pipe:
-        model = loaded_pipe  # グローバル変数を更新
-        print("load_model_task: モデルの読み込みが完了しました。")
-    else:
+    loaded_backend = load_model()
+    if not loaded_backend:
+        lifecycle.set_state(FAILED, error=f"モデル '{config.MODEL_NAME}' の読み込みに失敗しました")
         print("load_model_task: モデルの読み込みに失敗しました。")
+        return
+    model = loaded_backend.pipe  # グローバル変数を更新
+    prompt_guard = create_prompt_guard(loaded_backend.pipe)
+    print(f"load_model_task: プロンプトの上限は {prompt_guard.max_prompt_tokens} トークンです"
+          f"（コンテキスト長 {prompt_guard.max_context}、超えた場合: {prompt_guard.strategy}）。")
+    print("load_model_task: モデルの読み込みが完了しました。ウォームアップを開始...")
+
+    lifecycle.set_state(WARMING)
+    try:
+        warmup_model(loaded_backend)
+    except Exception as e:
+        # ウォームアップの失敗は致命的ではないので、そのまま準備完了とする
+        logger.warning("ウォームアップ中にエラーが発生しました: %s", e)
+    lifecycle.set_state(READY)
+    print(f"load_model_task: 準備が完了しました（起動から {lifecycle.time_to_ready:.1f}秒）。")
 
 print("FastAPIエンドポイントを定義しました。")
 
@@ -0,0 +1,267 @@
+# async_client.py
+"""
+LLM API の非同期クライアントと負荷試験ツール
+
+コネクションプール付きの httpx.AsyncClient を使い、同時実行数を制御しながらリクエストを送ります。
+429 / 503 には Retry-After（無い場合は指数バックオフ）に従って自動で再試行します。
+
+負荷試験の実行例:
+    python async_client.py --url http://localhost:8501 --concurrency 8 --requests 100
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+try:
+    import httpx
+except ImportError:  # 負荷試験の集計関数だけを使う場合は httpx が無くてもよい
+    httpx = None
+
+RETRY_STATUS_CODES = (429, 503)
+
+
+class APIError(Exception):
+    """API がエラーを返した場合の例外"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"API error: {status_code} - {message}")
+        self.status_code = status_code
+
+
+def backoff_delay(attempt, base=0.5, maximum=10.0, retry_after=None):
+    """
+    再試行までの待ち時間（秒）を返す
+
+    Retry-After が指定されていればそれに従い、無ければ指数バックオフ（フルジッター）を使います。
+    """
+    if retry_after is not None:
+        try:
+            return min(maximum, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+def percentile(values, q):
+    """values の q パーセンタイル（0～100、線形補間）を返す"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_results(latencies, errors, elapsed):
+    """
+    負荷試験の結果を集計する
+
+    Args:
+        latencies (list[float]): 成功したリクエストの応答時間（秒）
+        errors (list[str]): 失敗したリクエストのエラー内容
+        elapsed (float): 試験全体の経過時間（秒）
+    """
+    total = len(latencies) + len(errors)
+    error_types = {}
+    for error in errors:
+        error_types[error] = error_types.get(error, 0) + 1
+    return {
+        "requests": total,
+        "succeeded": len(latencies),
+        "failed": len(errors),
+        "error_rate": len(errors) / total if total else 0.0,
+        "elapsed": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "errors": error_types,
+    }
+
+
+class AsyncLLMClient:
+    """LLM API 非同期クライアント（コネクションプール・同時実行数制御・再試行付き）"""
+
+    def __init__(self, api_url, max_connections=16, concurrency=None, timeout=120.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=10.0, api_key=None):
+        """
+        Args:
+            api_url (str): API のベース URL（ngrok URL）
+            max_connections (int): コネクションプールの最大接続数
+            concurrency (int, optional): 同時に送信するリクエストの上限（省略時は max_connections）
+            timeout (float): 1リクエストのタイムアウト（秒）
+            max_retries (int): 429 / 503 / 通信エラー時の最大再試行回数
+            backoff_base (float): 指数バックオフの基準時間（秒）
+            backoff_max (float): 再試行までの最大待ち時間（秒）
+            api_key (str, optional): X-API-Key ヘッダで送る API キー（サーバーはクライアントごとに公平に処理する）
+        """
+        if httpx is None:
+            raise ImportError("AsyncLLMClient には httpx が必要です: pip install httpx")
+        self.api_url = api_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.concurrency = concurrency or max_connections
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            headers={"X-API-Key": api_key} if api_key else None,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.retries = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def _request(self, method, path, **kwargs):
+        """再試行付きでリクエストを送り、JSON を返す"""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self._client.request(method, f"{self.api_url}{path}", **kwargs)
+                except (httpx.TimeoutException, httpx.TransportError):
+                    if attempt >= self.max_retries:
+                        raise
+                    self.retries += 1
+                    await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+                    continue
+
+                if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    self.retries += 1
+                    delay = backoff_delay(
+                        attempt, self.backoff_base, self.backoff_max, response.headers.get("Retry-After")
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                if response.status_code != 200:
+                    raise APIError(response.status_code, response.text)
+                return response.json()
+
+    async def health_check(self):
+        """ヘルスチェック"""
+        return await self._request("GET", "/health")
+
+    async def generate(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True):
+        """テキスト生成（LLMClient.generate の非同期版）"""
+        payload = {
+            "prompt": prompt,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample
+        }
+        start_time = time.time()
+        result = await self._request("POST", "/generate", json=payload)
+        result["total_request_time"] = time.time() - start_time
+        return result
+
+    async def generate_batch(self, prompts, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True,
+                             batch_size=None):
+        """複数プロンプトのバッチ生成（LLMClient.generate_batch の非同期版）"""
+        payload = {
+            "prompts": list(prompts),
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample
+        }
+        if batch_size is not None:
+            payload["batch_size"] = batch_size
+        start_time = time.time()
+        result = await self._request("POST", "/generate/batch", json=payload)
+        result["total_request_time"] = time.time() - start_time
+        return result
+
+
+async def run_load_test(client, prompts, total_requests=100, duration=None, **generate_kwargs):
+    """
+    負荷試験を実行し、p50/p95/p99 応答時間・スループット・エラー率を返す
+
+    Args:
+        client (AsyncLLMClient): 同時実行数はクライアントの concurrency で制御される
+        prompts (list[str]): 順番に使い回すプロンプト
+        total_requests (int): 送信するリクエスト数（duration 指定時は無視）
+        duration (float, optional): 指定した秒数の間リクエストを送り続ける
+    """
+    latencies = []
+    errors = []
+
+    async def one(prompt):
+        start = time.perf_counter()
+        try:
+            await client.generate(prompt, **generate_kwargs)
+            latencies.append(time.perf_counter() - start)
+        except APIError as e:
+            errors.append(f"HTTP {e.status_code}")
+        except Exception as e:
+            errors.append(type(e).__name__)
+
+    start_time = time.perf_counter()
+    if duration is None:
+        await asyncio.gather(*(one(prompts[i % len(prompts)]) for i in range(total_requests)))
+    else:
+        # 同時実行数分のワーカーが期限までリクエストを送り続ける
+        end_time = start_time + duration
+        counter = iter(range(10 ** 9))
+
+        async def worker():
+            while time.perf_counter() < end_time:
+                await one(prompts[next(counter) % len(prompts)])
+
+        await asyncio.gather(*(worker() for _ in range(client.concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    report = summarize_results(latencies, errors, elapsed)
+    report["retries"] = client.retries
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM API の負荷試験")
+    parser.add_argument("--url", required=True, help="API のベース URL")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=None, help="指定した秒数だけ送り続ける")
+    parser.add_argument("--prompt", action="append", help="使用するプロンプト（複数指定可）")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--greedy", action="store_true", help="do_sample=False で送信する")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-retries", type=int, default=3)
+    args = parser.parse_args()
+
+    prompts = args.prompt or ["AIについて100文字で教えてください"]
+
+    async def run():
+        async with AsyncLLMClient(
+            args.url,
+            max_connections=args.concurrency,
+            timeout=args.timeout,
+            max_retries=args.max_retries,
+        ) as client:
+            return await run_load_test(
+                client,
+                prompts,
+                total_requests=args.requests,
+                duration=args.duration,
+                max_new_tokens=args.max_new_tokens,
+                do_sample=not args.greedy,
+            )
+
+    report = asyncio.run(run())
+    report["concurrency"] = args.concurrency
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
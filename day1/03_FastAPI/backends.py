@@ -0,0 +1,155 @@
+# backends.py
+"""
+推論バックエンドの共通インターフェース
+
+アプリケーションはモデル（transformers の pipeline など）を直接呼ばず、InferenceBackend を通して
+生成・バッチ生成・ストリーミング・トークン数の計算を行います。これにより、より速いランタイムへの
+差し替えや、モデルをダウンロードせずに上位の層だけを CPU で性能試験することができます。
+
+- transformers: transformers の text-generation pipeline（PrefixCachedPipeline・ReplicaPool も可）
+- stub: 決定的な応答を指定した遅延で返すスタブ（クイズ生成・採点には形式の正しい JSON を返す）
+"""
+
+import queue
+import threading
+
+from stub_model import StubPipeline, quiz_responder
+
+BACKENDS = ("transformers", "stub")
+
+
+class TextQueueStreamer:
+    """on_finalized_text で受け取ったテキスト片を順に返すイテレータ（スタブ用の streamer）"""
+
+    _END = object()
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self._queue.put(text)
+        if stream_end:
+            self._queue.put(self._END)
+
+    def end(self):
+        self._queue.put(self._END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self._queue.get()
+        if item is self._END:
+            raise StopIteration
+        return item
+
+
+class InferenceBackend:
+    """
+    推論バックエンドの基底クラス
+
+    pipeline 互換のオブジェクト（pipe）を持ち、呼び出し方の違いをここで吸収します。
+    生成のパラメータ（max_new_tokens など）と streamer / stopping_criteria はそのまま pipe に渡します。
+    """
+
+    name = None
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.tokenizer = pipe.tokenizer
+
+    def generate(self, prompt, **params):
+        """プロンプトに続く生成文（プロンプトを含まない）を返す"""
+        outputs = self.pipe(prompt, return_full_text=False, **params)
+        return outputs[0]["generated_text"]
+
+    def generate_batch(self, prompts, **params):
+        """
+        複数プロンプトをパディング付きの1回のバッチで生成する
+
+        1件だけの場合は単一プロンプトとして呼び出し、プレフィックスキャッシュなどを利用できるようにします。
+
+        Returns:
+            list[str]: プロンプトごとの生成文
+        """
+        if len(prompts) == 1:
+            return [self.generate(prompts[0], **params)]
+        outputs = self.pipe(list(prompts), batch_size=len(prompts), return_full_text=False, **params)
+        return [(out if isinstance(out, list) else [out])[0]["generated_text"] for out in outputs]
+
+    def make_streamer(self):
+        """stream で使う streamer（テキスト片のイテレータ）を作成する"""
+        raise NotImplementedError
+
+    def stream(self, prompt, **params):
+        """
+        生成したテキスト片を順に返すイテレータ（生成はバックグラウンドスレッドで実行する）
+
+        生成中の例外はイテレーションの終了後に送出します。
+        """
+        streamer = self.make_streamer()
+        errors = []
+
+        def run():
+            try:
+                self.generate(prompt, streamer=streamer, **params)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def count_tokens(self, text, add_special_tokens=False):
+        """text のトークン数"""
+        return len(self.tokenizer.encode(text, add_special_tokens=add_special_tokens))
+
+
+class TransformersBackend(InferenceBackend):
+    """transformers の text-generation pipeline を使うバックエンド"""
+
+    name = "transformers"
+
+    def make_streamer(self):
+        from transformers import TextIteratorStreamer
+
+        return TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+
+class StubBackend(InferenceBackend):
+    """決定的な応答を返すスタブのバックエンド（モデルのダウンロード不要）"""
+
+    name = "stub"
+
+    def __init__(self, token_delay=0.0, prefill_delay=0.0):
+        """
+        Args:
+            token_delay (float): 1トークンあたりの待ち時間（秒）
+            prefill_delay (float): 1回の生成ごとの固定の待ち時間（秒）
+        """
+        super().__init__(StubPipeline(token_delay=token_delay, prefill_delay=prefill_delay, responder=quiz_responder))
+
+    def make_streamer(self):
+        return TextQueueStreamer()
+
+
+def create_backend(name, load_pipeline=None, token_delay=0.0, prefill_delay=0.0):
+    """
+    設定名からバックエンドを作成する
+
+    Args:
+        name (str): "transformers" または "stub"
+        load_pipeline (callable, optional): transformers の場合に pipeline を返す関数
+        token_delay (float): stub の場合の1トークンあたりの待ち時間（秒）
+        prefill_delay (float): stub の場合の1回の生成ごとの待ち時間（秒）
+    """
+    if name == "stub":
+        return StubBackend(token_delay=token_delay, prefill_delay=prefill_delay)
+    if name == "transformers":
+        return TransformersBackend(load_pipeline())
+    raise ValueError(f"不明な推論バックエンドです: {name}（{', '.join(BACKENDS)} のいずれか）")
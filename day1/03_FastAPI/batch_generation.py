@@ -0,0 +1,123 @@
+# batch_generation.py
+"""
+複数プロンプトの一括生成（/generate/batch）
+
+決定的なリクエストはキャッシュ済みのプロンプトを推論から除き、残りを batch_size 件ずつのチャンクに分けて
+1つずつ順番に推論します（1つのリクエストで推論を占有し、他のリクエストを締め出さないため）。
+FastAPI やモデルに依存する部分（長さの確認・推論の実行）は呼び出し側から関数で受け取ります。
+"""
+
+import time
+
+from cache import cached_response, is_cacheable, unpack_cached_response
+
+
+class BatchRequestError(ValueError):
+    """バッチリクエストの内容が不正な場合の例外（status_code に HTTP のステータスコード）"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def validate_prompts(prompts, max_prompts):
+    """
+    プロンプトの件数を確認する
+
+    Raises:
+        BatchRequestError: 空の場合 (400)、max_prompts 件を超える場合 (413)
+    """
+    if not prompts:
+        raise BatchRequestError("prompts が空です。", status_code=400)
+    if len(prompts) > max_prompts:
+        raise BatchRequestError(f"prompts は最大 {max_prompts} 件までです。", status_code=413)
+
+
+def split_chunks(indices, batch_size):
+    """indices を batch_size 件ずつのチャンクに分ける"""
+    batch_size = max(1, int(batch_size))
+    return [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+
+
+class BatchItem:
+    """1件のプロンプトの結果"""
+
+    __slots__ = ("text", "cached", "truncated", "prompt_tokens", "elapsed")
+
+    def __init__(self, text, cached=False, truncated=False, prompt_tokens=0, elapsed=0.0):
+        self.text = text
+        self.cached = cached
+        self.truncated = truncated          # プロンプトを切り詰めたか
+        self.prompt_tokens = prompt_tokens
+        self.elapsed = elapsed              # 属するチャンクの推論にかかった時間（秒、キャッシュの場合は 0）
+
+
+async def generate_in_chunks(prompts, params, guard, run_chunk, batch_size, cache=None, cache_key=None,
+                             cancel_token=None, on_skipped=None):
+    """
+    複数のプロンプトの生成文を、キャッシュとチャンクごとの推論で求める
+
+    長すぎるプロンプトが1件でもあれば（guard が例外を送出した場合）、推論を始める前にその例外を送出します。
+    チャンク内では max_new_tokens を共有するため、最も残りの少ないプロンプトに合わせます。
+    それより多くの max_new_tokens を要求していたプロンプトの結果は、短く生成した可能性があるためキャッシュしません。
+    cancel_token がキャンセルされた場合は、途中まで生成したチャンクの結果を使わず、残りのチャンクも推論せずに
+    GenerationCancelled を送出します。
+
+    Args:
+        prompts (list[str]): プロンプト
+        params (dict): 生成パラメータ（max_new_tokens を含む）
+        guard (callable): (プロンプト, max_new_tokens) から GuardedPrompt を返す関数
+        run_chunk (callable): (プロンプトのリスト, 生成パラメータ, プロンプトのトークン数のリスト) を受け取り、
+            生成文のリストを返すコルーチン関数
+        batch_size (int): 1回の推論にまとめるプロンプト数
+        cache (ResponseCache, optional): 決定的なリクエストの応答キャッシュ
+        cache_key (callable, optional): (プロンプト, params) からキャッシュキーを作る関数（cache と一緒に指定する）
+        cancel_token (CancellationToken, optional): チャンクの前後で確認するキャンセル状態
+        on_skipped (callable, optional): キャンセルで推論しなかったチャンクの max_new_tokens の合計を受け取る関数
+
+    Returns:
+        tuple: (プロンプトと同じ順の BatchItem のリスト, 推論したチャンク数)
+    """
+    results = [None] * len(prompts)
+    keys = [None] * len(prompts)
+    pending = []
+    for i, prompt in enumerate(prompts):
+        if cache is not None and is_cacheable(params):
+            keys[i] = cache_key(prompt, params)
+            cached = cache.get(keys[i])
+            if cached is not None:
+                cached_text, truncated = unpack_cached_response(cached)
+                results[i] = BatchItem(cached_text, cached=True, truncated=truncated)
+                continue
+        pending.append(i)
+    guarded = {i: guard(prompts[i], params["max_new_tokens"]) for i in pending}
+
+    chunks = split_chunks(pending, batch_size)
+    budgets = [min(guarded[i].max_new_tokens for i in indices) for indices in chunks]
+    started = 0
+    try:
+        for indices, max_new_tokens in zip(chunks, budgets):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            chunk_params = dict(params, max_new_tokens=max_new_tokens)
+            started += 1
+            start = time.perf_counter()
+            texts = await run_chunk(
+                [guarded[i].prompt for i in indices], chunk_params, [guarded[i].prompt_tokens for i in indices]
+            )
+            elapsed = time.perf_counter() - start
+            if cancel_token is not None:
+                # 途中で止めた生成文はキャッシュにも応答にも使わない
+                cancel_token.raise_if_cancelled()
+            for i, text in zip(indices, texts):
+                if keys[i] is not None and max_new_tokens == guarded[i].max_new_tokens:
+                    cache.set(keys[i], cached_response(text, guarded[i].truncated))
+                results[i] = BatchItem(
+                    text, truncated=guarded[i].truncated, prompt_tokens=guarded[i].prompt_tokens, elapsed=elapsed
+                )
+    finally:
+        if started < len(chunks) and on_skipped is not None and cancel_token is not None and cancel_token.cancelled:
+            on_skipped(sum(
+                max_new_tokens * len(indices) for indices, max_new_tokens in zip(chunks[started:], budgets[started:])
+            ))
+    return results, len(chunks)
@@ -0,0 +1,135 @@
+# batching.py
+"""
+/generate エンドポイント用の動的マイクロバッチ処理
+
+短い待ち時間（max_wait_ms）の間に届いた同時リクエストを、
+生成パラメータが互換なものごとにまとめ、1回のバッチ推論で処理します。
+結果は各リクエストの待機中 Future に振り分けて返します。
+リクエストに CancellationToken を付けると、キャンセル済みのものは推論前に除外し、
+推論中にキャンセルされたものには GenerationCancelled を返します。
+"""
+
+import asyncio
+
+from cancellation import GenerationCancelled
+
+
+def batch_key(params):
+    """
+    同じバッチにまとめてよいリクエストを判定するためのキーを返す
+
+    do_sample=False（貪欲法）の場合 temperature / top_p は出力に影響しないため、
+    キーから除外してまとめやすくします。
+    """
+    if not params.get("do_sample"):
+        return (("do_sample", False), ("max_new_tokens", params.get("max_new_tokens")))
+    return tuple(sorted(params.items()))
+
+
+def run_pipeline_batch(pipe, prompts, params):
+    """
+    transformers の pipeline に複数プロンプトを渡し、パディング付きの1回のバッチで推論する
+
+    1件だけの場合は単一プロンプトとして呼び出し、プレフィックスキャッシュなどを利用できるようにします。
+
+    Returns:
+        list: プロンプトごとの出力（pipeline を単一プロンプトで呼んだ場合と同じ形式）
+    """
+    if len(prompts) == 1:
+        return [pipe(prompts[0], **params)]
+    outputs = pipe(list(prompts), batch_size=len(prompts), **params)
+    # 1件だけの場合でも常にプロンプトごとのリストで返す
+    return [out if isinstance(out, list) else [out] for out in outputs]
+
+
+class MicroBatcher:
+    """同時リクエストを集めてバッチ推論するスケジューラ"""
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10.0, executor=None, cancellable=False):
+        """
+        Args:
+            run_batch (callable): (prompts, params) を受け取りプロンプトごとの出力リストを返す同期関数
+            max_batch_size (int): 1バッチの最大リクエスト数（1以下でバッチ処理を無効化）
+            max_wait_ms (float): 最初のリクエストからバッチを締め切るまでの最大待ち時間（ミリ秒）
+            executor (InferenceExecutor, optional): バッチ推論を実行する executor
+                （省略時はイベントループのデフォルト executor）
+            cancellable (bool): True の場合 run_batch は (prompts, params, cancel_tokens) を受け取る
+        """
+        self.run_batch = run_batch
+        self.executor = executor
+        self.cancellable = cancellable
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self._pending = {}  # key -> [(prompt, future, cancel_token), ...]
+        self._timers = {}   # key -> asyncio.TimerHandle
+        self.stats = {"batches": 0, "requests": 0, "max_batch_size_seen": 0}
+
+    async def submit(self, prompt, params, cancel_token=None):
+        """リクエストをバッチに追加し、そのプロンプトの出力を待って返す"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = batch_key(params)
+
+        bucket = self._pending.setdefault(key, [])
+        bucket.append((prompt, future, cancel_token))
+        if len(bucket) >= self.max_batch_size:
+            self._flush(key)
+        elif len(bucket) == 1:
+            self._timers[key] = loop.call_later(self.max_wait_ms / 1000.0, self._flush, key)
+
+        return await future
+
+    def _flush(self, key):
+        """締め切ったバッチを推論タスクとして起動する"""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        bucket = self._pending.pop(key, None)
+        if bucket:
+            asyncio.ensure_future(self._run(bucket, dict(key)))
+
+    async def _run(self, bucket, params):
+        """バッチ推論を実行し、結果を各リクエストへ振り分ける"""
+        # 待っている間にキャンセルされたリクエストは推論しない
+        live = []
+        for prompt, future, token in bucket:
+            if future.done():
+                continue
+            if token is not None and token.cancelled:
+                future.set_exception(GenerationCancelled(token.reason))
+                continue
+            live.append((prompt, future, token))
+        if not live:
+            return
+        bucket = live
+
+        prompts = [prompt for prompt, _, _ in bucket]
+        args = (prompts, params, [token for _, _, token in bucket]) if self.cancellable else (prompts, params)
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(bucket)
+        self.stats["max_batch_size_seen"] = max(self.stats["max_batch_size_seen"], len(bucket))
+
+        try:
+            # 推論はブロッキング処理なのでイベントループ外で実行する
+            if self.executor is not None:
+                # 各リクエストは受付判定済みなので、ここでは再判定しない
+                results = await self.executor.run(self.run_batch, *args, weight=len(bucket), check=False)
+            else:
+                loop = asyncio.get_running_loop()
+                results = await loop.run_in_executor(None, self.run_batch, *args)
+            if len(results) != len(bucket):
+                raise RuntimeError(f"バッチ出力数が一致しません: {len(results)} != {len(bucket)}")
+        except Exception as e:
+            for _, future, _ in bucket:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, token), result in zip(bucket, results):
+            if future.done():
+                continue
+            if token is not None and token.cancelled:
+                # 途中で生成を打ち切った結果は返さない
+                future.set_exception(GenerationCancelled(token.reason))
+            else:
+                future.set_result(result)
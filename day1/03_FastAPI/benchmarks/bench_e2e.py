@@ -0,0 +1,195 @@
+# bench_e2e.py
+"""
+FastAPI サーバーのエンドツーエンドのベンチマーク（スタブモデル使用）
+
+STUB_MODEL=1 で app.py を起動し、同時実行数を変えながら /generate に負荷をかけて、
+p50/p99 応答時間・スループット・イベントループの遅延を JSON のレポートに記録します。
+モデルの推論時間は固定（トークンごとの遅延）なので、リクエストの解析・応答の抽出・ログ出力・
+スケジューリングなどサーバー側のオーバーヘッドの変化をコミット間で比較できます。
+
+実行例:
+    python benchmarks/bench_e2e.py --output bench_e2e.json
+    python benchmarks/bench_e2e.py --output new.json --baseline bench_e2e.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx
+
+from async_client import AsyncLLMClient, run_load_test
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..")
+LAG_METRIC = "llm_event_loop_lag_seconds"
+PROMPTS = [f"ベンチマーク用のプロンプト {i}: AIについて教えてください。" for i in range(32)]
+
+
+def parse_histogram(metrics_text, name):
+    """Prometheus テキスト形式からラベルなしヒストグラムのバケット・合計・件数を取り出す"""
+    buckets = {}
+    total = count = 0.0
+    for line in metrics_text.splitlines():
+        if line.startswith(f'{name}_bucket{{le="'):
+            bound = line.split('"')[1]
+            buckets[float("inf") if bound == "+Inf" else float(bound)] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_sum "):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_count "):
+            count = float(line.rsplit(" ", 1)[1])
+    return buckets, total, count
+
+
+def histogram_delta_summary(before, after, q=0.99):
+    """2時点のヒストグラムの差分から平均とパーセンタイル（バケットの上限値）を返す"""
+    buckets_before, sum_before, count_before = before
+    buckets_after, sum_after, count_after = after
+    count = count_after - count_before
+    if count <= 0:
+        return {"samples": 0, "mean": None, f"p{int(q * 100)}": None}
+    quantile = None
+    for bound in sorted(buckets_after):
+        if buckets_after[bound] - buckets_before.get(bound, 0.0) >= q * count:
+            quantile = bound
+            break
+    return {
+        "samples": int(count),
+        "mean": (sum_after - sum_before) / count,
+        f"p{int(q * 100)}": quantile if quantile != float("inf") else None,
+    }
+
+
+def start_server(port, args):
+    """スタブモデルでサーバーを起動し、準備完了まで待つ"""
+    env = dict(os.environ)
+    env.update({
+        "STUB_MODEL": "1",
+        "STUB_TOKEN_DELAY_MS": str(args.token_delay_ms),
+        "LOG_LEVEL": args.log_level,
+        "BATCH_MAX_SIZE": str(args.batch_max_size),
+        "WARMUP_PROMPT_LENGTHS": "",
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, env=env,
+    )
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"サーバーが終了しました (exitcode={process.returncode})")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1.0).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise TimeoutError("サーバーの起動がタイムアウトしました")
+
+
+async def run_level(url, concurrency, args):
+    """1つの同時実行数で負荷をかけ、結果とイベントループの遅延を返す"""
+    async with httpx.AsyncClient() as scraper:
+        before = parse_histogram((await scraper.get(f"{url}/metrics")).text, LAG_METRIC)
+        async with AsyncLLMClient(url, max_connections=concurrency, max_retries=0, timeout=args.timeout) as client:
+            report = await run_load_test(
+                client, PROMPTS, total_requests=args.requests, max_new_tokens=args.max_new_tokens, do_sample=True
+            )
+        after = parse_histogram((await scraper.get(f"{url}/metrics")).text, LAG_METRIC)
+    lag = histogram_delta_summary(before, after)
+    return {
+        "concurrency": concurrency,
+        "requests": report["requests"],
+        "error_rate": report["error_rate"],
+        "throughput_rps": report["throughput_rps"],
+        "latency_p50": report["latency_p50"],
+        "latency_p99": report["latency_p99"],
+        "event_loop_lag_mean": lag["mean"],
+        "event_loop_lag_p99": lag["p99"],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline):
+    """ベースラインのレポートとの差分（変化率）を表示する"""
+    old_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    print(f"ベースライン ({baseline.get('commit')}) との比較:")
+    for level in report["levels"]:
+        old = old_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        changes = []
+        for key in ("latency_p50", "latency_p99", "throughput_rps"):
+            if old[key] and level[key] is not None:
+                changes.append(f"{key} {(level[key] - old[key]) / old[key]:+.1%}")
+        print(f"  concurrency={level['concurrency']:>3}: " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スタブモデルを使ったサーバーのエンドツーエンドのベンチマーク")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="カンマ区切りの同時実行数")
+    parser.add_argument("--requests", type=int, default=200, help="同時実行数ごとのリクエスト数")
+    parser.add_argument("--token-delay-ms", type=float, default=2.0)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--batch-max-size", type=int, default=8)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="JSON レポートの出力先")
+    parser.add_argument("--baseline", help="比較するベースラインの JSON レポート")
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    process = start_server(args.port, args)
+    try:
+        levels = []
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            level = asyncio.run(run_level(url, concurrency, args))
+            print(
+                f"concurrency={concurrency:>3}: p50 {level['latency_p50'] * 1000:.1f} ms  "
+                f"p99 {level['latency_p99'] * 1000:.1f} ms  {level['throughput_rps']:.1f} req/s  "
+                f"エラー率 {level['error_rate']:.1%}"
+            )
+            levels.append(level)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    report = {
+        "commit": git_commit(),
+        "settings": {
+            "requests": args.requests,
+            "token_delay_ms": args.token_delay_ms,
+            "max_new_tokens": args.max_new_tokens,
+            "batch_max_size": args.batch_max_size,
+            "log_level": args.log_level,
+        },
+        "levels": levels,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"レポートを保存しました: {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_precision.py
+"""
+読み込み精度（fp32 / bf16 / int8）ごとのベンチマーク
+
+精度ごとに別プロセスでモデルを読み込み、読み込み時間・RSS・tokens/sec を比較します。
+RSS を正しく測るため、各精度は子プロセスで1つずつ実行します。
+
+実行例:
+    python benchmarks/bench_precision.py --model HuggingFaceTB/SmolLM2-135M-Instruct
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from precision import PRECISIONS, cpu_supports_bf16, resolve_precision
+
+PROMPT = "AIについて100文字で教えてください。"
+
+
+def rss_mb():
+    """現在のプロセスの RSS（MB）"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def run_single(model_name, precision, max_new_tokens, rounds):
+    """1つの精度でモデルを読み込み、計測結果を返す（子プロセスで実行される）"""
+    import torch
+
+    from precision import load_text_generation_pipeline
+
+    start = time.perf_counter()
+    pipe = load_text_generation_pipeline(model_name, precision, "cpu")
+    load_seconds = time.perf_counter() - start
+
+    prompt_len = len(pipe.tokenizer(PROMPT)["input_ids"])
+    with torch.no_grad():
+        pipe(PROMPT, max_new_tokens=4, do_sample=False)  # ウォームアップ
+        tokens = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            text = pipe(PROMPT, max_new_tokens=max_new_tokens, do_sample=False)[0]["generated_text"]
+            tokens += len(pipe.tokenizer(text)["input_ids"]) - prompt_len
+        elapsed = time.perf_counter() - start
+
+    return {
+        "precision": precision,
+        "load_seconds": load_seconds,
+        "rss_mb": rss_mb(),
+        "tokens_per_second": tokens / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="読み込み精度ごとの読み込み時間・RSS・tokens/sec の比較")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM2-135M-Instruct")
+    parser.add_argument("--precisions", default=",".join(PRECISIONS), help="カンマ区切りの精度")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--single", help=argparse.SUPPRESS)  # 子プロセス用
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.model, args.single, args.max_new_tokens, args.rounds)))
+        return
+
+    print(f"モデル: {args.model}  CPU の bf16 対応: {cpu_supports_bf16()}  auto の選択: {resolve_precision('auto', 'cpu')}")
+    for precision in args.precisions.split(","):
+        command = [
+            sys.executable, __file__, "--model", args.model, "--single", precision,
+            "--max-new-tokens", str(args.max_new_tokens), "--rounds", str(args.rounds),
+        ]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"{precision:>5}: 失敗 {output.stderr.strip().splitlines()[-1:]}")
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        print(
+            f"{precision:>5}: 読み込み {result['load_seconds']:.1f} s  RSS {result['rss_mb']:.0f} MB  "
+            f"{result['tokens_per_second']:.1f} tokens/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# bench_replicas.py
+"""
+レプリカ数に対するスループットのスケーリングを測定するベンチマーク
+
+レプリカ数を変えながら ReplicaPool に同時にリクエストを送り、リクエスト毎秒を比較します。
+CPU のみの環境でも動くよう、既定では小さなモデルを使います。
+
+実行例:
+    python benchmarks/bench_replicas.py --replicas 1 2 4 --requests 32
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from replicas import ReplicaPool
+
+
+def run(num_replicas, args):
+    pool = ReplicaPool(args.model, num_replicas=num_replicas, dtype="float32").start()
+    params = {"max_new_tokens": args.max_new_tokens, "do_sample": False}
+    try:
+        pool(args.prompt, **params)  # ウォームアップ
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_replicas * 2) as executor:
+            list(executor.map(lambda _: pool(args.prompt, **params), range(args.requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+    return args.requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レプリカ数ごとのスループット比較")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM2-135M-Instruct")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--prompt", default="AIについて100文字で教えてください")
+    args = parser.parse_args()
+
+    print(f"モデル: {args.model}  CPU 数: {os.cpu_count()}  リクエスト数: {args.requests}")
+    baseline = None
+    for num_replicas in args.replicas:
+        throughput = run(num_replicas, args)
+        baseline = baseline or throughput
+        print(f"レプリカ {num_replicas:2d}: {throughput:6.2f} req/s  (x{throughput / baseline:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# bench_speculative.py
+"""
+投機的（assisted）デコーディングのベンチマーク
+
+同じプロンプトについて、通常の生成とドラフトモデルを使った生成の tokens/sec と採用率を比較します。
+CPU のみの環境でも動くよう、既定では小さなモデルの組み合わせを使います。
+
+実行例:
+    python benchmarks/bench_speculative.py \
+        --model HuggingFaceTB/SmolLM2-360M-Instruct --draft-model HuggingFaceTB/SmolLM2-135M-Instruct
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import torch
+from transformers import pipeline
+
+from speculative import AssistedGenerator, load_draft_model
+
+PROMPTS = [
+    "日本の四季について説明してください。",
+    "Pythonでリストを逆順にする方法を教えてください。",
+    "AIについて100文字で教えてください。",
+]
+
+
+def tokens_per_second(pipe, generate, prompts, max_new_tokens):
+    """generate(prompt) で各プロンプトを生成し、全体の tokens/sec を返す"""
+    total_tokens = 0
+    total_time = 0.0
+    for prompt in prompts:
+        prompt_len = len(pipe.tokenizer(prompt)["input_ids"])
+        start = time.perf_counter()
+        text = generate(prompt)
+        total_time += time.perf_counter() - start
+        total_tokens += len(pipe.tokenizer(text)["input_ids"]) - prompt_len
+    return total_tokens / total_time if total_time > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="通常の生成と assisted generation の比較")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM2-360M-Instruct")
+    parser.add_argument("--draft-model", default="HuggingFaceTB/SmolLM2-135M-Instruct")
+    parser.add_argument("--num-assistant-tokens", type=int, default=None)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pipe = pipeline("text-generation", model=args.model, torch_dtype=torch.float32, device="cpu")
+    draft_model, draft_tokenizer = load_draft_model(args.draft_model, torch.float32, "cpu")
+    assisted = AssistedGenerator(pipe, draft_model, draft_tokenizer, args.num_assistant_tokens)
+    params = {"max_new_tokens": args.max_new_tokens, "do_sample": False}
+
+    def baseline(prompt):
+        return pipe(prompt, **params)[0]["generated_text"]
+
+    def speculative(prompt):
+        return assisted(prompt, **params)[0][0]["generated_text"]
+
+    # ウォームアップ（初回呼び出しのオーバーヘッドを除く）
+    baseline(PROMPTS[0])
+    speculative(PROMPTS[0])
+
+    baseline_tps = [tokens_per_second(pipe, baseline, PROMPTS, args.max_new_tokens) for _ in range(args.rounds)]
+    assisted_tps = [tokens_per_second(pipe, speculative, PROMPTS, args.max_new_tokens) for _ in range(args.rounds)]
+
+    print(f"モデル: {args.model}  ドラフト: {args.draft_model}")
+    print(f"通常の生成        : {statistics.median(baseline_tps):.1f} tokens/sec")
+    print(f"assisted generation: {statistics.median(assisted_tps):.1f} tokens/sec")
+    print(f"採用率: {assisted.acceptance_rate():.2%}  累計: {assisted.totals}")
+
+
+if __name__ == "__main__":
+    main()
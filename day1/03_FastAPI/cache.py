@@ -0,0 +1,262 @@
+# cache.py
+"""
+決定的な生成（do_sample=False）の応答キャッシュ
+
+(モデル名, プロンプト, max_new_tokens, サンプリングパラメータ) をキーに生成結果を保持します
+（do_sample=False では出力に影響しない temperature / top_p はキーに含めません）。
+値には生成文と、プロンプトを切り詰めたかどうかを保存します。
+メモリ上では件数上限付きの LRU と TTL で管理し、
+db_path を指定した場合は SQLite にも保存して再起動後も利用できるようにします。
+キャッシュに入る前の同一リクエストは SingleFlight で1回の生成にまとめます。
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_TABLE = "response_cache"
+
+CACHE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def is_cacheable(params):
+    """キャッシュを利用してよい（出力が決定的な）リクエストかどうか"""
+    return not params.get("do_sample")
+
+
+def cache_key_params(params):
+    """
+    キャッシュキーに含める生成パラメータを返す
+
+    batching.batch_key と同じく、do_sample=False（貪欲法）では temperature / top_p を除外します。
+    """
+    if not params.get("do_sample"):
+        return {"do_sample": False, "max_new_tokens": params.get("max_new_tokens")}
+    return params
+
+
+def make_cache_key(model_name, prompt, params):
+    """キャッシュキー（SHA-256 のハッシュ文字列）を作成する"""
+    payload = json.dumps(
+        {"model": model_name, "prompt": prompt, "params": cache_key_params(params)},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cached_response(text, truncated=False):
+    """キャッシュに保存する値（生成文と、プロンプトを切り詰めたか）"""
+    return {"text": text, "truncated": bool(truncated)}
+
+
+def unpack_cached_response(value):
+    """
+    キャッシュの値から (生成文, プロンプトを切り詰めたか) を返す
+
+    生成文だけを保存していた以前のエントリ（SQLite に残っているもの）は切り詰めなしとして扱います。
+    """
+    if isinstance(value, str):
+        return value, False
+    return value["text"], bool(value.get("truncated"))
+
+
+class ResponseCache:
+    """LRU + TTL の応答キャッシュ（SQLite への永続化はオプション）"""
+
+    def __init__(self, max_size=256, ttl=3600.0, db_path=None):
+        """
+        Args:
+            max_size (int): メモリ上に保持する最大件数（0 でキャッシュ無効）
+            ttl (float): エントリの有効期間（秒）。0 以下で無期限
+            db_path (str, optional): 永続化に使う SQLite ファイル
+        """
+        self.max_size = max(0, int(max_size))
+        self.ttl = float(ttl)
+        self.db_path = db_path
+        self._entries = OrderedDict()  # key -> (value, created_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.db_path:
+            self._init_db()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute(CACHE_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _expired(self, created_at):
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def get(self, key):
+        """キャッシュされた値を返す（無い・期限切れの場合は None）"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            entry = self._load_from_db(key)
+            if entry is not None:
+                value, created_at = entry
+                self._store(key, value, created_at)
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """値をキャッシュに保存する（value は JSON 化可能なもの）"""
+        if not self.enabled:
+            return
+        created_at = time.time()
+        with self._lock:
+            self._store(key, value, created_at)
+            self._save_to_db(key, value, created_at)
+
+    def _store(self, key, value, created_at):
+        self._entries[key] = (value, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_from_db(self, key):
+        if not self.db_path:
+            return None
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute(
+                f"SELECT value, created_at FROM {CACHE_TABLE} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = json.loads(row[0]), row[1]
+            if self._expired(created_at):
+                conn.execute(f"DELETE FROM {CACHE_TABLE} WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            return value, created_at
+        except sqlite3.Error as e:
+            print(f"キャッシュの読み込み中にエラーが発生しました: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _save_to_db(self, key, value, created_at):
+        if not self.db_path:
+            return
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {CACHE_TABLE} (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), created_at),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"キャッシュの保存中にエラーが発生しました: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """ヒット・ミス数などの統計を返す"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    同じキーの処理が実行中であれば新たに実行せず、その結果を共有する（asyncio 用）
+
+    決定的なリクエストが同時に大量に届いた場合でも、モデルの推論は1回だけ行われます。
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Future
+        self.leaders = 0     # 実際に処理を実行した回数
+        self.coalesced = 0   # 実行中の処理の結果を共有したリクエスト数
+
+    @property
+    def inflight(self):
+        return len(self._inflight)
+
+    async def run(self, key, fn, retry_on=()):
+        """
+        key の処理が実行中ならその結果を待ち、そうでなければ fn() を実行する
+
+        Args:
+            key: リクエストを識別するキー（キャッシュキーなど）
+            fn: 引数なしで呼び出すコルーチン関数
+            retry_on (tuple): 実行していたリクエストがこれらの例外で失敗した場合、待っていた側は自分で実行し直す
+                （実行していたリクエストだけの事情による失敗。例: そのクライアントの切断）
+
+        Returns:
+            tuple: (結果, 他のリクエストの結果を共有したか)
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                # 待っている側がキャンセルされても実行中の処理は止めない
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # 実行していたリクエストがキャンセルされた場合は自分で実行し直す
+                return await self.run(key, fn, retry_on)
+            except retry_on:
+                return await self.run(key, fn, retry_on)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 待っている側がいなくても警告を出さない
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        return {"inflight": self.inflight, "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,90 @@
+# cancellation.py
+"""
+生成の協調的なキャンセル
+
+クライアントが切断した場合やリクエストの期限を過ぎた場合に、max_new_tokens に達するまで
+デコードを続けないようにします。リクエストごとの CancellationToken を generate の
+stopping_criteria（CancellationCriteria）で毎ステップ確認し、キャンセルされた行の生成を止めます。
+バッチ推論ではキャンセルされたリクエストの行だけが終了し、他のリクエストはそのまま生成を続けます。
+"""
+
+import asyncio
+import threading
+import time
+
+DISCONNECTED = "disconnected"
+DEADLINE = "deadline"
+
+
+class GenerationCancelled(Exception):
+    """生成がキャンセルされた場合の例外"""
+
+    def __init__(self, reason):
+        super().__init__(f"生成がキャンセルされました: {reason}")
+        self.reason = reason
+
+
+class CancellationToken:
+    """1リクエストのキャンセル状態（推論スレッドからも参照される）"""
+
+    def __init__(self, deadline=None):
+        """
+        Args:
+            deadline (float, optional): time.monotonic() 基準の期限。過ぎるとキャンセル扱いになる
+        """
+        self.deadline = deadline
+        self.reason = None
+        self._lock = threading.Lock()
+
+    def cancel(self, reason):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+
+    @property
+    def cancelled(self):
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE)
+        return self.reason is not None
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled(self.reason)
+
+
+class CancellationCriteria:
+    """
+    generate の stopping_criteria に渡す停止条件
+
+    tokens はバッチの行と同じ順番の CancellationToken（None の行は止めない）です。
+    """
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+
+    def stopped_rows(self):
+        """行ごとに生成を止めるかどうか"""
+        return [token is not None and token.cancelled for token in self.tokens]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        rows = self.stopped_rows()
+        if len(rows) != input_ids.shape[0]:
+            # num_return_sequences などで行数が変わる場合は全行で同じ判定をする
+            rows = [all(rows)] * input_ids.shape[0]
+        return torch.tensor(rows, dtype=torch.bool, device=input_ids.device)
+
+
+async def watch_disconnect(raw_request, token, task, interval=0.25):
+    """
+    クライアントの切断を監視し、切断されたら token をキャンセルして task も止める
+
+    生成の完了時に呼び出し側でこのコルーチンのタスクをキャンセルしてください。
+    """
+    while not token.cancelled:
+        if await raw_request.is_disconnected():
+            token.cancel(DISCONNECTED)
+            task.cancel()
+            return
+        await asyncio.sleep(interval)
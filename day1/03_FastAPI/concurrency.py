@@ -0,0 +1,132 @@
+# concurrency.py
+"""
+推論処理の実行管理（同時実行数の制限とバックプレッシャー）
+
+ブロッキングするモデル推論を専用スレッドプールで実行し、イベントループを止めないようにします。
+同時実行数を超えたリクエストは有限の待ち行列で待たせ、満杯の場合は即座に拒否します。
+"""
+
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """待ち行列が満杯、または期限内に処理できる見込みがない場合の例外"""
+
+    def __init__(self, message, retry_after, status_code=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class DeadlineExceededError(Exception):
+    """リクエストの期限までに処理が完了しなかった場合の例外"""
+
+
+class InferenceExecutor:
+    """専用スレッドプールで推論を実行し、同時実行数と待ち行列の長さを制限する"""
+
+    def __init__(self, max_concurrency=1, max_queue_size=16):
+        """
+        Args:
+            max_concurrency (int): 同時に実行する推論の最大数
+            max_queue_size (int): 実行待ちにできるリクエストの最大数
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue_size = max(0, int(max_queue_size))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="inference")
+        self._semaphore = None
+        self.running = 0       # 実行中の推論呼び出し数（スロット使用数）
+        self.active = 0        # 実行中のリクエスト数
+        self.queue_depth = 0   # 実行待ちのリクエスト数
+        self.avg_service_time = 1.0  # 1回の推論にかかる時間の指数移動平均（秒）
+
+    def _get_semaphore(self):
+        # Semaphore はイベントループ上で生成する必要があるため遅延生成する
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def estimate_wait(self, extra=0):
+        """現在の待ち行列から、新しいリクエストの処理開始までの待ち時間（秒）を見積もる"""
+        rounds = (self.queue_depth + extra) / self.max_concurrency
+        if self.running >= self.max_concurrency:
+            rounds += 1
+        return rounds * self.avg_service_time
+
+    def retry_after(self):
+        """Retry-After ヘッダに設定する秒数"""
+        return max(1, math.ceil(self.estimate_wait()))
+
+    def check_admission(self, deadline=None, weight=1):
+        """
+        新しいリクエストを受け付けられるか判定する
+
+        Args:
+            deadline (float, optional): time.monotonic() 基準の処理期限
+            weight (int): 受け付けるリクエスト数
+
+        Raises:
+            QueueFullError: 待ち行列が満杯 (429)、または期限までに処理開始できない見込み (503)
+        """
+        busy = self.running >= self.max_concurrency
+        if busy and self.queue_depth + weight > self.max_queue_size:
+            raise QueueFullError("リクエストが混み合っています。", self.retry_after(), status_code=429)
+        if deadline is not None and busy and time.monotonic() + self.estimate_wait() > deadline:
+            raise QueueFullError("期限内に処理を開始できる見込みがありません。", self.retry_after(), status_code=503)
+
+    async def run(self, fn, *args, weight=1, deadline=None, check=True):
+        """
+        fn(*args) を専用スレッドプールで実行して結果を返す
+
+        Args:
+            weight (int): この呼び出しが処理するリクエスト数（バッチの場合はバッチサイズ）
+            deadline (float, optional): time.monotonic() 基準の処理期限
+            check (bool): 受付判定を行うか（呼び出し側で check_admission 済みの場合は False）
+
+        Raises:
+            QueueFullError: 受付不可の場合
+            DeadlineExceededError: 期限までに完了しなかった場合
+        """
+        if check:
+            self.check_admission(deadline, weight)
+        semaphore = self._get_semaphore()
+
+        self.queue_depth += weight
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self._remaining(deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("実行待ちの間に期限を過ぎました。")
+        finally:
+            self.queue_depth -= weight
+
+        self.running += 1
+        self.active += weight
+        start_time = time.monotonic()
+        future = asyncio.wrap_future(self._executor.submit(fn, *args))
+
+        def _release(_):
+            # スレッドの処理が実際に終わるまでスロットを解放しない
+            self.running -= 1
+            self.active -= weight
+            elapsed = time.monotonic() - start_time
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+            semaphore.release()
+
+        future.add_done_callback(_release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self._remaining(deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("推論が期限内に完了しませんでした。")
+
+    @staticmethod
+    def _remaining(deadline):
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    def shutdown(self):
+        """スレッドプールを停止する"""
+        self._executor.shutdown(wait=False)
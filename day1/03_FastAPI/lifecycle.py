@@ -0,0 +1,73 @@
+# lifecycle.py
+"""
+モデルの読み込み状態の管理
+
+サーバーはモデルの読み込みを待たずに起動し、読み込み・ウォームアップはバックグラウンドで行います。
+状態は loading → warming → ready（失敗時は failed）と遷移し、
+/ready エンドポイントや生成エンドポイントの 503 応答はこの状態を参照します。
+"""
+
+import threading
+import time
+
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelLifecycle:
+    """モデルの状態と、起動から準備完了までの各所要時間を保持する"""
+
+    def __init__(self, process_start=None):
+        self.process_start = process_start or time.time()
+        self.state = LOADING
+        self.error = None
+        self.load_seconds = None     # モデルの読み込み時間
+        self.warmup_seconds = None   # ウォームアップ時間
+        self.ready_at = None
+        self._state_since = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def set_state(self, state, error=None):
+        """状態を遷移させ、直前の状態の所要時間を記録する"""
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._state_since
+            if self.state == LOADING and state != LOADING:
+                self.load_seconds = elapsed
+            elif self.state == WARMING and state != WARMING:
+                self.warmup_seconds = elapsed
+            if state == READY:
+                self.ready_at = now
+            self.state = state
+            self.error = error
+            self._state_since = now
+
+    @property
+    def time_to_ready(self):
+        """プロセス起動から準備完了までの時間（秒）"""
+        if self.ready_at is None:
+            return None
+        return self.ready_at - self.process_start
+
+    def retry_after(self):
+        """準備できていない間の Retry-After（秒）"""
+        if self.state == FAILED:
+            return 60
+        if self.state == WARMING:
+            return 5
+        return 10
+
+    def as_dict(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "time_to_ready": self.time_to_ready,
+        }
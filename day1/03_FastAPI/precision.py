@@ -0,0 +1,112 @@
+# precision.py
+"""
+モデル読み込み時の精度（fp32 / bf16 / int8）の選択
+
+- fp32: 32bit 浮動小数点。どの CPU でも動くが、メモリ使用量が最も大きい
+- bf16: bfloat16。AVX512_BF16 / AMX を持つ CPU や GPU では速いが、持たない CPU では遅くなる
+- int8: fp32 で読み込んだ後、線形層の重みを動的量子化（torch.ao.quantization.quantize_dynamic）する。CPU 専用
+- auto: GPU なら bf16、CPU なら bf16 命令の有無を /proc/cpuinfo から判定して bf16 / fp32 を選ぶ
+
+int8 は精度が僅かに落ちるため auto では選ばず、明示的に指定した場合のみ使います。
+（02_streamlit_app/precision.py と同じ内容です）
+"""
+
+FP32 = "fp32"
+BF16 = "bf16"
+INT8 = "int8"
+AUTO = "auto"
+PRECISIONS = (FP32, BF16, INT8)
+
+_ALIASES = {"float32": FP32, "bfloat16": BF16, "qint8": INT8}
+# 読み込み時の dtype 名（int8 は fp32 で読み込んでから量子化する）
+_DTYPE_NAMES = {FP32: "float32", BF16: "bfloat16", INT8: "float32"}
+# bf16 の行列演算を高速に実行できる CPU 命令
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+
+
+def parse_cpu_flags(cpuinfo_text):
+    """/proc/cpuinfo の内容から CPU フラグの集合を返す"""
+    flags = set()
+    for line in cpuinfo_text.splitlines():
+        key, _, value = line.partition(":")
+        if key.strip() in ("flags", "Features"):
+            flags.update(value.split())
+    return flags
+
+
+def read_cpu_flags(path="/proc/cpuinfo"):
+    """ホスト CPU のフラグを返す（取得できない環境では空集合）"""
+    try:
+        with open(path) as f:
+            return parse_cpu_flags(f.read())
+    except OSError:
+        return set()
+
+
+def cpu_supports_bf16(cpu_flags=None):
+    """CPU が bf16 の演算命令を持つか"""
+    if cpu_flags is None:
+        cpu_flags = read_cpu_flags()
+    return any(flag in cpu_flags for flag in BF16_CPU_FLAGS)
+
+
+def resolve_precision(requested, device, cpu_flags=None):
+    """
+    設定値とデバイスから実際に使う精度を決める
+
+    Args:
+        requested (str): "auto" / "fp32" / "bf16" / "int8"（"float32" などの別名も可）
+        device (str): "cpu" または "cuda"
+        cpu_flags (set, optional): CPU フラグ（省略時は /proc/cpuinfo から取得）
+
+    Returns:
+        str: "fp32" / "bf16" / "int8" のいずれか
+    """
+    precision = (requested or AUTO).strip().lower()
+    precision = _ALIASES.get(precision, precision)
+    if precision != AUTO and precision not in PRECISIONS:
+        raise ValueError(f"不明な精度です: {requested}（{', '.join(PRECISIONS + (AUTO,))} のいずれかを指定してください）")
+
+    if device != "cpu":
+        if precision == INT8:
+            print("警告: int8 の動的量子化は CPU 専用のため bf16 で読み込みます")
+        return BF16 if precision in (AUTO, INT8) else precision
+    if precision == AUTO:
+        return BF16 if cpu_supports_bf16(cpu_flags) else FP32
+    return precision
+
+
+def dtype_name(precision):
+    """読み込み時の torch の dtype 名を返す"""
+    return _DTYPE_NAMES[precision]
+
+
+def torch_dtype(precision):
+    """読み込み時の torch の dtype を返す"""
+    import torch
+
+    return getattr(torch, dtype_name(precision))
+
+
+def quantize_model(model, precision):
+    """int8 の場合は線形層を動的量子化する（それ以外はそのまま返す）"""
+    if precision != INT8:
+        return model
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_text_generation_pipeline(model_name, precision, device):
+    """指定した精度で text-generation pipeline を作成する"""
+    from transformers import pipeline
+
+    pipe = pipeline(
+        "text-generation",
+        model=model_name,
+        model_kwargs={"torch_dtype": torch_dtype(precision)},
+        device=device
+    )
+    quantize_model(pipe.model, precision)
+    return pipe
@@ -0,0 +1,216 @@
+# prefix_cache.py
+"""
+共通のプロンプト前置部（指示文など）に対する KV キャッシュ
+
+過去に処理したプロンプトの past_key_values をトークン単位のプレフィックス木（trie）に保存し、
+新しいプロンプトと最長一致する前置部の KV を再利用して、その続きからプレフィル・生成を行います。
+保存量はバイト数の上限で管理し、超えた場合は最も古く使われたエントリから削除します。
+"""
+
+import copy
+import itertools
+import threading
+import time
+
+
+class _TrieNode:
+    __slots__ = ("children", "entry_ids")
+
+    def __init__(self):
+        self.children = {}     # token_id -> _TrieNode
+        self.entry_ids = set() # このノードを通るエントリの ID
+
+
+class PrefixTrie:
+    """トークン列をキーに値を保存し、最長共通プレフィックスで検索できるメモリ上限付きの trie"""
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes (int): 保存する値の合計バイト数の上限
+        """
+        self.max_bytes = int(max_bytes)
+        self.total_bytes = 0
+        self._root = _TrieNode()
+        self._entries = {}  # entry_id -> {"tokens", "value", "nbytes", "last_used"}
+        self._ids = itertools.count()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def longest_prefix(self, token_ids):
+        """
+        token_ids と最長一致するエントリを探す
+
+        Returns:
+            tuple: (一致したトークン数, 値)。一致するエントリが無い場合は (0, None)
+        """
+        node = self._root
+        depth = 0
+        for token in token_ids:
+            child = node.children.get(token)
+            if child is None or not child.entry_ids:
+                break
+            node = child
+            depth += 1
+        if depth == 0:
+            return 0, None
+
+        # このノード以下のエントリは先頭 depth トークンが一致している。最近使われたものを選ぶ
+        entry_id = max(node.entry_ids, key=lambda i: self._entries[i]["last_used"])
+        entry = self._entries[entry_id]
+        entry["last_used"] = time.monotonic()
+        return depth, entry["value"]
+
+    def insert(self, token_ids, value, nbytes):
+        """token_ids に対応する値を保存する（上限を超える場合は古いエントリを削除）"""
+        if nbytes > self.max_bytes:
+            return False
+        entry_id = next(self._ids)
+        self._entries[entry_id] = {
+            "tokens": tuple(token_ids),
+            "value": value,
+            "nbytes": nbytes,
+            "last_used": time.monotonic(),
+        }
+        node = self._root
+        for token in token_ids:
+            node = node.children.setdefault(token, _TrieNode())
+            node.entry_ids.add(entry_id)
+        self.total_bytes += nbytes
+
+        while self.total_bytes > self.max_bytes:
+            oldest = min(
+                (i for i in self._entries if i != entry_id),
+                key=lambda i: self._entries[i]["last_used"],
+            )
+            self._remove(oldest)
+            self.evictions += 1
+        return True
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self.total_bytes -= entry["nbytes"]
+        node = self._root
+        for token in entry["tokens"]:
+            child = node.children[token]
+            child.entry_ids.discard(entry_id)
+            if not child.entry_ids:
+                # 他のエントリが通らない枝はまとめて削除する
+                del node.children[token]
+                break
+            node = child
+
+
+def cache_nbytes(past_key_values):
+    """past_key_values が使用するメモリ量（バイト）を返す"""
+    if hasattr(past_key_values, "layers"):
+        tensors = [t for layer in past_key_values.layers for t in (layer.keys, layer.values)]
+    else:
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+
+def crop_cache(past_key_values, length):
+    """
+    past_key_values を先頭の length トークンに切り詰める
+
+    crop に正の長さを渡す使い方は transformers で非推奨になったため、末尾から取り除く数を負の値で渡します
+    （負の値は古いバージョンでも同じ意味です）。length 以下の長さであれば何もしません。
+    """
+    remove = past_key_values.get_seq_length() - length
+    if remove > 0:
+        past_key_values.crop(-remove)
+
+
+class PrefixCachedPipeline:
+    """
+    text-generation pipeline のラッパー。単一プロンプトの呼び出しでは前置部の KV キャッシュを再利用する
+
+    pipeline と同じ呼び出し方・戻り値（[{"generated_text": プロンプト + 生成文}]）で使えます。
+    複数プロンプトの呼び出しやキャッシュを利用できないモデルでは元の pipeline に委譲します。
+    """
+
+    def __init__(self, pipe, max_bytes, min_prefix_tokens=32):
+        """
+        Args:
+            pipe: transformers の text-generation pipeline
+            max_bytes (int): KV キャッシュに使う最大メモリ量（バイト）
+            min_prefix_tokens (int): 再利用・保存の対象とする最小トークン数
+        """
+        self.pipe = pipe
+        self.model = pipe.model
+        self.tokenizer = pipe.tokenizer
+        self.trie = PrefixTrie(max_bytes)
+        self.min_prefix_tokens = min_prefix_tokens
+        self.supported = True
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "reused_tokens": 0, "prefilled_tokens": 0}
+        # プロンプトのトークン列のキャッシュ（prompt_guard.TokenCache。設定すると長さの確認時の結果を再利用する）
+        self.token_cache = None
+
+    def __getattr__(self, name):
+        # tokenizer / model 以外の属性は元の pipeline のものを使う
+        if name == "pipe":
+            raise AttributeError(name)
+        return getattr(self.pipe, name)
+
+    def __call__(self, inputs, **kwargs):
+        if not self.supported or not isinstance(inputs, str) or "batch_size" in kwargs:
+            return self.pipe(inputs, **kwargs)
+        try:
+            return self._generate(inputs, **kwargs)
+        except Exception as e:
+            # モデルがキャッシュの受け渡しに対応していない場合は以降通常の pipeline を使う
+            print(f"プレフィックスキャッシュを利用できないため無効化します: {e}")
+            self.supported = False
+            return self.pipe(inputs, **kwargs)
+
+    def _generate(self, prompt, **kwargs):
+        import torch
+        from transformers import DynamicCache
+
+        if self.token_cache is not None:
+            token_ids = self.token_cache.encode(prompt)
+            input_ids = torch.tensor([token_ids], device=self.model.device)
+            inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        else:
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+            token_ids = inputs["input_ids"][0].tolist()
+        # 生成には少なくとも1トークンをキャッシュ外に残す必要がある
+        prefix_len = len(token_ids) - 1
+
+        with self._lock:
+            self.stats["lookups"] += 1
+            matched, cached = self.trie.longest_prefix(token_ids[:prefix_len])
+            if matched >= self.min_prefix_tokens:
+                past = copy.deepcopy(cached)
+                crop_cache(past, matched)
+                self.stats["hits"] += 1
+                self.stats["reused_tokens"] += matched
+            else:
+                matched = 0
+                past = DynamicCache()
+
+        # キャッシュされていない前置部だけをプレフィルする
+        if matched < prefix_len:
+            with torch.no_grad():
+                self.model(
+                    input_ids=inputs["input_ids"][:, matched:prefix_len],
+                    attention_mask=inputs["attention_mask"][:, :prefix_len],
+                    past_key_values=past,
+                    cache_position=torch.arange(matched, prefix_len, device=self.model.device),
+                    use_cache=True,
+                )
+            self.stats["prefilled_tokens"] += prefix_len - matched
+            if prefix_len >= self.min_prefix_tokens:
+                with self._lock:
+                    self.trie.insert(token_ids[:prefix_len], copy.deepcopy(past), cache_nbytes(past))
+
+        generate_kwargs = {k: v for k, v in kwargs.items() if k != "return_full_text"}
+        output_ids = self.model.generate(**inputs, past_key_values=past, **generate_kwargs)
+        completion = self.tokenizer.decode(output_ids[0][len(token_ids):], skip_special_tokens=True)
+        if kwargs.get("return_full_text", True):
+            return [{"generated_text": prompt + completion}]
+        return [{"generated_text": completion}]
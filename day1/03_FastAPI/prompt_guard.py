@@ -0,0 +1,192 @@
+# prompt_guard.py
+"""
+コンテキスト長に基づくプロンプトの長さの制限
+
+長すぎるプロンプトはプレフィルに非常に時間がかかり、モデルのコンテキスト長を超えると生成自体が失敗します。
+PromptGuard はプロンプトのトークン数を数え、上限を超える場合は拒否または切り詰め、
+max_new_tokens をコンテキストの残りに収まるよう制限して、1リクエストあたりの最悪のコストを抑えます。
+
+切り詰め方（strategy）:
+- reject: 切り詰めずに PromptTooLongError を送出する
+- head: 先頭を削って末尾を残す（直近の内容が重要な会話向け）
+- tail: 末尾を削って先頭を残す
+- middle: 中央を削って先頭と末尾を残す（指示文と質問の両方を残したい場合）
+
+トークン列は TokenCache（LRU）に保存し、同じプロンプトの再トークン化を省きます。
+"""
+
+import threading
+from collections import OrderedDict
+
+STRATEGIES = ("reject", "head", "tail", "middle")
+
+
+class PromptTooLongError(ValueError):
+    """プロンプトがトークン数の上限を超えた場合の例外"""
+
+    def __init__(self, prompt_tokens, max_prompt_tokens):
+        super().__init__(
+            f"プロンプトが長すぎます（{prompt_tokens} トークン、上限 {max_prompt_tokens} トークン）。"
+        )
+        self.prompt_tokens = prompt_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+
+
+class TokenCache:
+    """プロンプト -> トークン列の LRU キャッシュ（推論スレッドからも使われる）"""
+
+    def __init__(self, tokenizer, max_size=1024):
+        self.tokenizer = tokenizer
+        self.max_size = max(0, int(max_size))
+        self._entries = OrderedDict()  # (テキスト, add_special_tokens) -> トークン列（tuple）
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def encode(self, text, add_special_tokens=True):
+        """text のトークン列を返す（キャッシュに無ければトークン化して保存する）"""
+        key = (text, add_special_tokens)
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(ids)
+            self.misses += 1
+        ids = self.tokenizer.encode(text, add_special_tokens=add_special_tokens)
+        self.put(text, ids, add_special_tokens)
+        return list(ids)
+
+    def put(self, text, ids, add_special_tokens=True):
+        if self.max_size == 0:
+            return
+        key = (text, add_special_tokens)
+        with self._lock:
+            self._entries[key] = tuple(ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+def truncate_ids(ids, budget, strategy):
+    """トークン列を budget 個に切り詰める（strategy は head / tail / middle）"""
+    ids = list(ids)
+    if len(ids) <= budget:
+        return ids
+    if budget <= 0:
+        return []
+    if strategy == "head":
+        return ids[len(ids) - budget:]
+    if strategy == "tail":
+        return ids[:budget]
+    if strategy == "middle":
+        front = (budget + 1) // 2
+        return ids[:front] + ids[len(ids) - (budget - front):]
+    raise ValueError(f"不明な切り詰め方です: {strategy}（{', '.join(STRATEGIES[1:])} のいずれか）")
+
+
+def model_context_length(pipe, default=8192):
+    """モデルのコンテキスト長（最大位置数）を返す（取得できなければ default）"""
+    model_config = getattr(getattr(pipe, "model", None), "config", None)
+    length = getattr(model_config, "max_position_embeddings", None)
+    if not length:
+        # レプリカなどモデル本体を持たない場合はトークナイザーの上限を使う（未設定だと巨大な値になる）
+        length = getattr(getattr(pipe, "tokenizer", None), "model_max_length", None)
+        if not length or length > 10 ** 7:
+            return default
+    return int(length)
+
+
+class GuardedPrompt:
+    """PromptGuard.check の結果"""
+
+    __slots__ = ("prompt", "token_ids", "max_new_tokens", "original_tokens", "truncated", "clamped")
+
+    def __init__(self, prompt, token_ids, max_new_tokens, original_tokens, truncated, clamped):
+        self.prompt = prompt
+        self.token_ids = token_ids
+        self.max_new_tokens = max_new_tokens
+        self.original_tokens = original_tokens
+        self.truncated = truncated  # プロンプトを切り詰めたか
+        self.clamped = clamped      # max_new_tokens を減らしたか
+
+    @property
+    def prompt_tokens(self):
+        return len(self.token_ids)
+
+
+class PromptGuard:
+    """プロンプトのトークン数を確認し、上限を超える場合は拒否または切り詰める"""
+
+    def __init__(self, tokenizer, max_context, max_prompt_tokens=None, strategy="reject",
+                 min_new_tokens=16, cache_size=1024):
+        """
+        Args:
+            tokenizer: トークナイザー（encode / decode を使う）
+            max_context (int): プロンプトと生成を合わせたトークン数の上限（モデルのコンテキスト長）
+            max_prompt_tokens (int, optional): プロンプトのトークン数の上限。省略時は max_context - min_new_tokens
+            strategy (str): 上限を超えた場合の扱い（reject / head / tail / middle）
+            min_new_tokens (int): 生成のために必ず残すトークン数
+            cache_size (int): トークン列のキャッシュに保持するプロンプト数
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"不明な切り詰め方です: {strategy}（{', '.join(STRATEGIES)} のいずれか）")
+        self.tokenizer = tokenizer
+        self.max_context = int(max_context)
+        self.min_new_tokens = max(1, int(min_new_tokens))
+        limit = self.max_context - self.min_new_tokens
+        self.max_prompt_tokens = min(limit, int(max_prompt_tokens)) if max_prompt_tokens else limit
+        self.strategy = strategy
+        self.cache = TokenCache(tokenizer, cache_size)
+        self.stats = {"checked": 0, "rejected": 0, "truncated": 0, "clamped": 0}
+
+    def encode(self, text, add_special_tokens=True):
+        return self.cache.encode(text, add_special_tokens)
+
+    def check(self, prompt, max_new_tokens, add_special_tokens=True):
+        """
+        プロンプトの長さを確認し、必要なら切り詰め、max_new_tokens を残りのコンテキストに収める
+
+        Raises:
+            PromptTooLongError: strategy が reject で、上限を超えている場合
+        """
+        self.stats["checked"] += 1
+        token_ids = self.encode(prompt, add_special_tokens)
+        original_tokens = len(token_ids)
+        truncated = False
+        if original_tokens > self.max_prompt_tokens:
+            if self.strategy == "reject":
+                self.stats["rejected"] += 1
+                raise PromptTooLongError(original_tokens, self.max_prompt_tokens)
+            prompt, token_ids = self._truncate(prompt, add_special_tokens)
+            truncated = True
+            self.stats["truncated"] += 1
+
+        allowed = self.max_context - len(token_ids)
+        clamped = max_new_tokens > allowed
+        if clamped:
+            max_new_tokens = allowed
+            self.stats["clamped"] += 1
+        return GuardedPrompt(prompt, token_ids, max_new_tokens, original_tokens, truncated, clamped)
+
+    def _truncate(self, prompt, add_special_tokens):
+        """特殊トークンを除いた本文を切り詰め、上限に収まるまで再トークン化して確かめる"""
+        content_ids = self.tokenizer.encode(prompt, add_special_tokens=False)
+        special = len(self.encode(prompt, add_special_tokens)) - len(content_ids)
+        budget = self.max_prompt_tokens - special
+        # 切れ目のトークンが結合・分割されて長さが変わることがあるため、数回まで詰め直す
+        for _ in range(4):
+            text = self.tokenizer.decode(truncate_ids(content_ids, budget, self.strategy), skip_special_tokens=True)
+            token_ids = self.encode(text, add_special_tokens)
+            overflow = len(token_ids) - self.max_prompt_tokens
+            if overflow <= 0:
+                return text, token_ids
+            budget -= overflow
+        raise PromptTooLongError(len(token_ids), self.max_prompt_tokens)
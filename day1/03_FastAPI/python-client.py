@@ -28,7 +28,7 @@ class LLMClient:
         response = self.session.get(f"{self.api_url}/health")
         return response.json()
     
-    def generate(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True):
+    def generate(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True, assisted=False, timings=False):
         """
         テキスト生成
         
@@ -38,6 +38,8 @@ class LLMClient:
             temperature (float, optional): 温度パラメータ
             top_p (float, optional): top-p サンプリングのパラメータ
             do_sample (bool, optional): サンプリングを行うかどうか
+            assisted (bool, optional): ドラフトモデルによる投機的デコーディングを使うか
+            timings (bool, optional): 応答にフェーズ別の所要時間（tokenize / queue / prefill / decode / postprocess）を含めるか
         
         Returns:
             dict: 生成結果
@@ -49,6 +51,10 @@ class LLMClient:
             "top_p": top_p,
             "do_sample": do_sample
         }
+        if assisted:
+            payload["assisted"] = True
+        if timings:
+            payload["timings"] = True
         
         start_time = time.time()
         response = self.session.post(
@@ -64,6 +70,127 @@ class LLMClient:
         else:
             raise Exception(f"API error: {response.status_code} - {response.text}")
 
+    def generate_batch(self, prompts, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True, batch_size=None):
+        """
+        複数プロンプトのバッチ生成
+        
+        Args:
+            prompts (list[str]): プロンプト文字列のリスト
+            max_new_tokens (int, optional): 生成する最大トークン数
+            temperature (float, optional): 温度パラメータ
+            top_p (float, optional): top-p サンプリングのパラメータ
+            do_sample (bool, optional): サンプリングを行うかどうか
+            batch_size (int, optional): サーバー側で1回の推論にまとめるプロンプト数
+        
+        Returns:
+            dict: 生成結果（results にプロンプトと同じ順序で各結果が入る）
+        """
+        payload = {
+            "prompts": list(prompts),
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample
+        }
+        if batch_size is not None:
+            payload["batch_size"] = batch_size
+        
+        start_time = time.time()
+        response = self.session.post(
+            f"{self.api_url}/generate/batch",
+            json=payload
+        )
+        total_time = time.time() - start_time
+        
+        if response.status_code == 200:
+            result = response.json()
+            result["total_request_time"] = total_time
+            return result
+        else:
+            raise Exception(f"API error: {response.status_code} - {response.text}")
+
+    def chat(self, messages, session_id=None, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True):
+        """
+        会話履歴に続く応答の生成
+        
+        Args:
+            messages (list[dict]): {"role": ..., "content": ...} のリスト
+            session_id (str, optional): 前の応答の session_id。指定すると前のターンまでの KV キャッシュを再利用する
+            max_new_tokens (int, optional): 生成する最大トークン数
+            temperature (float, optional): 温度パラメータ
+            top_p (float, optional): top-p サンプリングのパラメータ
+            do_sample (bool, optional): サンプリングを行うかどうか
+        
+        Returns:
+            dict: 生成結果（message, session_id, reused_tokens, prefilled_tokens など）
+        """
+        payload = {
+            "messages": messages,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample
+        }
+        if session_id:
+            payload["session_id"] = session_id
+        
+        start_time = time.time()
+        response = self.session.post(f"{self.api_url}/chat", json=payload)
+        total_time = time.time() - start_time
+        
+        if response.status_code == 200:
+            result = response.json()
+            result["total_request_time"] = total_time
+            return result
+        else:
+            raise Exception(f"API error: {response.status_code} - {response.text}")
+
+    def generate_stream(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, do_sample=True):
+        """
+        ストリーミングテキスト生成（Server-Sent Events）
+        
+        Args:
+            prompt (str): プロンプト文字列
+            max_new_tokens (int, optional): 生成する最大トークン数
+            temperature (float, optional): 温度パラメータ
+            top_p (float, optional): top-p サンプリングのパラメータ
+            do_sample (bool, optional): サンプリングを行うかどうか
+        
+        Yields:
+            dict: 生成途中は {"token": "..."}、最後に {"done": True, "generated_text": ..., "response_time": ...,
+                  "time_to_first_token": ..., "tokens_per_sec": ...}
+        """
+        payload = {
+            "prompt": prompt,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample
+        }
+        
+        start_time = time.time()
+        with self.session.post(f"{self.api_url}/generate/stream", json=payload, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"API error: {response.status_code} - {response.text}")
+            
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    event = None
+                    continue
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                    continue
+                if not line.startswith("data:"):
+                    continue
+                
+                data = json.loads(line[len("data:"):].strip())
+                if event == "error":
+                    raise Exception(f"API error: {data.get('error')}")
+                if data.get("done"):
+                    data["total_request_time"] = time.time() - start_time
+                yield data
+
 # 使用例
 if __name__ == "__main__":
     # ngrok URLを設定（実際のURLに置き換えてください）
@@ -79,9 +206,44 @@ if __name__ == "__main__":
     
     # 単一の質問
     print("Simple question:")
-    result = client.generate([
-        {"prompt": "AIについて100文字で教えてください"}
-    ])
+    result = client.generate("AIについて100文字で教えてください")
     print(f"Response: {result['generated_text']}")
     print(f"Model processing time: {result['response_time']:.2f}s")
-    print(f"Total request time: {result['total_request_time']:.2f}s")    
\ No newline at end of file
+    print(f"Total request time: {result['total_request_time']:.2f}s")
+    print()
+    
+    # 複数の質問をまとめて生成
+    print("Batch questions:")
+    batch = client.generate_batch([
+        "AIについて100文字で教えてください",
+        "機械学習について100文字で教えてください",
+    ])
+    for item in batch["results"]:
+        print(f"Response: {item['generated_text']}")
+    print(f"Model processing time: {batch['response_time']:.2f}s ({batch['num_batches']} batches)")
+    print(f"Total request time: {batch['total_request_time']:.2f}s")
+    print()
+    
+    # ストリーミング生成
+    print("Streaming question:")
+    for event in client.generate_stream("AIについて100文字で教えてください"):
+        if "token" in event:
+            print(event["token"], end="", flush=True)
+        elif event.get("done"):
+            print()
+            # 1トークンも生成されなかった場合、time_to_first_token は None
+            ttft = event.get("time_to_first_token")
+            print(f"Time to first token: {ttft:.2f}s" if ttft is not None else "Time to first token: -")
+            print(f"Tokens/sec: {event['tokens_per_sec']:.1f}")
+            print(f"Model processing time: {event['response_time']:.2f}s")    
+    print()
+    
+    # マルチターンの会話（同じ session_id で続けると前のターンはプレフィルされない）
+    print("Chat:")
+    messages = [{"role": "user", "content": "AIについて100文字で教えてください"}]
+    reply = client.chat(messages)
+    print(f"Response: {reply['message']['content']}")
+    messages += [reply["message"], {"role": "user", "content": "もっと短くまとめてください"}]
+    reply = client.chat(messages, session_id=reply["session_id"])
+    print(f"Response: {reply['message']['content']}")
+    print(f"Reused tokens: {reply['reused_tokens']}  Prefilled tokens: {reply['prefilled_tokens']}")
@@ -0,0 +1,337 @@
+# replicas.py
+"""
+複数プロセスのモデルレプリカとリクエストルーター
+
+N 個のワーカープロセスがそれぞれモデルのレプリカを保持し、
+ルーターは処理中のリクエストが最も少ないワーカーにリクエストを振り分けます（least outstanding requests）。
+
+重みは一度だけ torch.save したファイルを各ワーカーが torch.load(mmap=True) で読み込むため、
+レプリカ間で OS のページキャッシュを共有でき、RSS がレプリカ数に比例して増えません。
+ReplicaPool は pipeline と同じ呼び出し方ができるので、app.py の model としてそのまま使えます。
+int8 の動的量子化は各ワーカーが読み込み後に重みを作り直すため、ページキャッシュを共有できません。
+そのため複数レプリカでは int8 を使えません（fp32 / bf16 を指定してください）。
+"""
+
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+def weights_snapshot_path(model_name, dtype_name, cache_dir):
+    """mmap 読み込み用の重みファイルのパスを返す"""
+    return os.path.join(cache_dir, f"{model_name.replace('/', '--')}-{dtype_name}.pt")
+
+
+def prepare_mmap_weights(model_name, dtype_name, cache_dir):
+    """
+    mmap で読み込める形式の重みファイルを作成する（既にあれば何もしない）
+
+    Returns:
+        str: 重みファイルのパス
+    """
+    path = weights_snapshot_path(model_name, dtype_name, cache_dir)
+    if os.path.exists(path):
+        return path
+
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    print(f"mmap 用の重みファイルを作成しています: {path}")
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=getattr(torch, dtype_name))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+    del model
+    return path
+
+
+def load_mmap_pipeline(model_name, weights_path, dtype_name):
+    """mmap した重みを使って text-generation pipeline を作成する"""
+    import torch
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, pipeline
+
+    model_config = AutoConfig.from_pretrained(model_name)
+    # パラメータは meta デバイスに作り、ランダムな重みの確保と初期化をしない
+    # （state_dict に含まれない rotary embedding の inv_freq などのバッファは通常どおり作る）
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(model_config, torch_dtype=getattr(torch, dtype_name))
+    # assign=True でパラメータを mmap されたテンソルに差し替える（コピーしない）
+    state_dict = torch.load(weights_path, mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise RuntimeError(f"重みファイルに含まれないパラメータがあります: {missing[:5]}")
+    model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return pipeline("text-generation", model=model, tokenizer=tokenizer, device="cpu")
+
+
+def replica_worker(worker_id, options, requests, responses):
+    """
+    ワーカープロセスのエントリポイント
+
+    requests から (request_id, inputs, kwargs) を受け取り、
+    responses に (request_id, worker_id, status, payload) を返します。
+    """
+    import torch
+
+    if options.get("torch_threads"):
+        torch.set_num_threads(options["torch_threads"])
+    if options.get("cpus") and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, options["cpus"])
+
+    try:
+        pipe = load_mmap_pipeline(options["model_name"], options["weights_path"], options["dtype"])
+        if options.get("precision"):
+            from precision import quantize_model
+
+            quantize_model(pipe.model, options["precision"])
+        if pipe.tokenizer.pad_token is None:
+            pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        pipe.tokenizer.padding_side = "left"
+        if options.get("prefix_cache_mb"):
+            from prefix_cache import PrefixCachedPipeline
+
+            pipe = PrefixCachedPipeline(pipe, max_bytes=int(options["prefix_cache_mb"] * 1024 * 1024))
+    except Exception as e:
+        responses.put((None, worker_id, "failed", repr(e)))
+        return
+    responses.put((None, worker_id, "ready", None))
+
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        request_id, inputs, kwargs = item
+        try:
+            with torch.no_grad():
+                outputs = pipe(inputs, **kwargs)
+            responses.put((request_id, worker_id, "ok", outputs))
+        except Exception as e:
+            responses.put((request_id, worker_id, "error", repr(e)))
+
+
+def split_cpus(cpus, num_groups):
+    """CPU 番号のリストをできるだけ均等な num_groups 個のグループに分ける"""
+    cpus = sorted(cpus)
+    size, remainder = divmod(len(cpus), num_groups)
+    groups = []
+    start = 0
+    for i in range(num_groups):
+        end = start + size + (1 if i < remainder else 0)
+        groups.append(cpus[start:end] or cpus)
+        start = end
+    return groups
+
+
+class LeastOutstandingRouter:
+    """処理中のリクエスト数が最も少ないワーカーを選ぶルーター"""
+
+    def __init__(self, num_workers):
+        self.outstanding = [0] * num_workers
+        self.completed = [0] * num_workers
+        self.available = [True] * num_workers
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ワーカーを選び、処理中の件数を1増やしてその番号を返す"""
+        with self._lock:
+            candidates = [i for i, ok in enumerate(self.available) if ok]
+            if not candidates:
+                raise RuntimeError("利用可能なレプリカがありません")
+            worker_id = min(candidates, key=lambda i: self.outstanding[i])
+            self.outstanding[worker_id] += 1
+            return worker_id
+
+    def release(self, worker_id):
+        with self._lock:
+            self.outstanding[worker_id] -= 1
+            self.completed[worker_id] += 1
+
+    def mark_unavailable(self, worker_id):
+        with self._lock:
+            self.available[worker_id] = False
+
+
+class ReplicaPool:
+    """モデルレプリカのワーカープロセス群。pipeline と同じように呼び出せる"""
+
+    def __init__(self, model_name, num_replicas=2, torch_threads=None, pin_cpus=True, dtype="bfloat16",
+                 weights_dir=None, prefix_cache_mb=0, start_timeout=1800.0, precision=None):
+        """
+        Args:
+            model_name (str): モデル名
+            num_replicas (int): ワーカープロセス（レプリカ）の数
+            torch_threads (int, optional): ワーカーごとの torch スレッド数（省略時は割り当て CPU 数）
+            pin_cpus (bool): ワーカーごとに CPU アフィニティを設定するか
+            dtype (str): 重みの dtype 名（例: "bfloat16", "float32"）
+            weights_dir (str, optional): mmap 用重みファイルの保存先
+            prefix_cache_mb (float): 各ワーカーのプレフィックス KV キャッシュの上限（MB、0 で無効）
+            start_timeout (float): 全ワーカーの読み込み完了を待つ最大時間（秒）
+            precision (str, optional): "fp32" / "bf16" / "int8"。指定時は dtype より優先する。
+                int8 はレプリカが1つの場合のみ（fp32 の重みを mmap で読み込み、ワーカーで線形層を量子化する）
+
+        Raises:
+            ValueError: 複数レプリカで int8 を指定した場合
+        """
+        self.model_name = model_name
+        self.num_replicas = max(1, int(num_replicas))
+        self.torch_threads = torch_threads
+        self.pin_cpus = pin_cpus
+        self.precision = precision
+        if precision is not None:
+            from precision import INT8, dtype_name
+
+            if precision == INT8 and self.num_replicas > 1:
+                # 量子化した重みはワーカーごとの新しいメモリになり、RSS がレプリカ数に比例して増える
+                raise ValueError("int8 は複数レプリカでは利用できません（MODEL_PRECISION に fp32 / bf16 を指定してください）")
+            dtype = dtype_name(precision)
+        self.dtype = dtype
+        self.weights_dir = weights_dir or os.path.join(os.path.expanduser("~"), ".cache", "llm_replicas")
+        self.prefix_cache_mb = prefix_cache_mb
+        self.start_timeout = start_timeout
+        self.router = LeastOutstandingRouter(self.num_replicas)
+        self.tokenizer = None
+        self._ctx = mp.get_context("spawn")
+        self._processes = []
+        self._request_queues = []
+        self._responses = None
+        self._pending = {}  # request_id -> (Future, worker_id)
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._collector = None
+        self._running = False
+
+    def start(self):
+        """重みファイルを準備してワーカーを起動し、全レプリカの読み込み完了を待つ"""
+        from transformers import AutoTokenizer
+
+        weights_path = prepare_mmap_weights(self.model_name, self.dtype, self.weights_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        cpu_groups = split_cpus(cpus, self.num_replicas)
+        self._responses = self._ctx.Queue()
+        for worker_id in range(self.num_replicas):
+            options = {
+                "model_name": self.model_name,
+                "weights_path": weights_path,
+                "dtype": self.dtype,
+                "torch_threads": self.torch_threads or len(cpu_groups[worker_id]),
+                "cpus": cpu_groups[worker_id] if self.pin_cpus else None,
+                "prefix_cache_mb": self.prefix_cache_mb,
+                "precision": self.precision,
+            }
+            requests = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=replica_worker,
+                args=(worker_id, options, requests, self._responses),
+                daemon=True,
+            )
+            process.start()
+            self._request_queues.append(requests)
+            self._processes.append(process)
+
+        # 全ワーカーの読み込み完了を待つ
+        ready = set()
+        deadline = time.monotonic() + self.start_timeout
+        while len(ready) < self.num_replicas:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.shutdown()
+                raise TimeoutError("レプリカの起動がタイムアウトしました")
+            request_id, worker_id, status, payload = self._responses.get(timeout=remaining)
+            if status == "failed":
+                self.shutdown()
+                raise RuntimeError(f"レプリカ {worker_id} の起動に失敗しました: {payload}")
+            ready.add(worker_id)
+            print(f"レプリカ {worker_id} の準備ができました ({len(ready)}/{self.num_replicas})")
+
+        self._running = True
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def submit(self, inputs, kwargs):
+        """リクエストをワーカーに振り分け、結果を受け取る Future を返す"""
+        future = Future()
+        worker_id = self.router.acquire()
+        request_id = next(self._ids)
+        with self._pending_lock:
+            self._pending[request_id] = (future, worker_id)
+        self._request_queues[worker_id].put((request_id, inputs, kwargs))
+        return future
+
+    def __call__(self, inputs, **kwargs):
+        streamer = kwargs.pop("streamer", None)
+        if streamer is None:
+            return self.submit(inputs, kwargs).result()
+
+        # ストリーマはプロセス間で共有できないため、生成完了後にまとめて渡す
+        kwargs["return_full_text"] = False
+        outputs = self.submit(inputs, kwargs).result()
+        streamer.on_finalized_text(outputs[0]["generated_text"], stream_end=True)
+        return outputs
+
+    def _collect(self):
+        """ワーカーからの結果を受け取り、対応する Future に設定する"""
+        while self._running:
+            try:
+                request_id, worker_id, status, payload = self._responses.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                break
+            with self._pending_lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is None:
+                continue
+            future, _ = entry
+            self.router.release(worker_id)
+            if status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"レプリカ {worker_id} で推論に失敗しました: {payload}"))
+
+    def _check_workers(self):
+        """終了したワーカーを振り分け対象から外し、処理中だったリクエストを失敗させる"""
+        for worker_id, process in enumerate(self._processes):
+            if process.is_alive() or not self.router.available[worker_id]:
+                continue
+            print(f"レプリカ {worker_id} が終了しました (exitcode={process.exitcode})")
+            self.router.mark_unavailable(worker_id)
+            with self._pending_lock:
+                lost = [rid for rid, (_, wid) in self._pending.items() if wid == worker_id]
+                for request_id in lost:
+                    future, _ = self._pending.pop(request_id)
+                    future.set_exception(RuntimeError(f"レプリカ {worker_id} が終了しました"))
+
+    def stats(self):
+        """レプリカごとの処理中・完了件数を返す"""
+        return {
+            "replicas": self.num_replicas,
+            "outstanding": list(self.router.outstanding),
+            "completed": list(self.router.completed),
+            "available": list(self.router.available),
+        }
+
+    def shutdown(self):
+        """全ワーカーを停止する"""
+        self._running = False
+        for requests in self._request_queues:
+            try:
+                requests.put(None)
+            except (OSError, ValueError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,189 @@
+# scheduler.py
+"""
+コストを考慮したリクエストの受付スケジューラ
+
+到着順に処理すると、max_new_tokens の大きいリクエストが短いリクエストを長時間待たせてしまいます。
+このスケジューラはモデルの手前でリクエストを待たせ、次の順に実行するリクエストを選びます。
+
+1. クライアント（API キー）ごとの公平キュー: これまでに実行したコストが最も少ないクライアントを優先
+2. クライアント内では予想コストの小さいリクエストを優先（SJF）。待ち時間に応じて優先度を上げ（aging）、
+   長いリクエストが飢餓状態にならないようにする
+3. 実行中のリクエストのデコードトークン数（max_new_tokens の合計）が上限を超えないようにする
+"""
+
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+from concurrency import DeadlineExceededError, QueueFullError
+
+
+def estimate_cost(prompt_tokens, max_new_tokens, prefill_weight=0.1):
+    """
+    リクエストの予想コストを返す
+
+    デコードは1トークンずつ、プレフィルはまとめて処理されるため、
+    プロンプトのトークンは prefill_weight 倍で数えます。
+    """
+    return max_new_tokens + prompt_tokens * prefill_weight
+
+
+class _Job:
+    __slots__ = ("client_id", "cost", "decode_tokens", "enqueued_at", "seq", "future")
+
+    def __init__(self, client_id, cost, decode_tokens, seq, future):
+        self.client_id = client_id
+        self.cost = cost
+        self.decode_tokens = decode_tokens
+        self.enqueued_at = time.monotonic()
+        self.seq = seq
+        self.future = future
+
+
+class CostAwareScheduler:
+    """SJF + aging + クライアントごとの公平キュー + デコードトークン数の上限を持つスケジューラ"""
+
+    def __init__(self, max_active=8, max_outstanding_tokens=8192, max_waiting=64,
+                 aging_rate=100.0, retry_after=None):
+        """
+        Args:
+            max_active (int): 同時に実行するリクエストの最大数
+            max_outstanding_tokens (int): 実行中のリクエストの max_new_tokens の合計の上限。
+                1件でこれを超えるリクエストは、他に実行中のものが無いときに単独で実行する
+            max_waiting (int): 待たせるリクエストの最大数（超えると 429）
+            aging_rate (float): 待ち時間1秒あたりに差し引くコスト（大きいほど到着順に近づく）
+            retry_after (callable, optional): 拒否時の Retry-After 秒数を返す関数
+        """
+        self.max_active = max(1, int(max_active))
+        self.max_outstanding_tokens = max(1, int(max_outstanding_tokens))
+        self.max_waiting = max(0, int(max_waiting))
+        self.aging_rate = float(aging_rate)
+        self._retry_after = retry_after or (lambda: 1)
+        self._queues = {}        # client_id -> [_Job, ...]
+        self._virtual_time = {}  # client_id -> これまでに実行したコスト（公平キュー用）
+        self._seq = itertools.count()
+        self.active = 0
+        self.outstanding_tokens = 0
+        self.waiting = 0
+        self.stats = {"scheduled": 0, "rejected": 0, "expired": 0, "reordered": 0}
+
+    def priority(self, job, now=None):
+        """小さいほど先に実行する（予想コストから待ち時間分を差し引いた値）"""
+        now = time.monotonic() if now is None else now
+        return job.cost - self.aging_rate * (now - job.enqueued_at)
+
+    def _fits(self, job):
+        if self.active >= self.max_active:
+            return False
+        if self.active == 0:
+            return True
+        return self.outstanding_tokens + job.decode_tokens <= self.max_outstanding_tokens
+
+    def _next_job(self):
+        """次に実行するリクエストを選ぶ（待ち行列からは取り除かない）"""
+        clients = [client_id for client_id, jobs in self._queues.items() if jobs]
+        if not clients:
+            return None
+        client_id = min(clients, key=lambda c: self._virtual_time.get(c, 0.0))
+        now = time.monotonic()
+        return min(self._queues[client_id], key=lambda job: (self.priority(job, now), job.seq))
+
+    def _dispatch(self):
+        """実行枠が空いている間、優先度の高いリクエストから実行を許可する"""
+        while True:
+            job = self._next_job()
+            if job is None or not self._fits(job):
+                # 選ばれたリクエストが入らない場合は、後続を追い越させずに枠が空くのを待つ
+                return
+            queue = self._queues[job.client_id]
+            if any(other.seq < job.seq for other in queue):
+                self.stats["reordered"] += 1
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.client_id]
+            self.waiting -= 1
+            self._grant(job)
+            job.future.set_result(None)
+
+    def _grant(self, job):
+        self.active += 1
+        self.outstanding_tokens += job.decode_tokens
+        self._virtual_time[job.client_id] = self._virtual_time.get(job.client_id, 0.0) + job.cost
+        self.stats["scheduled"] += 1
+
+    def _release(self, job):
+        self.active -= 1
+        self.outstanding_tokens -= job.decode_tokens
+        if self.active == 0 and self.waiting == 0:
+            # 全て処理し終えたら公平キューの履歴は不要
+            self._virtual_time.clear()
+        self._dispatch()
+
+    def _activate_client(self, client_id):
+        """待ち行列が空だったクライアントの仮想時間を、現在待っているクライアントの最小値に揃える"""
+        others = [self._virtual_time.get(c, 0.0) for c, jobs in self._queues.items() if jobs and c != client_id]
+        floor = min(others) if others else max(self._virtual_time.values(), default=0.0)
+        # 長く休んでいたクライアントが貯めた分で他を締め出さないようにする
+        self._virtual_time[client_id] = max(self._virtual_time.get(client_id, 0.0), floor)
+
+    @asynccontextmanager
+    async def slot(self, client_id, prompt_tokens, max_new_tokens, deadline=None):
+        """
+        実行の順番が来るまで待ち、with ブロックの間だけ実行枠を確保する
+
+        Yields:
+            float: 待ち時間（秒）
+
+        Raises:
+            QueueFullError: 待ち行列が満杯の場合 (429)
+            DeadlineExceededError: 期限までに順番が来なかった場合
+        """
+        loop = asyncio.get_running_loop()
+        job = _Job(client_id, estimate_cost(prompt_tokens, max_new_tokens), max_new_tokens,
+                   next(self._seq), loop.create_future())
+
+        if self.waiting == 0 and self._fits(job):
+            self._grant(job)
+        else:
+            if self.waiting >= self.max_waiting:
+                self.stats["rejected"] += 1
+                raise QueueFullError("リクエストが混み合っています。", self._retry_after(), status_code=429)
+            if not self._queues.get(client_id):
+                self._activate_client(client_id)
+            self._queues.setdefault(client_id, []).append(job)
+            self.waiting += 1
+            self._dispatch()
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(asyncio.shield(job.future), timeout=timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if job.future.done():
+                    # 許可と同時にキャンセルされた場合は確保した枠を返す
+                    self._release(job)
+                else:
+                    self._queues[client_id].remove(job)
+                    if not self._queues[client_id]:
+                        del self._queues[client_id]
+                    self.waiting -= 1
+                    job.future.cancel()
+                    self._dispatch()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["expired"] += 1
+                    raise DeadlineExceededError("実行待ちの間に期限を過ぎました。")
+                raise
+
+        try:
+            yield time.monotonic() - job.enqueued_at
+        finally:
+            self._release(job)
+
+    def snapshot(self):
+        """待ち行列と実行中の状態を返す"""
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "outstanding_tokens": self.outstanding_tokens,
+            "waiting_by_client": {c: len(jobs) for c, jobs in self._queues.items()},
+            **self.stats,
+        }
@@ -0,0 +1,199 @@
+# sessions.py
+"""
+/chat の会話セッションごとの KV キャッシュ
+
+セッションごとに、直前のターンまでのトークン列とその past_key_values を保持し、
+次のターンではチャットテンプレートを適用したトークン列と一致する部分を再利用して、
+新しく追加されたターンだけをプレフィルします。
+保存量はバイト数の上限（最も古く使われたセッションから削除）と、一定時間使われないセッションの削除で管理します。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from prefix_cache import cache_nbytes, crop_cache
+
+
+def common_prefix_length(a, b):
+    """2つのトークン列の共通の先頭部分の長さ"""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def render_chat_prompt(tokenizer, messages):
+    """チャットテンプレートを適用したプロンプト文字列を返す（テンプレートが無い場合は簡易形式）"""
+    if getattr(tokenizer, "chat_template", None) and hasattr(tokenizer, "apply_chat_template"):
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    lines = [f"{m['role']}: {m['content']}" for m in messages]
+    return "\n".join(lines) + "\nassistant: "
+
+
+class SessionStore:
+    """セッション ID -> (トークン列, past_key_values) のバイト数上限付き LRU（アイドル時間で失効）"""
+
+    def __init__(self, max_bytes, idle_timeout=600.0):
+        """
+        Args:
+            max_bytes (int): 保存する KV キャッシュの合計バイト数の上限
+            idle_timeout (float): この秒数使われなかったセッションは削除する（0 以下で無期限）
+        """
+        self.max_bytes = int(max_bytes)
+        self.idle_timeout = float(idle_timeout)
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # session_id -> {"tokens", "value", "nbytes", "last_used"}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        if self.idle_timeout <= 0:
+            return
+        # 先頭ほど古く使われたエントリ
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if now - entry["last_used"] <= self.idle_timeout:
+                break
+            self._drop(session_id)
+            self.expirations += 1
+
+    def _drop(self, session_id):
+        entry = self._entries.pop(session_id)
+        self.total_bytes -= entry["nbytes"]
+        return entry
+
+    def take(self, session_id):
+        """
+        セッションのエントリを取り出す（生成中は他のリクエストと共有しないよう、ストアからは外す）
+
+        Returns:
+            tuple: (トークン列, 値)。無い・失効した場合は (None, None)
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            if session_id not in self._entries:
+                return None, None
+            entry = self._drop(session_id)
+            return entry["tokens"], entry["value"]
+
+    def put(self, session_id, token_ids, value, nbytes):
+        """セッションのエントリを保存する（上限を超える場合は古いセッションから削除）"""
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+            if nbytes > self.max_bytes:
+                return False
+            self._entries[session_id] = {
+                "tokens": list(token_ids),
+                "value": value,
+                "nbytes": nbytes,
+                "last_used": time.monotonic(),
+            }
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+                return True
+            return False
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "sessions": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SessionChatGenerator:
+    """セッションの KV キャッシュを再利用してチャットの応答を生成する"""
+
+    def __init__(self, pipe, store):
+        """
+        Args:
+            pipe: text-generation pipeline（PrefixCachedPipeline も可。.model と .tokenizer を使う）
+            store (SessionStore): セッションの KV キャッシュ
+        """
+        self.model = pipe.model
+        self.tokenizer = pipe.tokenizer
+        self.store = store
+        self.supported = True
+        self.stats = {"requests": 0, "hits": 0, "reused_tokens": 0, "prefilled_tokens": 0}
+
+    def __call__(self, session_id, token_ids, **params):
+        """
+        チャットテンプレート適用済みのトークン列の続きを生成する（ブロッキング）
+
+        params は generate にそのまま渡します（streamer / stopping_criteria も可）。
+
+        Returns:
+            tuple: (生成文, {"reused_tokens", "prefilled_tokens"})
+        """
+        import torch
+        from transformers import DynamicCache
+
+        self.stats["requests"] += 1
+        if not self.supported:
+            return self._generate_stateless(token_ids, **params)
+
+        cached_ids, past = self.store.take(session_id) if session_id else (None, None)
+        # 生成には少なくとも1トークンをキャッシュ外に残す必要がある
+        matched = min(common_prefix_length(cached_ids or [], token_ids), len(token_ids) - 1)
+        if past is not None and matched > 0:
+            crop_cache(past, matched)
+            self.stats["hits"] += 1
+        else:
+            matched = 0
+            past = DynamicCache()
+        self.stats["reused_tokens"] += matched
+        self.stats["prefilled_tokens"] += len(token_ids) - matched
+
+        input_ids = torch.tensor([token_ids], device=self.model.device)
+        try:
+            with torch.no_grad():
+                # past_key_values に含まれない部分（新しいターン）だけがプレフィルされる
+                output_ids = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    past_key_values=past,
+                    **params,
+                )
+        except Exception as e:
+            # モデルがキャッシュの受け渡しに対応していない場合は以降キャッシュを使わない
+            print(f"セッションの KV キャッシュを利用できないため無効化します: {e}")
+            self.supported = False
+            return self._generate_stateless(token_ids, **params)
+
+        if session_id:
+            # キャッシュには最後に生成したトークンの手前までが入っている
+            cached_len = past.get_seq_length()
+            self.store.put(session_id, output_ids[0][:cached_len].tolist(), past, cache_nbytes(past))
+
+        completion = self.tokenizer.decode(output_ids[0][len(token_ids):], skip_special_tokens=True)
+        return completion, {"reused_tokens": matched, "prefilled_tokens": len(token_ids) - matched}
+
+    def _generate_stateless(self, token_ids, **params):
+        """キャッシュを使わずにプロンプト全体をプレフィルして生成する"""
+        import torch
+
+        input_ids = torch.tensor([token_ids], device=self.model.device)
+        with torch.no_grad():
+            output_ids = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), **params)
+        completion = self.tokenizer.decode(output_ids[0][len(token_ids):], skip_special_tokens=True)
+        return completion, {"reused_tokens": 0, "prefilled_tokens": len(token_ids)}
@@ -0,0 +1,123 @@
+# speculative.py
+"""
+ドラフトモデルを使った投機的（assisted）デコーディング
+
+小さなドラフトモデルが数トークンを先読みで提案し、メインモデルが1回の forward でまとめて検証します。
+採用されたトークンの分だけメインモデルの forward 回数が減るため、デコードが速くなります。
+貪欲法（do_sample=False）では出力は通常の生成と同じになります。
+
+採用率は transformers から直接取得できないため、
+メインモデル・ドラフトモデルの forward 回数と生成トークン数から推定します。
+"""
+
+import threading
+
+
+class ForwardCounter:
+    """with ブロック内でモジュールの forward が呼ばれた回数を数える"""
+
+    def __init__(self, module):
+        self.module = module
+        self.count = 0
+        self._handle = None
+
+    def _hook(self, module, args):
+        self.count += 1
+
+    def __enter__(self):
+        self._handle = self.module.register_forward_pre_hook(self._hook)
+        return self
+
+    def __exit__(self, *exc):
+        self._handle.remove()
+
+
+def acceptance_stats(new_tokens, verify_steps, drafted_tokens):
+    """
+    生成トークン数と forward 回数から採用率を推定する
+
+    メインモデルは検証1回ごとに自前の1トークンを確定するため、
+    残り（new_tokens - verify_steps）がドラフトから採用されたトークン数になります。
+    """
+    accepted = max(0, new_tokens - verify_steps)
+    return {
+        "generated_tokens": new_tokens,
+        "verify_steps": verify_steps,
+        "drafted_tokens": drafted_tokens,
+        "accepted_tokens": accepted,
+        "acceptance_rate": accepted / drafted_tokens if drafted_tokens else 0.0,
+    }
+
+
+def load_draft_model(model_name, torch_dtype, device):
+    """
+    ドラフトモデルとそのトークナイザーを読み込む
+
+    Returns:
+        tuple: (model, tokenizer)
+    """
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    draft_model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch_dtype).to(device)
+    draft_model.eval()
+    draft_tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return draft_model, draft_tokenizer
+
+
+class AssistedGenerator:
+    """メインの pipeline とドラフトモデルで assisted generation を行う"""
+
+    def __init__(self, pipe, draft_model, draft_tokenizer=None, num_assistant_tokens=None):
+        """
+        Args:
+            pipe: メインモデルの text-generation pipeline（PrefixCachedPipeline も可）
+            draft_model: ドラフトモデル
+            draft_tokenizer: ドラフトモデルのトークナイザー。語彙がメインと異なる場合に使う
+            num_assistant_tokens (int, optional): 1回に提案させるトークン数
+        """
+        self.model = pipe.model
+        self.tokenizer = pipe.tokenizer
+        self.draft_model = draft_model
+        self.draft_tokenizer = None
+        if draft_tokenizer is not None and draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            # 語彙が異なる場合は universal assisted decoding を使う
+            self.draft_tokenizer = draft_tokenizer
+        if num_assistant_tokens:
+            self.draft_model.generation_config.num_assistant_tokens = num_assistant_tokens
+        # forward 回数を正しく数えるため、assisted generation は1件ずつ実行する
+        self._lock = threading.Lock()
+        self.totals = {"requests": 0, "drafted_tokens": 0, "accepted_tokens": 0}
+
+    def __call__(self, prompt, **params):
+        """
+        プロンプトを assisted generation で生成する
+
+        Returns:
+            tuple: (pipeline と同じ形式の出力, 採用率などの統計)
+        """
+        import torch
+
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        prompt_len = inputs["input_ids"].shape[1]
+        kwargs = dict(params)
+        kwargs["assistant_model"] = self.draft_model
+        if self.draft_tokenizer is not None:
+            kwargs["tokenizer"] = self.tokenizer
+            kwargs["assistant_tokenizer"] = self.draft_tokenizer
+
+        with self._lock, torch.no_grad():
+            with ForwardCounter(self.model) as main_calls, ForwardCounter(self.draft_model) as draft_calls:
+                output_ids = self.model.generate(**inputs, **kwargs)
+
+            stats = acceptance_stats(output_ids.shape[1] - prompt_len, main_calls.count, draft_calls.count)
+            self.totals["requests"] += 1
+            self.totals["drafted_tokens"] += stats["drafted_tokens"]
+            self.totals["accepted_tokens"] += stats["accepted_tokens"]
+
+        completion = self.tokenizer.decode(output_ids[0][prompt_len:], skip_special_tokens=True)
+        return [{"generated_text": prompt + completion}], stats
+
+    def acceptance_rate(self):
+        """起動からの累計の採用率"""
+        drafted = self.totals["drafted_tokens"]
+        return self.totals["accepted_tokens"] / drafted if drafted else 0.0
@@ -0,0 +1,93 @@
+# streaming.py
+"""
+トークンストリーミング（Server-Sent Events）用のヘルパー
+
+pipeline に TextIteratorStreamer を渡して別スレッドで生成し、
+生成されたテキスト片を SSE イベントとして順次送信します。
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+
+def format_sse(data, event=None):
+    """dict を SSE 形式の1イベント文字列に変換する"""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+def run_streaming_generation(pipe, prompt, streamer, params, errors):
+    """
+    ストリーマ付きで pipeline を実行する（ブロッキング）
+
+    生成中に例外が発生した場合でもストリーマを終了させ、
+    受信側のイテレーションが止まらないようにします。発生した例外は errors に追加されます。
+    """
+    try:
+        pipe(prompt, streamer=streamer, **params)
+    except Exception as e:
+        errors.append(e)
+        streamer.end()
+
+
+def start_generation_thread(pipe, prompt, streamer, params):
+    """
+    ストリーマ付きで pipeline をバックグラウンドスレッド実行する
+
+    Returns:
+        tuple: (thread, errors) errors には発生した例外が追加される
+    """
+    errors = []
+    thread = threading.Thread(
+        target=run_streaming_generation, args=(pipe, prompt, streamer, params, errors), daemon=True
+    )
+    thread.start()
+    return thread, errors
+
+
+async def iterate_in_thread(iterator):
+    """ブロッキングするイテレータをイベントループを止めずに非同期で反復する"""
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    sentinel = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, sentinel)
+        if item is sentinel:
+            break
+        yield item
+
+
+class StreamTimer:
+    """ストリーミング生成の応答時間・最初のトークンまでの時間・トークン毎秒を計測する"""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.first_token_time = None
+
+    def mark_token(self):
+        """トークン（テキスト片）を受信したことを記録する"""
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+
+    def summary(self, token_count):
+        """計測結果を dict で返す"""
+        end_time = time.time()
+        response_time = end_time - self.start_time
+        ttft = None
+        tokens_per_sec = 0.0
+        if self.first_token_time is not None:
+            ttft = self.first_token_time - self.start_time
+            decode_time = end_time - self.first_token_time
+            if decode_time > 0:
+                tokens_per_sec = token_count / decode_time
+        return {
+            "response_time": response_time,
+            "time_to_first_token": ttft,
+            "tokens_per_sec": tokens_per_sec,
+            "generated_tokens": token_count,
+        }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# テスト対象モジュール（03_FastAPI 直下）を import できるようにする
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,31 @@
+import pytest
+
+from async_client import backoff_delay, percentile, summarize_results
+
+
+def test_percentile_interpolation():
+    """パーセンタイルが線形補間で計算されることを確認"""
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 100) == 5.0
+    assert percentile(values, 95) == pytest.approx(4.8)
+    assert percentile([], 50) is None
+
+
+def test_backoff_respects_retry_after_and_maximum():
+    """Retry-After があればそれに従い、最大待ち時間を超えないことを確認"""
+    assert backoff_delay(0, retry_after="3") == 3.0
+    assert backoff_delay(0, maximum=2.0, retry_after="30") == 2.0
+    for attempt in range(10):
+        assert 0.0 <= backoff_delay(attempt, base=0.5, maximum=4.0) <= 4.0
+
+
+def test_summarize_results():
+    """成功・失敗の件数、エラー率、スループットが集計されることを確認"""
+    report = summarize_results([0.1, 0.2, 0.3], ["HTTP 429", "HTTP 429", "ReadTimeout"], elapsed=2.0)
+    assert report["requests"] == 6
+    assert report["error_rate"] == 0.5
+    assert report["throughput_rps"] == 1.5
+    assert report["latency_p50"] == pytest.approx(0.2)
+    assert report["errors"] == {"HTTP 429": 2, "ReadTimeout": 1}
@@ -0,0 +1,89 @@
+import json
+import time
+
+import pytest
+
+from backends import StubBackend, TransformersBackend, create_backend
+from stub_model import StubPipeline
+
+QUIZ_PROMPT = "一般知識に関する4択クイズを、JSON形式のリストで出力してください。\nジャンル「動物」の問題を3問作成してください。"
+
+
+def test_stub_backend_returns_valid_quiz_json():
+    """クイズ生成のプロンプトには、指定した問題数の形式の正しい JSON を返すことを確認"""
+    quiz = json.loads(StubBackend().generate(QUIZ_PROMPT, max_new_tokens=1024))
+
+    assert len(quiz) == 3
+    for q in quiz:
+        assert "動物" in q["question"]
+        assert len(q["options"]) == 4
+        assert q["answer"] in range(4)
+
+
+def test_stub_backend_returns_grading_json():
+    """採点のプロンプトには is_correct と correct_answer を含む JSON を返すことを確認"""
+    prompt = '問題: ...\nユーザーの解答: ...\nJSON形式で出力してください： {"is_correct": 0 or 1, "correct_answer": "..."}'
+    result = json.loads(StubBackend().generate(prompt, max_new_tokens=128))
+
+    assert result["is_correct"] in (0, 1)
+    assert isinstance(result["correct_answer"], str)
+
+
+def test_stub_backend_is_deterministic_and_excludes_prompt():
+    """生成文はプロンプトを含まず、同じプロンプトには常に同じ応答になることを確認"""
+    first = StubBackend().generate("こんにちは", max_new_tokens=8)
+    assert first == StubBackend().generate("こんにちは", max_new_tokens=8)
+    assert not first.startswith("こんにちは")
+    assert len(first) == 8
+
+
+def test_generate_batch_matches_single():
+    """バッチ生成でもプロンプトごとに単一生成と同じ生成文になることを確認"""
+    backend = StubBackend()
+    prompts = ["a", QUIZ_PROMPT]
+    assert backend.generate_batch(prompts, max_new_tokens=1024) == [
+        backend.generate(p, max_new_tokens=1024) for p in prompts
+    ]
+
+
+def test_stream_yields_the_generated_text():
+    """stream のテキスト片を連結すると generate と同じ生成文になることを確認"""
+    backend = StubBackend()
+    chunks = list(backend.stream(QUIZ_PROMPT, max_new_tokens=1024))
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == backend.generate(QUIZ_PROMPT, max_new_tokens=1024)
+
+
+def test_stream_raises_generation_error():
+    """生成中の例外は、ストリームの終了後に送出されることを確認"""
+    class FailingPipeline(StubPipeline):
+        def __call__(self, inputs, **kwargs):
+            raise RuntimeError("boom")
+
+    backend = StubBackend()
+    backend.pipe = FailingPipeline()
+    with pytest.raises(RuntimeError, match="boom"):
+        list(backend.stream("a", max_new_tokens=4))
+
+
+def test_stub_latency_is_configurable():
+    """token_delay に応じて生成に時間がかかることを確認"""
+    start = time.perf_counter()
+    StubBackend(token_delay=0.005).generate("a", max_new_tokens=10)
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_count_tokens():
+    """トークナイザーでトークン数を数えることを確認（スタブは1文字 = 1トークン）"""
+    assert StubBackend().count_tokens("あいう") == 3
+
+
+def test_create_backend():
+    """設定名から対応するバックエンドが作成されることを確認"""
+    assert isinstance(create_backend("stub"), StubBackend)
+    backend = create_backend("transformers", load_pipeline=StubPipeline)
+    assert isinstance(backend, TransformersBackend)
+    assert backend.generate("a", max_new_tokens=3) == StubPipeline().completion("a", 3)
+    with pytest.raises(ValueError):
+        create_backend("unknown")
@@ -0,0 +1,262 @@
+import asyncio
+import importlib.util
+import os
+import time
+
+import pytest
+
+from backends import StubBackend
+from batch_generation import BatchRequestError, generate_in_chunks, split_chunks, validate_prompts
+from cache import ResponseCache, make_cache_key
+from cancellation import DEADLINE, DISCONNECTED, CancellationToken, GenerationCancelled
+from prompt_guard import PromptGuard, PromptTooLongError
+from stub_model import StubTokenizer
+
+
+class ChunkRunner:
+    """スタブのバックエンドでチャンクを生成し、呼び出しを記録する run_chunk"""
+
+    def __init__(self):
+        self.backend = StubBackend()
+        self.calls = []
+
+    async def __call__(self, prompts, params, prompt_tokens):
+        self.calls.append((list(prompts), dict(params), list(prompt_tokens)))
+        return self.backend.generate_batch(prompts, **params)
+
+
+def run(prompts, params, runner, batch_size=2, cache=None, guard=None):
+    guard = guard or PromptGuard(StubTokenizer(), max_context=1000).check
+    return asyncio.run(generate_in_chunks(
+        prompts, params, guard=guard, run_chunk=runner, batch_size=batch_size, cache=cache,
+        cache_key=lambda prompt, p: make_cache_key("stub", prompt, p),
+    ))
+
+
+def greedy(max_new_tokens=8):
+    return {"max_new_tokens": max_new_tokens, "do_sample": False, "temperature": 0.7, "top_p": 0.9}
+
+
+def test_split_chunks():
+    """batch_size 件ずつに分け、最後のチャンクが余りになることを確認"""
+    assert split_chunks([0, 1, 2, 3, 4], 2) == [[0, 1], [2, 3], [4]]
+    assert split_chunks([0, 1], 5) == [[0, 1]]
+    assert split_chunks([0, 1], 0) == [[0], [1]]
+    assert split_chunks([], 3) == []
+
+
+@pytest.mark.parametrize("batch_size, expected", [(2, [2, 2, 1]), (5, [5]), (1, [1, 1, 1, 1, 1])])
+def test_chunks_by_batch_size(batch_size, expected):
+    """batch_size ごとにチャンクに分けて推論し、num_batches がチャンク数になることを確認"""
+    runner = ChunkRunner()
+    prompts = [f"質問{i}" for i in range(5)]
+
+    items, num_batches = run(prompts, greedy(), runner, batch_size=batch_size)
+
+    assert [len(call[0]) for call in runner.calls] == expected
+    assert num_batches == len(expected)
+    assert [item.text for item in items] == StubBackend().generate_batch(prompts, **greedy())
+    assert all(item.elapsed > 0 and not item.cached for item in items)
+
+
+def test_cached_prompts_are_skipped_and_order_is_kept():
+    """キャッシュ済みのプロンプトは推論せず、結果はプロンプトと同じ順で返ることを確認"""
+    cache = ResponseCache(max_size=16)
+    prompts = ["a", "b", "c", "d"]
+    run(["b", "d"], greedy(), ChunkRunner(), cache=cache)
+
+    runner = ChunkRunner()
+    items, num_batches = run(prompts, greedy(), runner, batch_size=4, cache=cache)
+
+    assert runner.calls[0][0] == ["a", "c"]
+    assert num_batches == 1
+    assert [item.cached for item in items] == [False, True, False, True]
+    assert [item.text for item in items] == StubBackend().generate_batch(prompts, **greedy())
+    assert items[1].elapsed == 0.0
+
+
+def test_sampling_requests_are_not_cached():
+    """do_sample=True のリクエストはキャッシュを使わないことを確認"""
+    cache = ResponseCache(max_size=16)
+    params = dict(greedy(), do_sample=True)
+    run(["a"], params, ChunkRunner(), cache=cache)
+
+    runner = ChunkRunner()
+    items, _ = run(["a"], params, runner, cache=cache)
+
+    assert len(runner.calls) == 1
+    assert not items[0].cached
+
+
+def test_result_generated_with_lowered_max_new_tokens_is_not_cached():
+    """チャンクの最小に合わせて max_new_tokens を下げて生成したプロンプトの結果はキャッシュしないことを確認"""
+    cache = ResponseCache(max_size=16)
+    # 長いプロンプトはコンテキストの残りが少ないため max_new_tokens が 4 に制限される
+    guard = PromptGuard(StubTokenizer(), max_context=24, min_new_tokens=1).check
+    runner = ChunkRunner()
+
+    run(["短い", "x" * 20], greedy(8), runner, cache=cache, guard=guard)
+
+    assert runner.calls[0][1]["max_new_tokens"] == 4
+    assert cache.get(make_cache_key("stub", "短い", greedy(8))) is None
+    assert cache.get(make_cache_key("stub", "x" * 20, greedy(8))) is not None
+
+
+def test_guard_error_is_raised_before_inference():
+    """長すぎるプロンプトが1件でもあれば、どのチャンクも推論せずに例外になることを確認"""
+    guard = PromptGuard(StubTokenizer(), max_context=16, min_new_tokens=1, strategy="reject").check
+    runner = ChunkRunner()
+
+    with pytest.raises(PromptTooLongError):
+        run(["短い", "x" * 100], greedy(), runner, guard=guard)
+
+    assert runner.calls == []
+
+
+def test_truncated_flag_and_prompt_tokens():
+    """切り詰めたプロンプトは truncated になり、チャンクには切り詰め後のトークン数を渡すことを確認"""
+    guard = PromptGuard(StubTokenizer(), max_context=30, max_prompt_tokens=10, strategy="tail").check
+    runner = ChunkRunner()
+
+    items, _ = run(["短い", "x" * 40], greedy(), runner, guard=guard)
+
+    assert [item.truncated for item in items] == [False, True]
+    assert runner.calls[0][2] == [2, 10]
+    assert [item.prompt_tokens for item in items] == [2, 10]
+
+
+def test_cached_prompt_keeps_truncated_flag():
+    """切り詰めて生成したプロンプトは、キャッシュから返す場合も truncated になることを確認"""
+    cache = ResponseCache(max_size=16)
+    guard = PromptGuard(StubTokenizer(), max_context=30, max_prompt_tokens=10, strategy="tail").check
+    run(["短い", "x" * 40], greedy(), ChunkRunner(), cache=cache, guard=guard)
+
+    runner = ChunkRunner()
+    items, _ = run(["短い", "x" * 40], greedy(), runner, cache=cache, guard=guard)
+
+    assert runner.calls == []
+    assert [item.cached for item in items] == [True, True]
+    assert [item.truncated for item in items] == [False, True]
+
+
+@pytest.mark.parametrize("prompts, status_code", [([], 400), (["a"] * 4, 413)])
+def test_validate_prompts(prompts, status_code):
+    """空のリストは 400、件数の上限を超える場合は 413 になることを確認"""
+    with pytest.raises(BatchRequestError) as excinfo:
+        validate_prompts(prompts, max_prompts=3)
+    assert excinfo.value.status_code == status_code
+
+
+def test_validate_prompts_accepts_up_to_the_limit():
+    """上限ちょうどの件数は受け付けることを確認"""
+    validate_prompts(["a"] * 3, max_prompts=3)
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {"results": [], "response_time": 0.1, "num_batches": 1, "prompts_per_sec": 10.0}
+
+
+class FakeSession:
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, json=None):
+        self.posts.append((url, json))
+        return FakeResponse()
+
+
+def load_client_module():
+    pytest.importorskip("requests")
+    path = os.path.join(os.path.dirname(__file__), "..", "python-client.py")
+    spec = importlib.util.spec_from_file_location("python_client", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_client_generate_batch_payload():
+    """LLMClient.generate_batch が /generate/batch にプロンプトと batch_size を送ることを確認"""
+    client = load_client_module().LLMClient("http://example.com/")
+    client.session = FakeSession()
+
+    result = client.generate_batch(["a", "b"], max_new_tokens=8, do_sample=False, batch_size=2)
+
+    url, payload = client.session.posts[0]
+    assert url == "http://example.com/generate/batch"
+    assert payload["prompts"] == ["a", "b"]
+    assert payload["batch_size"] == 2
+    assert payload["max_new_tokens"] == 8 and payload["do_sample"] is False
+    assert result["num_batches"] == 1 and "total_request_time" in result
+
+
+def test_client_generate_batch_omits_default_batch_size():
+    """batch_size を指定しない場合は送らない（サーバーの既定値を使う）ことを確認"""
+    client = load_client_module().LLMClient("http://example.com")
+    client.session = FakeSession()
+
+    client.generate_batch(["a"])
+
+    assert "batch_size" not in client.session.posts[0][1]
+
+
+class CancellingRunner(ChunkRunner):
+    """cancel_after 個目のチャンクの生成中にキャンセルする run_chunk"""
+
+    def __init__(self, token, cancel_after):
+        super().__init__()
+        self.token = token
+        self.cancel_after = cancel_after
+
+    async def __call__(self, prompts, params, prompt_tokens):
+        texts = await super().__call__(prompts, params, prompt_tokens)
+        if len(self.calls) == self.cancel_after:
+            self.token.cancel(DISCONNECTED)
+        return texts
+
+
+def run_cancellable(prompts, runner, token, cache=None):
+    skipped = []
+    with pytest.raises(GenerationCancelled) as excinfo:
+        asyncio.run(generate_in_chunks(
+            prompts, greedy(), guard=PromptGuard(StubTokenizer(), max_context=1000).check, run_chunk=runner,
+            batch_size=2, cache=cache, cache_key=lambda prompt, p: make_cache_key("stub", prompt, p),
+            cancel_token=token, on_skipped=skipped.append,
+        ))
+    return excinfo.value, skipped
+
+
+def test_cancellation_stops_remaining_chunks():
+    """チャンクの生成中にキャンセルされると、残りのチャンクは推論せず、その max_new_tokens を on_skipped に渡すことを確認"""
+    token = CancellationToken()
+    runner = CancellingRunner(token, cancel_after=1)
+
+    error, skipped = run_cancellable([f"質問{i}" for i in range(5)], runner, token)
+
+    assert error.reason == DISCONNECTED
+    assert len(runner.calls) == 1
+    assert skipped == [8 * 3]
+
+
+def test_cancelled_chunk_is_not_cached():
+    """キャンセルされたチャンクの（途中までの）生成文はキャッシュしないことを確認"""
+    token = CancellationToken()
+    cache = ResponseCache(max_size=16)
+
+    run_cancellable(["a", "b"], CancellingRunner(token, cancel_after=1), token, cache=cache)
+
+    assert cache.get(make_cache_key("stub", "a", greedy())) is None
+
+
+def test_expired_deadline_skips_every_chunk():
+    """期限を過ぎていれば1つもチャンクを推論しないことを確認"""
+    token = CancellationToken(deadline=time.monotonic() - 1)
+    runner = ChunkRunner()
+
+    error, skipped = run_cancellable(["a", "b", "c"], runner, token)
+
+    assert error.reason == DEADLINE
+    assert runner.calls == []
+    assert skipped == [8 * 3]
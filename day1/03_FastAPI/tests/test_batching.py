@@ -0,0 +1,107 @@
+import asyncio
+
+from batching import MicroBatcher, batch_key, run_pipeline_batch
+
+
+class StubPipeline:
+    """貪欲法の生成を模した決定的なスタブ pipeline"""
+
+    def __init__(self):
+        self.calls = []
+
+    def _generate(self, prompt, max_new_tokens):
+        # プロンプトのみから決まる決定的な「生成」結果
+        continuation = "".join(reversed(prompt))[:max_new_tokens]
+        return [{"generated_text": prompt + continuation}]
+
+    def __call__(self, inputs, max_new_tokens=16, batch_size=1, **kwargs):
+        self.calls.append(inputs)
+        if isinstance(inputs, list):
+            return [self._generate(p, max_new_tokens) for p in inputs]
+        return self._generate(inputs, max_new_tokens)
+
+
+PROMPTS = ["AIとは", "東京の天気", "hello world", "機械学習の基礎を説明して"]
+GREEDY = {"max_new_tokens": 8, "do_sample": False, "temperature": 0.7, "top_p": 0.9}
+
+
+def test_batched_matches_unbatched_for_greedy():
+    """貪欲法ではバッチ処理の有無で出力が一致することを確認"""
+    pipe = StubPipeline()
+    unbatched = [pipe(p, **GREEDY) for p in PROMPTS]
+
+    batch_pipe = StubPipeline()
+    batcher = MicroBatcher(
+        lambda prompts, params: run_pipeline_batch(batch_pipe, prompts, params),
+        max_batch_size=8,
+        max_wait_ms=50,
+    )
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(p, GREEDY) for p in PROMPTS))
+
+    batched = asyncio.run(run())
+
+    assert batched == unbatched
+    assert len(batch_pipe.calls) == 1, "同時リクエストが1回のバッチにまとめられていません"
+    assert batcher.stats["max_batch_size_seen"] == len(PROMPTS)
+
+
+def test_max_batch_size_splits_batches():
+    """max_batch_size を超えるリクエストは複数バッチに分割されることを確認"""
+    pipe = StubPipeline()
+    batcher = MicroBatcher(
+        lambda prompts, params: run_pipeline_batch(pipe, prompts, params),
+        max_batch_size=3,
+        max_wait_ms=50,
+    )
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(p, GREEDY) for p in PROMPTS))
+
+    results = asyncio.run(run())
+
+    assert len(results) == len(PROMPTS)
+    # 1件だけのバッチは単一プロンプトとして呼び出される
+    assert sorted(len(call) if isinstance(call, list) else 1 for call in pipe.calls) == [1, 3]
+
+
+def test_incompatible_params_are_not_batched_together():
+    """生成パラメータが異なるリクエストは別バッチになることを確認"""
+    sampling = {"max_new_tokens": 8, "do_sample": True, "temperature": 0.7, "top_p": 0.9}
+    assert batch_key(GREEDY) != batch_key(sampling)
+    # 貪欲法では temperature / top_p の違いは無視される
+    assert batch_key(GREEDY) == batch_key(dict(GREEDY, temperature=0.1))
+
+    pipe = StubPipeline()
+    batcher = MicroBatcher(
+        lambda prompts, params: run_pipeline_batch(pipe, prompts, params),
+        max_batch_size=8,
+        max_wait_ms=20,
+    )
+
+    async def run():
+        return await asyncio.gather(
+            batcher.submit(PROMPTS[0], GREEDY),
+            batcher.submit(PROMPTS[1], sampling),
+        )
+
+    asyncio.run(run())
+    assert len(pipe.calls) == 2
+
+
+def test_batch_error_propagates_to_all_waiters():
+    """バッチ推論の例外が全リクエストに伝播することを確認"""
+
+    def failing_batch(prompts, params):
+        raise RuntimeError("推論失敗")
+
+    batcher = MicroBatcher(failing_batch, max_batch_size=8, max_wait_ms=10)
+
+    async def run():
+        return await asyncio.gather(
+            *(batcher.submit(p, GREEDY) for p in PROMPTS[:2]), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
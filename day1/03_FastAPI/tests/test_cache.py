@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from cache import (
+    ResponseCache, SingleFlight, cached_response, is_cacheable, make_cache_key, unpack_cached_response,
+)
+
+GREEDY = {"max_new_tokens": 64, "do_sample": False, "temperature": 0.7, "top_p": 0.9}
+
+
+def test_only_deterministic_requests_are_cacheable():
+    """do_sample=False のリクエストのみキャッシュ対象であることを確認"""
+    assert is_cacheable(GREEDY)
+    assert not is_cacheable(dict(GREEDY, do_sample=True))
+
+
+def test_cache_key_depends_on_all_fields():
+    """モデル名・プロンプト・パラメータのいずれかが違えば別のキーになることを確認"""
+    key = make_cache_key("model-a", "こんにちは", GREEDY)
+    assert key == make_cache_key("model-a", "こんにちは", dict(GREEDY))
+    assert key != make_cache_key("model-b", "こんにちは", GREEDY)
+    assert key != make_cache_key("model-a", "こんばんは", GREEDY)
+    assert key != make_cache_key("model-a", "こんにちは", dict(GREEDY, max_new_tokens=32))
+
+
+def test_greedy_cache_key_ignores_sampling_parameters():
+    """do_sample=False では temperature / top_p が違っても同じキーになり、do_sample=True では別のキーになることを確認"""
+    key = make_cache_key("model-a", "こんにちは", GREEDY)
+    assert key == make_cache_key("model-a", "こんにちは", dict(GREEDY, temperature=0.2, top_p=1.0))
+    assert key == make_cache_key("model-a", "こんにちは", {"max_new_tokens": 64, "do_sample": False})
+
+    sampling = dict(GREEDY, do_sample=True)
+    assert make_cache_key("model-a", "こんにちは", sampling) != make_cache_key(
+        "model-a", "こんにちは", dict(sampling, temperature=0.2)
+    )
+
+
+def test_cached_response_keeps_truncated_flag(tmp_path):
+    """キャッシュの値に切り詰めたかどうかを保存し、SQLite から読み直しても失われないことを確認"""
+    db_path = str(tmp_path / "cache.db")
+    ResponseCache(max_size=10, ttl=3600, db_path=db_path).set("a", cached_response("応答", truncated=True))
+
+    restarted = ResponseCache(max_size=10, ttl=3600, db_path=db_path)
+    assert unpack_cached_response(restarted.get("a")) == ("応答", True)
+
+
+def test_unpack_legacy_text_entry():
+    """生成文だけを保存していた以前のエントリは切り詰めなしとして読めることを確認"""
+    assert unpack_cached_response("以前の応答") == ("以前の応答", False)
+
+
+def test_lru_eviction_and_counters():
+    """件数上限を超えると最も古く使われたエントリが削除されることを確認"""
+    cache = ResponseCache(max_size=2, ttl=0)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"  # a を最近使ったことにする
+    cache.set("c", "C")           # b が追い出される
+    assert cache.get("b") is None
+    assert cache.get("c") == "C"
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+
+
+def test_ttl_expiry():
+    """TTL を過ぎたエントリは返されないことを確認"""
+    cache = ResponseCache(max_size=10, ttl=0.05)
+    cache.set("a", "A")
+    assert cache.get("a") == "A"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_sqlite_persistence(tmp_path):
+    """SQLite に保存したエントリが別インスタンスから読めることを確認"""
+    db_path = str(tmp_path / "cache.db")
+    ResponseCache(max_size=10, ttl=3600, db_path=db_path).set("a", "永続化された応答")
+
+    restarted = ResponseCache(max_size=10, ttl=3600, db_path=db_path)
+    assert restarted.get("a") == "永続化された応答"
+    assert restarted.stats()["hits"] == 1
+
+
+def test_single_flight_shares_one_execution():
+    """同時に届いた同じキーの処理が1回だけ実行され、全員が同じ結果を受け取ることを確認"""
+    flight = SingleFlight()
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "結果"
+
+    async def run():
+        return await asyncio.gather(*(flight.run("key", generate) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["結果"] * 5
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert flight.stats() == {"inflight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_single_flight_propagates_errors_and_allows_retry():
+    """実行中の処理のエラーが待っている側にも伝わり、完了後は再実行できることを確認"""
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("失敗")
+
+    async def run():
+        results = await asyncio.gather(
+            flight.run("key", failing), flight.run("key", failing), return_exceptions=True
+        )
+        retried = await flight.run("key", lambda: asyncio.sleep(0, result="成功"))
+        return results, retried
+
+    results, retried = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == ("成功", False)
+
+
+def test_single_flight_follower_retries_when_leader_cancelled():
+    """実行していたリクエストがキャンセルされた場合、待っていた側が自分で実行し直すことを確認"""
+    flight = SingleFlight()
+
+    async def generate():
+        await asyncio.sleep(0.05)
+        return "結果"
+
+    async def run():
+        leader = asyncio.ensure_future(flight.run("key", generate))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.run("key", generate))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == ("結果", False)
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from batching import MicroBatcher
+from cache import SingleFlight
+from cancellation import (
+    CancellationCriteria, CancellationToken, GenerationCancelled, DEADLINE, DISCONNECTED,
+)
+from stub_model import StubPipeline
+
+
+def test_token_expires_at_deadline():
+    """期限を過ぎると deadline を理由にキャンセル扱いになることを確認"""
+    token = CancellationToken(deadline=time.monotonic() + 0.01)
+    assert not token.cancelled
+    time.sleep(0.02)
+    assert token.cancelled
+    assert token.reason == DEADLINE
+    with pytest.raises(GenerationCancelled):
+        token.raise_if_cancelled()
+
+
+def test_first_reason_is_kept():
+    """最初にキャンセルされた理由が保持されることを確認"""
+    token = CancellationToken()
+    token.cancel(DISCONNECTED)
+    token.cancel(DEADLINE)
+    assert token.reason == DISCONNECTED
+
+
+def test_stub_stops_only_cancelled_rows():
+    """バッチ内でキャンセルされた行だけが途中で生成を止めることを確認"""
+    cancelled, alive = CancellationToken(), CancellationToken()
+    criteria = CancellationCriteria([cancelled, alive, None])
+    pipe = StubPipeline()
+    cancelled.cancel(DISCONNECTED)
+    outputs = pipe(["a", "b", "c"], max_new_tokens=8, stopping_criteria=[criteria], return_full_text=False)
+    lengths = [len(output[0]["generated_text"]) for output in outputs]
+    assert lengths == [1, 8, 8]
+
+
+def test_batcher_skips_and_rejects_cancelled_requests():
+    """待機中にキャンセルされたリクエストは推論せず、推論中のキャンセルは結果を返さないことを確認"""
+    seen = []
+
+    def run_batch(prompts, params, cancel_tokens):
+        seen.append(list(prompts))
+        # 推論中に2件目がキャンセルされる
+        cancel_tokens[1].cancel(DEADLINE)
+        return [[{"generated_text": p}] for p in prompts]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=8, max_wait_ms=10, cancellable=True)
+    before = CancellationToken()
+    before.cancel(DISCONNECTED)
+    params = {"max_new_tokens": 4, "do_sample": False}
+
+    async def run():
+        return await asyncio.gather(
+            batcher.submit("skipped", params, before),
+            batcher.submit("ok", params, CancellationToken()),
+            batcher.submit("stopped", params, CancellationToken()),
+            return_exceptions=True,
+        )
+
+    skipped, ok, stopped = asyncio.run(run())
+    assert seen == [["ok", "stopped"]]
+    assert isinstance(skipped, GenerationCancelled) and skipped.reason == DISCONNECTED
+    assert ok == [{"generated_text": "ok"}]
+    assert isinstance(stopped, GenerationCancelled) and stopped.reason == DEADLINE
+
+
+def test_single_flight_follower_regenerates_after_leader_cancelled():
+    """共有元の生成がキャンセルされた場合、待っていた側が自分で生成し直すことを確認"""
+    flight = SingleFlight()
+
+    async def cancelled_generation():
+        await asyncio.sleep(0.01)
+        raise GenerationCancelled(DISCONNECTED)
+
+    async def generation():
+        return "結果"
+
+    async def run():
+        leader = asyncio.ensure_future(flight.run("key", cancelled_generation, retry_on=(GenerationCancelled,)))
+        await asyncio.sleep(0)
+        follower = await flight.run("key", generation, retry_on=(GenerationCancelled,))
+        with pytest.raises(GenerationCancelled):
+            await leader
+        return follower
+
+    assert asyncio.run(run()) == ("結果", False)
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from concurrency import InferenceExecutor, QueueFullError, DeadlineExceededError
+
+
+def test_run_does_not_block_event_loop():
+    """推論実行中もイベントループ上の他の処理が進むことを確認"""
+    executor = InferenceExecutor(max_concurrency=1, max_queue_size=4)
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(executor.run(time.sleep, 0.1), ticker())
+
+    asyncio.run(run())
+    assert len(ticks) == 5
+
+
+def test_concurrency_limit():
+    """同時実行数が max_concurrency を超えないことを確認"""
+    executor = InferenceExecutor(max_concurrency=2, max_queue_size=8)
+    lock = threading.Lock()
+    state = {"current": 0, "peak": 0}
+
+    def work():
+        with lock:
+            state["current"] += 1
+            state["peak"] = max(state["peak"], state["current"])
+        time.sleep(0.05)
+        with lock:
+            state["current"] -= 1
+
+    async def run():
+        await asyncio.gather(*(executor.run(work) for _ in range(6)))
+
+    asyncio.run(run())
+    assert state["peak"] == 2
+
+
+def test_queue_full_rejected_with_retry_after():
+    """待ち行列が満杯のとき 429 と Retry-After で拒否されることを確認"""
+    executor = InferenceExecutor(max_concurrency=1, max_queue_size=1)
+
+    async def run():
+        tasks = [asyncio.ensure_future(executor.run(time.sleep, 0.1)) for _ in range(2)]
+        await asyncio.sleep(0.02)
+        with pytest.raises(QueueFullError) as excinfo:
+            executor.check_admission()
+        await asyncio.gather(*tasks)
+        return excinfo.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+
+
+def test_deadline_exceeded_while_queued():
+    """実行待ちの間に期限を過ぎると DeadlineExceededError になることを確認"""
+    executor = InferenceExecutor(max_concurrency=1, max_queue_size=4)
+
+    async def run():
+        first = asyncio.ensure_future(executor.run(time.sleep, 0.2))
+        await asyncio.sleep(0.01)
+        with pytest.raises(DeadlineExceededError):
+            await executor.run(time.sleep, 0.01, deadline=time.monotonic() + 0.05, check=False)
+        await first
+
+    asyncio.run(run())
+    assert executor.queue_depth == 0
+    assert executor.running == 0
@@ -0,0 +1,33 @@
+import time
+
+from lifecycle import ModelLifecycle, LOADING, WARMING, READY, FAILED
+
+
+def test_state_transitions_record_durations():
+    """loading → warming → ready の遷移で各所要時間が記録されることを確認"""
+    lifecycle = ModelLifecycle()
+    assert lifecycle.state == LOADING
+    assert not lifecycle.ready
+    assert lifecycle.time_to_ready is None
+
+    time.sleep(0.01)
+    lifecycle.set_state(WARMING)
+    time.sleep(0.01)
+    lifecycle.set_state(READY)
+
+    assert lifecycle.ready
+    assert lifecycle.load_seconds >= 0.01
+    assert lifecycle.warmup_seconds >= 0.01
+    assert lifecycle.time_to_ready >= lifecycle.load_seconds + lifecycle.warmup_seconds
+
+
+def test_failed_state_keeps_error_and_longer_retry_after():
+    """失敗時にエラー内容が保持され、Retry-After が長くなることを確認"""
+    lifecycle = ModelLifecycle()
+    loading_retry = lifecycle.retry_after()
+    lifecycle.set_state(FAILED, error="読み込み失敗")
+
+    info = lifecycle.as_dict()
+    assert info["state"] == FAILED
+    assert info["error"] == "読み込み失敗"
+    assert lifecycle.retry_after() > loading_retry
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from metrics import LAG_BUCKETS, MetricsRegistry, monitor_event_loop_lag
+
+
+def test_counter_with_labels():
+    """ラベル付きカウンタが Prometheus 形式で出力されることを確認"""
+    registry = MetricsRegistry()
+    requests = registry.counter("llm_requests_total", "リクエスト数", ("endpoint", "status"))
+    requests.inc(endpoint="/generate", status="200")
+    requests.inc(endpoint="/generate", status="200")
+    requests.inc(endpoint="/generate", status="429")
+
+    text = registry.render()
+    assert "# TYPE llm_requests_total counter" in text
+    assert 'llm_requests_total{endpoint="/generate",status="200"} 2' in text
+    assert 'llm_requests_total{endpoint="/generate",status="429"} 1' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    """ヒストグラムのバケットが累積値で出力されることを確認"""
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "応答時間", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "latency_seconds_count 4" in text
+    assert "latency_seconds_sum 3.65" in text
+
+
+def test_gauge_callback_and_inc_dec():
+    """ゲージの増減とコールバックによる値の取得を確認"""
+    registry = MetricsRegistry()
+    in_flight = registry.gauge("in_flight", "処理中")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    depth = {"value": 7}
+    registry.gauge("queue_depth", "待ち行列", callback=lambda: depth["value"])
+
+    text = registry.render()
+    assert "in_flight 1" in text
+    assert "queue_depth 7" in text
+
+
+def test_event_loop_lag_detects_blocking():
+    """イベントループをブロックするとその時間が遅延として記録されることを確認"""
+    registry = MetricsRegistry()
+    lag = registry.histogram("lag_seconds", "遅延", buckets=LAG_BUCKETS)
+
+    async def run():
+        task = asyncio.create_task(monitor_event_loop_lag(lag, interval=0.01))
+        await asyncio.sleep(0.03)
+        time.sleep(0.1)  # イベントループ上でブロッキングする処理
+        await asyncio.sleep(0.03)
+        task.cancel()
+
+    asyncio.run(run())
+    assert lag.get_count() >= 2
+    assert lag._values[()][1] >= 0.05
@@ -0,0 +1,37 @@
+import pytest
+
+from precision import BF16, FP32, INT8, dtype_name, parse_cpu_flags, resolve_precision
+
+CPUINFO = """processor\t: 0
+vendor_id\t: GenuineIntel
+flags\t\t: fpu sse2 avx2 avx512f avx512_bf16
+"""
+
+
+def test_parse_cpu_flags():
+    """/proc/cpuinfo の flags 行からフラグを取り出せることを確認"""
+    flags = parse_cpu_flags(CPUINFO)
+    assert "avx512_bf16" in flags
+    assert "GenuineIntel" not in flags
+
+
+def test_auto_picks_bf16_only_when_cpu_supports_it():
+    """auto は CPU が bf16 命令を持つ場合だけ bf16 を選ぶことを確認"""
+    assert resolve_precision("auto", "cpu", parse_cpu_flags(CPUINFO)) == BF16
+    assert resolve_precision("auto", "cpu", {"avx2"}) == FP32
+    assert resolve_precision("auto", "cuda", set()) == BF16
+
+
+def test_explicit_precision_and_aliases():
+    """明示した精度と別名がそのまま使われ、int8 は fp32 で読み込むことを確認"""
+    assert resolve_precision("int8", "cpu", set()) == INT8
+    assert resolve_precision("bfloat16", "cpu", set()) == BF16
+    assert dtype_name(INT8) == "float32"
+    # int8 の動的量子化は CPU 専用
+    assert resolve_precision("int8", "cuda", set()) == BF16
+
+
+def test_unknown_precision_raises():
+    """不明な精度を指定するとエラーになることを確認"""
+    with pytest.raises(ValueError):
+        resolve_precision("fp8", "cpu", set())
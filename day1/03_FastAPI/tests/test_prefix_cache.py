@@ -0,0 +1,85 @@
+from prefix_cache import PrefixTrie, crop_cache
+
+
+class FakeCache:
+    """get_seq_length と crop だけを持つ KV キャッシュ（crop に渡された値を記録する）"""
+
+    def __init__(self, length):
+        self.length = length
+        self.crops = []
+
+    def get_seq_length(self):
+        return self.length
+
+    def crop(self, max_length):
+        self.crops.append(max_length)
+        self.length = max_length if max_length >= 0 else self.length + max_length
+
+
+def test_longest_prefix_match():
+    """保存済みのトークン列と最長一致する長さと値が返ることを確認"""
+    trie = PrefixTrie(max_bytes=1000)
+    trie.insert([1, 2, 3, 4, 5], "kv-a", nbytes=10)
+
+    assert trie.longest_prefix([1, 2, 3, 9]) == (3, "kv-a")
+    assert trie.longest_prefix([1, 2, 3, 4, 5, 6]) == (5, "kv-a")
+    assert trie.longest_prefix([7, 8]) == (0, None)
+
+
+def test_prefers_recently_used_entry():
+    """同じ前置部を持つエントリが複数ある場合は最近使われたものを返すことを確認"""
+    trie = PrefixTrie(max_bytes=1000)
+    trie.insert([1, 2, 3, 4], "kv-a", nbytes=10)
+    trie.insert([1, 2, 3, 5], "kv-b", nbytes=10)
+
+    assert trie.longest_prefix([1, 2, 3, 4]) == (4, "kv-a")
+    assert trie.longest_prefix([1, 2, 3, 6]) == (3, "kv-a")
+
+
+def test_memory_bounded_eviction():
+    """バイト数の上限を超えると最も古く使われたエントリが削除されることを確認"""
+    trie = PrefixTrie(max_bytes=25)
+    trie.insert([1, 2, 3], "kv-a", nbytes=10)
+    trie.insert([4, 5, 6], "kv-b", nbytes=10)
+    trie.longest_prefix([1, 2, 3])          # kv-a を最近使ったことにする
+    trie.insert([7, 8, 9], "kv-c", nbytes=10)  # kv-b が追い出される
+
+    assert len(trie) == 2
+    assert trie.total_bytes == 20
+    assert trie.evictions == 1
+    assert trie.longest_prefix([4, 5, 6]) == (0, None)
+    assert trie.longest_prefix([1, 2, 3]) == (3, "kv-a")
+
+
+def test_eviction_keeps_shared_branch():
+    """共有している枝は、他のエントリが残っている限り削除されないことを確認"""
+    trie = PrefixTrie(max_bytes=15)
+    trie.insert([1, 2, 3], "kv-a", nbytes=10)
+    trie.insert([1, 2, 4], "kv-b", nbytes=10)  # kv-a が追い出される
+
+    assert trie.longest_prefix([1, 2, 3]) == (2, "kv-b")
+
+
+def test_oversized_value_is_not_stored():
+    """上限より大きい値は保存されないことを確認"""
+    trie = PrefixTrie(max_bytes=5)
+    assert trie.insert([1, 2], "kv", nbytes=10) is False
+    assert len(trie) == 0
+
+
+def test_crop_cache_uses_negative_offset():
+    """crop_cache が末尾から取り除くトークン数を負の値で crop に渡すことを確認"""
+    past = FakeCache(10)
+    crop_cache(past, 7)
+
+    assert past.crops == [-3]
+    assert past.get_seq_length() == 7
+
+
+def test_crop_cache_keeps_shorter_cache():
+    """切り詰める必要がない場合は crop を呼ばないことを確認"""
+    past = FakeCache(5)
+    crop_cache(past, 5)
+    crop_cache(past, 8)
+
+    assert past.crops == []
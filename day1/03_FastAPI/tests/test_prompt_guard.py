@@ -0,0 +1,109 @@
+import pytest
+
+from prompt_guard import PromptGuard, PromptTooLongError, TokenCache, model_context_length, truncate_ids
+from stub_model import StubPipeline, StubTokenizer
+
+
+class BosTokenizer(StubTokenizer):
+    """先頭に BOS（id 1）を付けるトークナイザー"""
+
+    def encode(self, text, add_special_tokens=True):
+        ids = super().encode(text)
+        return [1] + ids if add_special_tokens else ids
+
+    def decode(self, ids, skip_special_tokens=False):
+        return super().decode([i for i in ids if not (skip_special_tokens and i == 1)])
+
+
+class CountingTokenizer(StubTokenizer):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def encode(self, text, add_special_tokens=True):
+        self.calls += 1
+        return super().encode(text, add_special_tokens)
+
+
+def test_token_cache_tokenizes_each_prompt_once():
+    """同じプロンプトは2回目以降トークン化されず、キャッシュの結果が返ることを確認"""
+    tokenizer = CountingTokenizer()
+    cache = TokenCache(tokenizer, max_size=2)
+
+    assert cache.encode("あいう") == cache.encode("あいう") == [ord(c) for c in "あいう"]
+    assert tokenizer.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_token_cache_evicts_least_recently_used():
+    """保持数を超えると最も古く使われたプロンプトから削除されることを確認"""
+    tokenizer = CountingTokenizer()
+    cache = TokenCache(tokenizer, max_size=2)
+    cache.encode("a")
+    cache.encode("b")
+    cache.encode("a")  # a を最近使ったことにする
+    cache.encode("c")  # b が追い出される
+
+    calls = tokenizer.calls
+    cache.encode("a")
+    assert tokenizer.calls == calls
+    cache.encode("b")
+    assert tokenizer.calls == calls + 1
+
+
+@pytest.mark.parametrize("strategy, expected", [
+    ("head", [5, 6, 7, 8]),
+    ("tail", [1, 2, 3, 4]),
+    ("middle", [1, 2, 7, 8]),
+])
+def test_truncate_ids(strategy, expected):
+    """切り詰め方ごとに残る部分を確認"""
+    assert truncate_ids([1, 2, 3, 4, 5, 6, 7, 8], 4, strategy) == expected
+
+
+def test_rejects_prompt_over_budget():
+    """strategy=reject では上限を超えるプロンプトで PromptTooLongError が送出されることを確認"""
+    guard = PromptGuard(StubTokenizer(), max_context=20, min_new_tokens=10)
+
+    with pytest.raises(PromptTooLongError) as e:
+        guard.check("あ" * 11, max_new_tokens=5)
+    assert (e.value.prompt_tokens, e.value.max_prompt_tokens) == (11, 10)
+    assert guard.stats["rejected"] == 1
+
+
+def test_truncates_prompt_and_keeps_special_tokens():
+    """切り詰めた後も BOS を含めて上限に収まり、切り詰めたプロンプトのトークン列がキャッシュされることを確認"""
+    guard = PromptGuard(BosTokenizer(), max_context=20, min_new_tokens=10, strategy="middle")
+
+    guarded = guard.check("あいうえおかきくけこさしす", max_new_tokens=5)
+
+    assert guarded.truncated
+    assert guarded.prompt == "あいうえお" + "こさしす"
+    assert guarded.prompt_tokens == 10
+    assert guarded.token_ids[0] == 1
+    assert guard.encode(guarded.prompt) == guarded.token_ids
+    assert guarded.original_tokens == 14
+
+
+def test_clamps_max_new_tokens_to_remaining_context():
+    """max_new_tokens がコンテキストの残りに収まるよう減らされることを確認"""
+    guard = PromptGuard(StubTokenizer(), max_context=20, min_new_tokens=4)
+
+    guarded = guard.check("あ" * 12, max_new_tokens=100)
+    assert (guarded.max_new_tokens, guarded.clamped, guarded.truncated) == (8, True, False)
+
+    guarded = guard.check("あ" * 12, max_new_tokens=5)
+    assert (guarded.max_new_tokens, guarded.clamped) == (5, False)
+
+
+def test_max_prompt_tokens_is_capped_by_context():
+    """max_prompt_tokens はコンテキスト長から min_new_tokens を引いた値を超えないことを確認"""
+    guard = PromptGuard(StubTokenizer(), max_context=100, max_prompt_tokens=500, min_new_tokens=20)
+    assert guard.max_prompt_tokens == 80
+    guard = PromptGuard(StubTokenizer(), max_context=100, max_prompt_tokens=50)
+    assert guard.max_prompt_tokens == 50
+
+
+def test_model_context_length_falls_back_to_default():
+    """モデルの設定からコンテキスト長を取得できない場合は既定値を使うことを確認"""
+    assert model_context_length(StubPipeline(), default=1234) == 1234
@@ -0,0 +1,38 @@
+import pytest
+
+from replicas import LeastOutstandingRouter, ReplicaPool, split_cpus
+
+
+def test_split_cpus_evenly():
+    """CPU が均等に分割されることを確認"""
+    assert split_cpus(range(8), 2) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert split_cpus(range(5), 2) == [[0, 1, 2], [3, 4]]
+    # CPU 数よりグループが多い場合は全 CPU を共有する
+    assert split_cpus([0], 2) == [[0], [0]]
+
+
+def test_least_outstanding_routing():
+    """処理中のリクエストが最も少ないワーカーが選ばれることを確認"""
+    router = LeastOutstandingRouter(3)
+    assert [router.acquire() for _ in range(3)] == [0, 1, 2]
+    router.release(1)
+    assert router.acquire() == 1
+    router.release(0)
+    router.release(2)
+    assert router.acquire() in (0, 2)
+    assert router.completed == [1, 1, 1]
+
+
+def test_unavailable_worker_is_skipped():
+    """終了したワーカーには振り分けられないことを確認"""
+    router = LeastOutstandingRouter(2)
+    router.mark_unavailable(0)
+    assert [router.acquire() for _ in range(3)] == [1, 1, 1]
+
+
+def test_int8_is_rejected_with_multiple_replicas():
+    """int8 の量子化はワーカーごとに重みを作り直し mmap の共有が効かないため、複数レプリカでは拒否することを確認"""
+    with pytest.raises(ValueError):
+        ReplicaPool("model", num_replicas=2, precision="int8")
+    assert ReplicaPool("model", num_replicas=1, precision="int8").dtype == "float32"
+    assert ReplicaPool("model", num_replicas=2, precision="bf16").dtype == "bfloat16"
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from concurrency import DeadlineExceededError, QueueFullError
+from scheduler import CostAwareScheduler, estimate_cost
+
+
+def run_jobs(scheduler, jobs, hold=0.01, gap=0.0):
+    """最初のジョブで枠を埋めてから残りを gap 秒おきに投入し、実行された順番を返す"""
+    order = []
+
+    async def job(name, client, max_new_tokens):
+        async with scheduler.slot(client, 0, max_new_tokens):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def run():
+        tasks = []
+        for spec in jobs:
+            tasks.append(asyncio.ensure_future(job(*spec)))
+            await asyncio.sleep(gap)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    return order
+
+
+def test_estimate_cost_weights_decode_tokens():
+    """デコードトークンがプロンプトのトークンより重く数えられることを確認"""
+    assert estimate_cost(100, 10) < estimate_cost(10, 100)
+
+
+def test_shortest_job_first():
+    """同じクライアントでは max_new_tokens の小さいリクエストが先に実行されることを確認"""
+    scheduler = CostAwareScheduler(max_active=1, aging_rate=0)
+    order = run_jobs(scheduler, [("first", "a", 10), ("long", "a", 2048), ("short", "a", 16)])
+    assert order == ["first", "short", "long"]
+    assert scheduler.stats["reordered"] == 1
+
+
+def test_aging_prevents_starvation():
+    """待ち時間が長くなると大きいリクエストも先に実行されることを確認"""
+    scheduler = CostAwareScheduler(max_active=1, aging_rate=1e6)
+    order = run_jobs(scheduler, [("first", "a", 10), ("long", "a", 2048), ("short", "a", 16)], hold=0.02, gap=0.005)
+    assert order == ["first", "long", "short"]
+
+
+def test_fair_queuing_between_clients():
+    """大量に送るクライアントがいても、他のクライアントのリクエストが交互に実行されることを確認"""
+    scheduler = CostAwareScheduler(max_active=1, aging_rate=0)
+    jobs = [("first", "heavy", 10)] + [(f"heavy{i}", "heavy", 10) for i in range(3)] + [("light0", "light", 10)]
+    order = run_jobs(scheduler, jobs)
+    assert order.index("light0") <= 2
+
+
+def test_outstanding_token_cap():
+    """実行中の max_new_tokens の合計が上限を超えないことを確認"""
+    scheduler = CostAwareScheduler(max_active=8, max_outstanding_tokens=100, aging_rate=0)
+    peak = []
+
+    async def job(max_new_tokens):
+        async with scheduler.slot("a", 0, max_new_tokens):
+            peak.append(scheduler.outstanding_tokens)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(job(40) for _ in range(5)), job(500))
+
+    asyncio.run(run())
+    # 上限を超える1件は単独で実行される
+    assert max(peak) == 500
+    assert max(p for p in peak if p != 500) <= 100
+    assert scheduler.active == 0 and scheduler.outstanding_tokens == 0
+
+
+def test_queue_full_and_deadline():
+    """待ち行列が満杯なら 429、期限までに順番が来なければ DeadlineExceededError になることを確認"""
+    scheduler = CostAwareScheduler(max_active=1, max_waiting=1)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        async with scheduler.slot("a", 0, 10):
+            waiter = asyncio.ensure_future(scheduler.slot("a", 0, 10, deadline=loop.time() + 0.02).__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFullError):
+                async with scheduler.slot("b", 0, 10):
+                    pass
+            with pytest.raises(DeadlineExceededError):
+                await waiter
+        assert scheduler.waiting == 0
+
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+import sessions
+from sessions import SessionStore, common_prefix_length, render_chat_prompt
+from stub_model import StubTokenizer
+
+
+def test_take_removes_entry_until_put_back():
+    """取り出したセッションは生成中に他のリクエストと共有されないよう、ストアから外れることを確認"""
+    store = SessionStore(max_bytes=100)
+    store.put("s1", [1, 2, 3], "kv-a", nbytes=10)
+
+    assert store.take("s1") == ([1, 2, 3], "kv-a")
+    assert store.take("s1") == (None, None)
+    assert store.total_bytes == 0
+
+
+def test_memory_bounded_lru_eviction():
+    """バイト数の上限を超えると最も古く使われたセッションが削除されることを確認"""
+    store = SessionStore(max_bytes=25)
+    store.put("a", [1], "kv-a", nbytes=10)
+    store.put("b", [2], "kv-b", nbytes=10)
+    tokens, value = store.take("a")          # a を使ってから戻す（最近使ったことになる）
+    store.put("a", tokens, value, nbytes=10)
+    store.put("c", [3], "kv-c", nbytes=10)   # b が追い出される
+
+    assert len(store) == 2
+    assert store.total_bytes == 20
+    assert store.evictions == 1
+    assert store.take("b") == (None, None)
+    assert store.take("a") == ([1], "kv-a")
+
+
+def test_entry_larger_than_limit_is_not_stored():
+    """上限を超える大きさのキャッシュは保存されないことを確認"""
+    store = SessionStore(max_bytes=10)
+
+    assert store.put("big", [1], "kv", nbytes=11) is False
+    assert len(store) == 0
+
+
+def test_idle_sessions_expire(monkeypatch):
+    """idle_timeout より長く使われなかったセッションが削除されることを確認"""
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "monotonic", lambda: now[0])
+    store = SessionStore(max_bytes=100, idle_timeout=60)
+    store.put("old", [1], "kv-old", nbytes=10)
+    now[0] += 30
+    store.put("new", [2], "kv-new", nbytes=10)
+    now[0] += 40  # old は 70 秒、new は 40 秒使われていない
+
+    assert store.stats()["sessions"] == 1
+    assert store.expirations == 1
+    assert store.take("old") == (None, None)
+    assert store.take("new") == ([2], "kv-new")
+
+
+def test_delete_session():
+    """delete でセッションのキャッシュを破棄できることを確認"""
+    store = SessionStore(max_bytes=100)
+    store.put("s1", [1], "kv", nbytes=10)
+
+    assert store.delete("s1") is True
+    assert store.delete("s1") is False
+    assert store.total_bytes == 0
+
+
+def test_common_prefix_length():
+    """前のターンのトークン列と新しいプロンプトの共通部分の長さを確認"""
+    assert common_prefix_length([1, 2, 3], [1, 2, 3, 4, 5]) == 3
+    assert common_prefix_length([1, 2, 9, 4], [1, 2, 3, 4]) == 2
+    assert common_prefix_length([], [1, 2]) == 0
+
+
+def test_render_chat_prompt_uses_chat_template():
+    """チャットテンプレートを持つトークナイザーでは apply_chat_template の結果を使うことを確認"""
+    class TemplateTokenizer:
+        chat_template = "..."
+
+        def apply_chat_template(self, messages, tokenize, add_generation_prompt):
+            assert tokenize is False and add_generation_prompt is True
+            return "".join(f"<{m['role']}>{m['content']}" for m in messages) + "<model>"
+
+    messages = [{"role": "user", "content": "こんにちは"}]
+    assert render_chat_prompt(TemplateTokenizer(), messages) == "<user>こんにちは<model>"
+
+
+def test_render_chat_prompt_keeps_earlier_turns_as_prefix():
+    """テンプレートが無い場合も、ターンを追加したプロンプトが前のプロンプトの続きになることを確認"""
+    tokenizer = StubTokenizer()
+    first = [{"role": "user", "content": "こんにちは"}]
+    second = first + [{"role": "assistant", "content": "はい"}, {"role": "user", "content": "元気?"}]
+
+    prompt = render_chat_prompt(tokenizer, first)
+    assert prompt.endswith("assistant: ")
+    assert render_chat_prompt(tokenizer, second).startswith(prompt)
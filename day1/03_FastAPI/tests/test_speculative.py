@@ -0,0 +1,50 @@
+from speculative import ForwardCounter, acceptance_stats
+
+
+class FakeHandle:
+    def __init__(self, hooks, hook):
+        self.hooks = hooks
+        self.hook = hook
+
+    def remove(self):
+        self.hooks.remove(self.hook)
+
+
+class FakeModule:
+    """register_forward_pre_hook だけを持つ torch.nn.Module の代わり"""
+
+    def __init__(self):
+        self.hooks = []
+
+    def register_forward_pre_hook(self, hook):
+        self.hooks.append(hook)
+        return FakeHandle(self.hooks, hook)
+
+    def __call__(self, *args):
+        for hook in self.hooks:
+            hook(self, args)
+
+
+def test_acceptance_stats():
+    """検証回数を除いた生成トークンが採用数として数えられることを確認"""
+    stats = acceptance_stats(new_tokens=20, verify_steps=8, drafted_tokens=24)
+    assert stats["accepted_tokens"] == 12
+    assert stats["acceptance_rate"] == 0.5
+
+
+def test_acceptance_stats_without_draft():
+    """ドラフトの提案が無い場合でもゼロ除算にならないことを確認"""
+    stats = acceptance_stats(new_tokens=3, verify_steps=5, drafted_tokens=0)
+    assert stats["accepted_tokens"] == 0
+    assert stats["acceptance_rate"] == 0.0
+
+
+def test_forward_counter_removes_hook():
+    """with ブロック内の呼び出しだけが数えられ、終了時にフックが外れることを確認"""
+    module = FakeModule()
+    with ForwardCounter(module) as counter:
+        module()
+        module()
+    module()
+    assert counter.count == 2
+    assert module.hooks == []
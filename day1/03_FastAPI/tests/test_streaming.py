@@ -0,0 +1,80 @@
+import asyncio
+import json
+import queue
+
+from streaming import format_sse, iterate_in_thread, start_generation_thread, StreamTimer
+
+
+class StubStreamer:
+    """TextIteratorStreamer を模したスタブ"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.stop = object()
+
+    def put_text(self, text):
+        self.queue.put(text)
+
+    def end(self):
+        self.queue.put(self.stop)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get(timeout=5)
+            if item is self.stop:
+                return
+            yield item
+
+
+def stub_pipe(prompt, streamer=None, max_new_tokens=4, **kwargs):
+    for token in prompt.split()[:max_new_tokens]:
+        streamer.put_text(token)
+    streamer.end()
+
+
+def collect(streamer):
+    async def run():
+        return [chunk async for chunk in iterate_in_thread(streamer)]
+
+    return asyncio.run(run())
+
+
+def test_format_sse():
+    """SSE 形式のイベント文字列を確認"""
+    event = format_sse({"token": "こんにちは"}, event="done")
+    assert event == 'event: done\ndata: {"token": "こんにちは"}\n\n'
+    assert json.loads(format_sse({"a": 1}).split("data: ")[1]) == {"a": 1}
+
+
+def test_stream_tokens_in_order():
+    """スレッドで生成されたトークンが順番通りに受信できることを確認"""
+    streamer = StubStreamer()
+    thread, errors = start_generation_thread(stub_pipe, "a b c d e", streamer, {"max_new_tokens": 3})
+    assert collect(streamer) == ["a", "b", "c"]
+    thread.join(timeout=5)
+    assert errors == []
+
+
+def test_stream_ends_on_generation_error():
+    """生成中の例外でストリームが終了し、例外が記録されることを確認"""
+
+    def failing_pipe(prompt, streamer=None, **kwargs):
+        streamer.put_text("x")
+        raise RuntimeError("生成失敗")
+
+    streamer = StubStreamer()
+    thread, errors = start_generation_thread(failing_pipe, "a", streamer, {})
+    assert collect(streamer) == ["x"]
+    thread.join(timeout=5)
+    assert isinstance(errors[0], RuntimeError)
+
+
+def test_stream_timer_summary():
+    """最初のトークンまでの時間とトークン毎秒が計算されることを確認"""
+    timer = StreamTimer()
+    assert timer.summary(0)["time_to_first_token"] is None
+    timer.mark_token()
+    stats = timer.summary(10)
+    assert stats["time_to_first_token"] >= 0
+    assert stats["response_time"] >= stats["time_to_first_token"]
+    assert stats["generated_tokens"] == 10
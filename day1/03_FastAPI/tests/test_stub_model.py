@@ -0,0 +1,38 @@
+from stub_model import StubPipeline
+
+
+class RecordingStreamer:
+    def __init__(self):
+        self.chunks = []
+        self.ended = False
+
+    def on_finalized_text(self, text, stream_end=False):
+        self.chunks.append(text)
+        self.ended = stream_end
+
+
+def test_stub_output_is_deterministic():
+    """同じプロンプトには常に同じ応答を max_new_tokens 文字で返すことを確認"""
+    pipe = StubPipeline()
+    first = pipe("こんにちは", max_new_tokens=8)[0]["generated_text"]
+    second = StubPipeline()("こんにちは", max_new_tokens=8)[0]["generated_text"]
+    assert first == second
+    assert first.startswith("こんにちは")
+    assert len(pipe.tokenizer.encode(first)) == len("こんにちは") + 8
+
+
+def test_stub_batch_matches_single():
+    """バッチ呼び出しでも単一呼び出しと同じ応答になることを確認"""
+    pipe = StubPipeline()
+    batch = pipe(["a", "b"], max_new_tokens=4, batch_size=2)
+    assert batch == [pipe("a", max_new_tokens=4), pipe("b", max_new_tokens=4)]
+
+
+def test_stub_streams_each_token():
+    """ストリーマにトークンを1つずつ渡し、最後に終了を通知することを確認"""
+    pipe = StubPipeline()
+    streamer = RecordingStreamer()
+    outputs = pipe("prompt", max_new_tokens=5, streamer=streamer, return_full_text=False)
+    assert "".join(streamer.chunks) == outputs[0]["generated_text"]
+    assert len(streamer.chunks) == 6
+    assert streamer.ended
@@ -0,0 +1,54 @@
+import time
+
+from stub_model import StubPipeline
+from timing import ChromeTraceRecorder, GenerationTimer, RequestTimings, format_server_timing, run_timed
+
+
+def test_generation_timer_splits_prefill_and_decode():
+    """2回目の put（最初の生成トークン）で prefill と decode が分かれることを確認"""
+    timer = GenerationTimer()
+    timer.start()
+    timer.put("prompt ids")
+    time.sleep(0.01)
+    timer.put("token 1")
+    time.sleep(0.01)
+    timer.put("token 2")
+    timer.end()
+
+    timings = RequestTimings()
+    timings.add_generation(timer.started, timer)
+    durations = timings.durations()
+    assert durations["prefill"] >= 0.01
+    assert durations["decode"] >= 0.01
+    assert durations["queue"] == 0
+
+
+def test_run_timed_with_text_streaming_pipeline():
+    """テキスト単位で通知するパイプラインでも最初のトークンの時刻が記録されることを確認"""
+    pipe = StubPipeline(token_delay=0.002)
+    outputs, timer = run_timed(pipe, "prompt", max_new_tokens=5)
+    assert outputs[0]["generated_text"].startswith("prompt")
+    assert timer.started < timer.first_token < timer.finished
+
+
+def test_server_timing_header_format():
+    """Server-Timing ヘッダがフェーズ順にミリ秒で出力されることを確認"""
+    header = format_server_timing({"decode": 0.5, "tokenize": 0.001})
+    assert header == "tokenize;dur=1.00, decode;dur=500.00"
+
+
+def test_chrome_trace_export():
+    """リクエストごとに全体と各フェーズの complete イベントが記録されることを確認"""
+    recorder = ChromeTraceRecorder(max_events=100)
+    timings = RequestTimings()
+    with timings.phase("tokenize"):
+        pass
+    timings.prompt_tokens = 3
+    recorder.record(timings)
+    recorder.record(timings)
+
+    events = recorder.export()["traceEvents"]
+    assert [event["name"] for event in events] == ["generate", "tokenize", "generate", "tokenize"]
+    assert {event["ph"] for event in events} == {"X"}
+    assert events[0]["tid"] != events[2]["tid"]
+    assert events[0]["args"]["prompt_tokens"] == 3
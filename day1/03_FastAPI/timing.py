@@ -0,0 +1,162 @@
+# timing.py
+"""
+リクエストのフェーズ別の所要時間の計測
+
+/generate の処理を次のフェーズに分けて計測します。
+
+- tokenize: プロンプトのトークン化
+- queue: スケジューラ・マイクロバッチ・スレッドプールでの待ち時間
+- prefill: モデル呼び出しの開始から最初のトークンが生成されるまで
+- decode: 最初のトークンから生成完了まで
+- postprocess: 生成文のデコード・応答の抽出・トークン数の集計
+
+prefill / decode の境目は、generate に streamer として渡した GenerationTimer が受け取る
+トークンの時刻から求めます。レプリカモードではトークンごとの通知が無いため、全体が prefill になります。
+計測結果は Server-Timing ヘッダや Chrome のトレース形式（chrome://tracing, Perfetto）で出力できます。
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PHASES = ("tokenize", "queue", "prefill", "decode", "postprocess")
+
+
+class GenerationTimer:
+    """
+    generate の streamer として渡し、生成開始・最初のトークン・生成完了の時刻を記録する
+
+    transformers の streamer は最初にプロンプトのトークン列、その後は生成したトークンを put で受け取ります。
+    """
+
+    def __init__(self):
+        self.started = None
+        self.first_token = None
+        self.finished = None
+        self._puts = 0
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def put(self, value):
+        self._puts += 1
+        if self._puts == 2 and self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def end(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    def on_finalized_text(self, text, stream_end=False):
+        # テキスト単位で通知するパイプライン（スタブ・レプリカ）用
+        if text and self.first_token is None:
+            self.first_token = time.perf_counter()
+        if stream_end:
+            self.end()
+
+
+def run_timed(fn, *args, **kwargs):
+    """
+    fn(*args, streamer=GenerationTimer(), **kwargs) を実行する
+
+    Returns:
+        tuple: (fn の戻り値, GenerationTimer)
+    """
+    timer = GenerationTimer()
+    timer.start()
+    result = fn(*args, streamer=timer, **kwargs)
+    timer.end()
+    return result, timer
+
+
+class RequestTimings:
+    """1リクエストのフェーズごとの開始・終了時刻（time.perf_counter() 基準）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []  # (フェーズ名, 開始, 終了)
+        self.prompt_tokens = None
+        self.output_tokens = None
+
+    def add(self, name, start, end):
+        if start is not None and end is not None:
+            self.spans.append((name, start, max(start, end)))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def add_generation(self, queued_at, timer):
+        """GenerationTimer の時刻から queue / prefill / decode を追加する"""
+        self.add("queue", queued_at, timer.started)
+        first_token = timer.first_token or timer.finished
+        self.add("prefill", timer.started, first_token)
+        self.add("decode", first_token, timer.finished)
+
+    def durations(self):
+        """フェーズ名 -> 所要時間（秒）"""
+        result = {}
+        for name, start, end in self.spans:
+            result[name] = result.get(name, 0.0) + (end - start)
+        return result
+
+    def as_dict(self):
+        durations = self.durations()
+        return {
+            "phases": {name: durations[name] for name in PHASES if name in durations},
+            "total": time.perf_counter() - self.started,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+
+def format_server_timing(durations):
+    """フェーズごとの所要時間（秒）を Server-Timing ヘッダの値（ミリ秒）にする"""
+    return ", ".join(
+        f"{name};dur={durations[name] * 1000:.2f}" for name in PHASES if name in durations
+    )
+
+
+class ChromeTraceRecorder:
+    """リクエストのフェーズを Chrome のトレース形式のイベントとして保持する（古いものから破棄）"""
+
+    def __init__(self, max_events=10000):
+        self.origin = time.perf_counter()
+        self._events = deque(maxlen=max(1, int(max_events)))
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def record(self, timings, name="generate", args=None):
+        """1リクエスト分のフェーズを、リクエストごとの行（tid）に記録する"""
+        tid = next(self._ids)
+        end = max((span[2] for span in timings.spans), default=timings.started)
+        events = [self._event(name, timings.started, end, tid, dict(args or {}, **{
+            "prompt_tokens": timings.prompt_tokens, "output_tokens": timings.output_tokens,
+        }))]
+        events.extend(self._event(phase, start, stop, tid) for phase, start, stop in timings.spans)
+        with self._lock:
+            self._events.extend(events)
+
+    def _event(self, name, start, end, tid, args=None):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": 1,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        return event
+
+    def export(self):
+        """Chrome のトレース形式（JSON オブジェクト）を返す"""
+        with self._lock:
+            return {"traceEvents": list(self._events), "displayTimeUnit": "ms"}